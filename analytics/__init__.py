@@ -0,0 +1,48 @@
+# analytics/__init__.py
+"""
+ポートフォリオ分析（Streamlit に依存しない関数群）。
+
+各関数は sqlite3.Connection（db.get_pool(...).read() で借りたものなど）を最初の引数に取り、
+DataFrame / dict を返すだけで画面の描画はしない。
+画面（management_page.py・pages/）・バッチ・ベンチマークから同じ関数を呼ぶ。
+
+    from analytics import quarter_performance
+    with get_pool(db_path).read() as conn:
+        df = quarter_performance(conn, date.today())
+"""
+from analytics.drops import drop_report, flagged_drops, judgement_history
+from analytics.performance import (
+    determine_quarter_periods,
+    performance_table,
+    prev_positions_asof,
+    quarter_performance,
+    replay_quarter,
+    transactions_period,
+)
+from analytics.positions import (
+    current_positions,
+    current_prices,
+    holdings_asof,
+    latest_moving_averages,
+    securities,
+)
+from analytics.snapshots import period_snapshots, prev_positions_quarter
+
+__all__ = [
+    "current_positions",
+    "current_prices",
+    "determine_quarter_periods",
+    "drop_report",
+    "flagged_drops",
+    "holdings_asof",
+    "judgement_history",
+    "latest_moving_averages",
+    "performance_table",
+    "period_snapshots",
+    "prev_positions_asof",
+    "prev_positions_quarter",
+    "quarter_performance",
+    "replay_quarter",
+    "securities",
+    "transactions_period",
+]
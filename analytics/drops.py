@@ -0,0 +1,23 @@
+# analytics/drops.py
+"""四半期スナップショットに対する下落判定（判定ロジックは drop_detection）。"""
+import sqlite3
+
+import pandas as pd
+
+from analytics.snapshots import period_snapshots
+from drop_detection import detect_drops, flagged
+
+def drop_report(conn: sqlite3.Connection) -> pd.DataFrame:
+    """
+    positions_quarter 全体に drop_detection.detect_drops を適用した結果
+    （prev_market_price / price_drop_rate / drop_30pct / drop_50pct / 下落理由 などの列付き）。
+    """
+    return detect_drops(period_snapshots(conn, "quarter"))
+
+def flagged_drops(conn: sqlite3.Connection) -> pd.DataFrame:
+    """drop_report のうち 50％下落または 30％連続下落の行。"""
+    return flagged(drop_report(conn))
+
+def judgement_history(conn: sqlite3.Connection) -> pd.DataFrame:
+    """drop_judgement に保存済みの判定結果。"""
+    return pd.read_sql_query("SELECT * FROM drop_judgement", conn)
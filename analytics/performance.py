@@ -0,0 +1,198 @@
+# analytics/performance.py
+"""
+四半期の投資パフォーマンス（前期末の保有に当期取引を反映した平均単価・評価損益）。
+前期末の保有は positions_quarter（管理画面で編集できる四半期集計）を使う。
+"""
+import sqlite3
+from datetime import date, timedelta
+
+import pandas as pd
+
+from analytics.positions import current_prices, holdings_asof, latest_moving_averages
+from analytics.snapshots import prev_positions_quarter
+from price_asof import AsofIndex
+
+# performance_table の列順
+PERFORMANCE_COLUMNS = [
+    "security_code",
+    "security_name",
+    "prev_avg_cost",
+    "latest_avg_cost",
+    "latest_moving_average",
+    "pct_change",
+    "latest_holding_qty",
+    "current_price",
+    "unrealized_PL",
+]
+
+# ─────────────────────────────
+# 1. 期間
+# ─────────────────────────────
+def determine_quarter_periods(today: date):
+    """
+    today の年月日から
+    - prev_year (文字列)
+    - prev_quarter (例: 'Q1','Q2','Q3','Q4')
+    - current_start: 当期四半期の開始日 (date)
+    - current_end: today (date)
+    を返却する。
+    """
+    year, month = today.year, today.month
+    if month <= 3:       # 1〜3月 → Q1
+        prev_year, prev_quarter = year - 1, "Q4"
+        current_start = date(year, 1, 1)
+    elif month <= 6:     # 4〜6月 → Q2
+        prev_year, prev_quarter = year, "Q1"
+        current_start = date(year, 4, 1)
+    elif month <= 9:     # 7〜9月 → Q3
+        prev_year, prev_quarter = year, "Q2"
+        current_start = date(year, 7, 1)
+    else:                # 10〜12月 → Q4
+        prev_year, prev_quarter = year, "Q3"
+        current_start = date(year, 10, 1)
+
+    return str(prev_year), prev_quarter, current_start, today
+
+# ─────────────────────────────
+# 2. 前期末の保有・当期取引
+# ─────────────────────────────
+def prev_positions_asof(conn: sqlite3.Connection, prev_end: date) -> pd.DataFrame:
+    """
+    prev_end（前期末日）時点の保有を取引台帳から復元し、analytics.snapshots.prev_positions_quarter と同じ形
+    （index = security_code、security_name / prev_holding_qty / prev_avg_cost）で返す。保有数が 0 の銘柄は含まない。
+
+    positions_quarter を使わない場合の参照用（quarter_performance では使わない）。
+    positions_quarter と違い、管理画面での手修正は反映されず、期末終値が無い銘柄も含む。
+    """
+    df = holdings_asof(conn, prev_end)
+    df = df[df["holding_qty"] > 0]
+    return df.set_index("security_code").rename(
+        columns={"holding_qty": "prev_holding_qty", "avg_cost": "prev_avg_cost"}
+    )[["security_name", "prev_holding_qty", "prev_avg_cost"]]
+
+def transactions_period(conn: sqlite3.Connection, start_date: date, end_date: date) -> pd.DataFrame:
+    """
+    当期四半期の取引 transactions を取得する。
+    期間内に取引がない場合は空の DataFrame を返す。
+    txn_date を DATE() で包むとインデックスが使えないため、
+    「start_date 以上・end_date の翌日未満」の範囲条件で絞り込む。
+    """
+    q = """
+        SELECT
+            t.txn_type, t.quantity, t.price, DATE(t.txn_date) AS txn_date,
+            s.security_code, s.security_name
+        FROM transactions t
+        JOIN securities s ON t.security_id = s.security_id
+        WHERE t.txn_date >= ? AND t.txn_date < ?
+        ORDER BY t.txn_date, t.transaction_id
+    """
+    end_exclusive = end_date + timedelta(days=1)
+    df = pd.read_sql_query(q, conn, params=(start_date.isoformat(), end_exclusive.isoformat()))
+    if df.empty:
+        cols = ["txn_type", "quantity", "price", "txn_date", "security_code", "security_name"]
+        return pd.DataFrame(columns=cols)
+    df["txn_date"] = pd.to_datetime(df["txn_date"]).dt.date
+    return df
+
+# ─────────────────────────────
+# 3. 前期残高＋当期取引の再生（銘柄ごとのループなし）
+# ─────────────────────────────
+def replay_quarter(df_prev: pd.DataFrame, df_txn: pd.DataFrame) -> pd.DataFrame:
+    """
+    前期末の保有（df_prev）に当期取引（df_txn, 銘柄内で日付順）を反映し、
+    security_code を index とした
+    security_name / prev_holding_qty / prev_avg_cost / latest_holding_qty / latest_avg_cost
+    の DataFrame を返す。
+
+    BUY は cost += 数量×単価、SEL は cost -= 数量×直前平均単価 なので、
+    SEL 1 件は cost に (売却後数量 / 売却前数量) を掛けるのと同じ。
+    したがって最終 cost は「各 BUY 額 × それ以降の係数の積」の総和となり、
+    groupby の cumsum / cumprod だけで計算できる（係数 0 = 全量売却で区間を切る）。
+    """
+    prev = df_prev[["security_name", "prev_holding_qty", "prev_avg_cost"]].astype(
+        {"prev_holding_qty": float, "prev_avg_cost": float}
+    )
+    txn_names = df_txn.groupby("security_code", sort=False)["security_name"].first()
+    codes = prev.index.union(pd.Index(txn_names.index)).sort_values()
+
+    out = pd.DataFrame(index=pd.Index(codes, name="security_code"))
+    out["security_name"] = prev["security_name"].combine_first(txn_names).reindex(codes)
+    out["prev_holding_qty"] = prev["prev_holding_qty"].reindex(codes).fillna(0.0)
+    out["prev_avg_cost"] = prev["prev_avg_cost"].reindex(codes).fillna(0.0)
+    prev_cost = out["prev_holding_qty"] * out["prev_avg_cost"]
+
+    latest_qty = out["prev_holding_qty"].copy()
+    latest_cost = prev_cost.copy()
+
+    if not df_txn.empty:
+        t = df_txn[["security_code", "txn_type", "quantity", "price"]].reset_index(drop=True)
+        t["quantity"] = t["quantity"].astype(float)
+        t["price"] = t["price"].astype(float)
+        is_buy = t["txn_type"].eq("BUY")
+        is_sel = t["txn_type"].eq("SEL")
+        g = t.groupby("security_code", sort=False)
+
+        # 数量の推移
+        signed = t["quantity"].where(is_buy, -t["quantity"].where(is_sel, 0.0))
+        qty_after = out["prev_holding_qty"].reindex(t["security_code"]).to_numpy() + signed.groupby(t["security_code"]).cumsum()
+        qty_before = qty_after - signed
+
+        # cost_k = factor_k × cost_{k-1} + buy_k
+        factor = (qty_after / qty_before.where(qty_before != 0)).where(is_sel & (qty_before != 0), 1.0)
+        buy = (t["quantity"] * t["price"]).where(is_buy, 0.0)
+
+        # 全量売却（係数 0）以降を新しい区間とし、区間内の係数の累積積を取る
+        reset = factor.eq(0)
+        segment = reset.astype(int).groupby(t["security_code"]).cumsum()
+        cumfactor = factor.where(~reset, 1.0).groupby([t["security_code"], segment]).cumprod()
+
+        last = g.tail(1).index
+        last_code = t.loc[last, "security_code"].to_numpy()
+        last_segment = pd.Series(segment[last].to_numpy(), index=last_code)
+        last_cumfactor = pd.Series(cumfactor[last].to_numpy(), index=last_code)
+
+        in_last = segment.to_numpy() == last_segment.reindex(t["security_code"]).to_numpy()
+        contrib = (buy / cumfactor * last_cumfactor.reindex(t["security_code"]).to_numpy()).where(in_last, 0.0)
+        cost = contrib.groupby(t["security_code"]).sum()
+        # 区間が切れていなければ前期末 cost も係数の積だけ残る
+        carried = prev_cost.reindex(last_code).to_numpy() * last_cumfactor.where(last_segment == 0, 0.0)
+        cost = cost.reindex(last_code) + carried
+
+        latest_qty.loc[last_code] = qty_after[last].to_numpy()
+        latest_cost.loc[last_code] = cost.to_numpy()
+
+    out["latest_holding_qty"] = latest_qty
+    out["latest_avg_cost"] = (latest_cost / latest_qty.where(latest_qty != 0)).fillna(0.0)
+    return out
+
+# ─────────────────────────────
+# 4. 指標
+# ─────────────────────────────
+def performance_table(df_prev: pd.DataFrame, df_txn: pd.DataFrame,
+                      price_map: dict[str, float], ma_map: dict[str, float]) -> pd.DataFrame:
+    """
+    replay_quarter の結果に最新移動平均・平均単価の変化率（%）・現在値・評価損益を加え、
+    PERFORMANCE_COLUMNS の列で返す。
+    """
+    df_result = replay_quarter(df_prev, df_txn)
+    df_result["latest_moving_average"] = df_result.index.map(ma_map)
+    df_result["pct_change"] = (
+        (df_result["latest_avg_cost"] - df_result["prev_avg_cost"])
+        / df_result["prev_avg_cost"].where(df_result["prev_avg_cost"] != 0) * 100
+    )
+    df_result["current_price"] = df_result.index.map(price_map)
+    df_result["unrealized_PL"] = (
+        (df_result["current_price"] - df_result["latest_avg_cost"]) * df_result["latest_holding_qty"]
+    )
+    return df_result.reset_index()[PERFORMANCE_COLUMNS]
+
+def quarter_performance(conn: sqlite3.Connection, today: date,
+                        index: AsofIndex | None = None) -> pd.DataFrame:
+    """today を含む四半期の performance_table（前期末の保有 + 当期取引、today 以前の直近終値）。"""
+    prev_year, prev_quarter, current_start, current_end = determine_quarter_periods(today)
+    return performance_table(
+        prev_positions_quarter(conn, prev_year, prev_quarter),
+        transactions_period(conn, current_start, current_end),
+        current_prices(conn, today, index),
+        latest_moving_averages(conn),
+    )
@@ -0,0 +1,74 @@
+# analytics/positions.py
+"""銘柄一覧・現在ポジション・任意の日付時点の保有・直近終値・最新移動平均。"""
+import sqlite3
+from datetime import date
+
+import pandas as pd
+
+from position_ledger import moving_average, positions_asof
+from price_asof import AsofIndex, build_index
+
+def securities(conn: sqlite3.Connection) -> pd.DataFrame:
+    """securities の (security_id, security_code, security_name)（銘柄コード順）。"""
+    return pd.read_sql_query(
+        "SELECT security_id, security_code, security_name FROM securities ORDER BY security_code", conn
+    )
+
+def current_positions(conn: sqlite3.Connection) -> pd.DataFrame:
+    """
+    取引のある銘柄の現在ポジション（v_positions = positions_current + securities）。
+    列は d365_code / security_code / security_name / holding_qty / avg_cost / market_price / valuation_diff。
+    """
+    return pd.read_sql_query("SELECT * FROM v_positions ORDER BY security_code", conn)
+
+def holdings_asof(conn: sqlite3.Connection, day: date) -> pd.DataFrame:
+    """
+    day の取引まで反映した時点の保有（position_ledger.positions_asof = 直近チェックポイント + 以降の取引の再生）。
+    列は security_id / security_code / security_name / holding_qty / avg_cost / txn_count（銘柄コード順）。
+    day 以前に取引の無い銘柄は含まない。
+    """
+    states = positions_asof(conn, day)
+    names = securities(conn).set_index("security_id")
+    df = pd.DataFrame(
+        [(sid, qty, moving_average(qty, cost), count) for sid, (qty, cost, count) in states.items()],
+        columns=["security_id", "holding_qty", "avg_cost", "txn_count"],
+    )
+    df = df.join(names, on="security_id")
+    return df[["security_id", "security_code", "security_name", "holding_qty", "avg_cost", "txn_count"]] \
+        .sort_values("security_code", ignore_index=True)
+
+def current_prices(conn: sqlite3.Connection, quote_date: date,
+                   index: AsofIndex | None = None) -> dict[str, float]:
+    """
+    quote_date 以前の直近終値（週末・休日なら前営業日まで遡る）を
+    { '7203': 3075.5, ... } の辞書で返す。
+    index（price_asof.get_asof_index の結果など）を渡せばそれを使い、無ければ conn から作る。
+    """
+    index = index if index is not None else build_index(conn)
+    prices = index.asof(quote_date)
+    codes = dict(conn.execute("SELECT security_id, security_code FROM securities"))
+    return {codes[sid]: price for sid, price in prices.items() if sid in codes}
+
+def latest_moving_averages(conn: sqlite3.Connection) -> dict[str, float]:
+    """
+    銘柄ごとに最新（txn_date, transaction_id が最大）の moving_average を取得し、
+    { '7203': 2875.0, ... } の辞書を返す。moving_average が NULL の行は対象外。
+    """
+    query = """
+        SELECT security_code, moving_average
+        FROM (
+            SELECT
+                s.security_code,
+                t.moving_average,
+                ROW_NUMBER() OVER (
+                    PARTITION BY t.security_id
+                    ORDER BY t.txn_date DESC, t.transaction_id DESC
+                ) AS rn
+            FROM transactions t
+            JOIN securities s ON t.security_id = s.security_id
+            WHERE t.moving_average IS NOT NULL
+        )
+        WHERE rn = 1
+    """
+    df = pd.read_sql_query(query, conn)
+    return dict(zip(df["security_code"], df["moving_average"]))
@@ -0,0 +1,46 @@
+# analytics/snapshots.py
+"""期末ポジションのスナップショット（positions_quarter / positions_halfyear）の読み出し。"""
+import sqlite3
+
+import pandas as pd
+
+from snapshots import SNAPSHOT_KINDS
+
+def period_snapshots(conn: sqlite3.Connection, kind: str = "quarter",
+                     year: str | None = None, period: str | None = None) -> pd.DataFrame:
+    """
+    kind（'quarter' / 'halfyear'）のスナップショットを返す。
+    year / period（'Q1' / 'H1' など）を指定すればその期だけに絞る。
+    """
+    table, column, _, _ = SNAPSHOT_KINDS[kind]
+    where, params = [], []
+    if year is not None:
+        where.append("year = ?")
+        params.append(str(year))
+    if period is not None:
+        where.append(f"{column} = ?")
+        params.append(period)
+    sql = f"SELECT * FROM {table}" + (f" WHERE {' AND '.join(where)}" if where else "")
+    return pd.read_sql_query(sql, conn, params=params)
+
+def prev_positions_quarter(conn: sqlite3.Connection, prev_year: str, prev_quarter: str) -> pd.DataFrame:
+    """
+    前期の positions_quarter を読み込む。
+    テーブルが空の場合は空の DataFrame を返す。
+    戻り値は index を security_code にした
+    security_name / prev_holding_qty / prev_avg_cost の DataFrame。
+    """
+    q = """
+        SELECT
+            security_code,
+            security_name,
+            holding_qty   AS prev_holding_qty,
+            avg_cost      AS prev_avg_cost
+        FROM positions_quarter
+        WHERE year = ? AND quarter = ?
+    """
+    df = pd.read_sql_query(q, conn, params=(prev_year, prev_quarter))
+    if df.empty:
+        cols = ["security_name", "prev_holding_qty", "prev_avg_cost"]
+        return pd.DataFrame(columns=cols, index=pd.Index([], name="security_code"))
+    return df.set_index("security_code")
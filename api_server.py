@@ -0,0 +1,305 @@
+# api_server.py
+"""
+保有・取引・下落判定を JSON で返すローカル HTTP サーバ（asyncio、外部ライブラリなし）。
+
+    GET /version                       … {"data_version": n}
+    GET /positions                     … 現在ポジション（v_positions）
+    GET /positions?date=YYYY-MM-DD     … その日の取引まで反映した保有（取引台帳のチェックポイントから復元）
+    GET /performance?date=YYYY-MM-DD   … 四半期の投資パフォーマンス（management_page と同じ計算、既定: 今日）
+    GET /transactions?start=&end=&code=&page=&page_size=
+                                       … 取引一覧（新しい順、ページング）
+    GET /drops?flagged=1               … 四半期ごとの下落判定（flagged=1 で 50％下落・連続下落のみ）
+    GET /drops/judgements              … drop_judgement に保存済みの判定
+
+- 応答は (パス, クエリ) ごとにプロセス内でキャッシュし、data_version が変わったら捨てる
+  （書き込みのたびに data_version が増えるので、書き込み後の最初の要求で作り直す）
+- ETag は data_version とクエリから作り、If-None-Match が一致すれば 304 を返す
+- 集計はスレッドで実行し、同じキーの同時要求は 1 回の計算を待ち合わせる
+- HTTP/1.1 の keep-alive に対応
+
+    python api_server.py --port 8765
+    curl -s localhost:8765/positions
+"""
+import argparse
+import asyncio
+import json
+import zlib
+from datetime import date, timedelta
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+import pandas as pd
+
+from analytics import (
+    current_positions,
+    drop_report,
+    flagged_drops,
+    holdings_asof,
+    judgement_history,
+    quarter_performance,
+)
+from data_version import get_data_version
+from db import get_pool
+from price_asof import get_asof_index
+from transaction_queries import PAGE_SIZE, count_transactions, fetch_transactions
+
+DB = "app.db"
+HOST = "127.0.0.1"
+PORT = 8765
+
+# /transactions の 1 ページの上限
+MAX_PAGE_SIZE = 1000
+# キャッシュする応答の上限（超えたら古いものから捨てる）
+MAX_CACHE_ENTRIES = 1024
+# keep-alive 接続で次の要求を待つ秒数
+KEEPALIVE_TIMEOUT = 15.0
+# 要求ヘッダの上限（バイト）
+MAX_HEADER_BYTES = 16 * 1024
+
+# /transactions で返す列（別名 t = transactions, s = securities）
+TRANSACTION_COLUMNS = """
+    t.transaction_id,
+    t.txn_date,
+    t.txn_type,
+    t.quantity,
+    t.price,
+    t.moving_average,
+    COALESCE(s.security_code, '不明') AS security_code,
+    COALESCE(s.security_name, '不明') AS security_name
+"""
+
+STATUS_TEXT = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+               405: "Method Not Allowed", 431: "Request Header Fields Too Large",
+               500: "Internal Server Error"}
+
+# ─────────────────────────────
+# 1. エンドポイント（conn と クエリ → JSON にできる値）
+# ─────────────────────────────
+def _records(df: pd.DataFrame) -> list[dict]:
+    # NaN → null、日付 → ISO 形式の文字列
+    return json.loads(df.to_json(orient="records", force_ascii=False, date_format="iso"))
+
+def _date_param(params: dict, name: str, default: date) -> date:
+    value = params.get(name)
+    try:
+        return date.fromisoformat(value) if value else default
+    except ValueError:
+        raise ValueError(f"{name} は YYYY-MM-DD で指定してください: {value}") from None
+
+def _int_param(params: dict, name: str, default: int, low: int, high: int) -> int:
+    value = params.get(name)
+    try:
+        number = int(value) if value else default
+    except ValueError:
+        raise ValueError(f"{name} は整数で指定してください: {value}") from None
+    if not low <= number <= high:
+        raise ValueError(f"{name} は {low}〜{high} で指定してください: {number}")
+    return number
+
+def positions_endpoint(conn, params: dict, db_path) -> dict:
+    if params.get("date"):
+        day = _date_param(params, "date", date.today())
+        return {"date": day.isoformat(), "items": _records(holdings_asof(conn, day))}
+    return {"items": _records(current_positions(conn))}
+
+def performance_endpoint(conn, params: dict, db_path) -> dict:
+    day = _date_param(params, "date", date.today())
+    df = quarter_performance(conn, day, get_asof_index(db_path, conn))
+    return {"date": day.isoformat(), "items": _records(df)}
+
+def transactions_endpoint(conn, params: dict, db_path) -> dict:
+    start = _date_param(params, "start", date.min)
+    end = _date_param(params, "end", date.max - timedelta(days=1))
+    code = params.get("code") or None
+    page = _int_param(params, "page", 1, 1, 10**9)
+    page_size = _int_param(params, "page_size", PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    total = count_transactions(conn, start, end, code)
+    df = fetch_transactions(conn, TRANSACTION_COLUMNS, start, end, code,
+                            limit=page_size, offset=(page - 1) * page_size)
+    return {"total": total, "page": page, "page_size": page_size,
+            "pages": max(1, -(-total // page_size)), "items": _records(df)}
+
+def drops_endpoint(conn, params: dict, db_path) -> dict:
+    df = flagged_drops(conn) if params.get("flagged") in ("1", "true") else drop_report(conn)
+    return {"items": _records(df)}
+
+def judgements_endpoint(conn, params: dict, db_path) -> dict:
+    return {"items": _records(judgement_history(conn))}
+
+ROUTES = {
+    "/positions": positions_endpoint,
+    "/performance": performance_endpoint,
+    "/transactions": transactions_endpoint,
+    "/drops": drops_endpoint,
+    "/drops/judgements": judgements_endpoint,
+}
+
+# ─────────────────────────────
+# 2. 応答キャッシュ
+# ─────────────────────────────
+class ApiApp:
+    """ルーティングと、data_version をキーにした応答キャッシュ。"""
+
+    def __init__(self, db_path=DB):
+        self.db_path = str(Path(db_path).resolve())
+        self.pool = get_pool(self.db_path)
+        self._version = None
+        self._cache: dict[tuple, tuple[str, bytes]] = {}        # key → (ETag, 本文)
+        self._inflight: dict[tuple, asyncio.Future] = {}
+
+    def current_version(self) -> int:
+        """現在の data_version。変わっていればキャッシュを捨てる。"""
+        with self.pool.read() as conn:
+            version = get_data_version(conn)
+        if version != self._version:
+            self._version = version
+            self._cache.clear()
+        return version
+
+    def _compute(self, handler, params: dict) -> tuple[int, bytes]:
+        """
+        (計算に使った data_version, 本文) を返す。
+        data_version の読み取りと集計を 1 つの読み取りトランザクション（同じスナップショット）で行う。
+        """
+        with self.pool.read() as conn:
+            conn.execute("BEGIN")
+            version = get_data_version(conn)
+            payload = handler(conn, params, self.db_path)
+        body = json.dumps({"data_version": version, **payload}, ensure_ascii=False,
+                          separators=(",", ":")).encode("utf-8")
+        return version, body
+
+    async def respond(self, method: str, target: str, headers: dict) -> tuple[int, dict, bytes]:
+        """(ステータス, 追加ヘッダ, 本文) を返す。"""
+        if method not in ("GET", "HEAD"):
+            return _error(405, f"{method} は使えません", {"Allow": "GET, HEAD"})
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        version = self.current_version()
+        if url.path == "/version":
+            return 200, {}, json.dumps({"data_version": version}).encode()
+        handler = ROUTES.get(url.path)
+        if handler is None:
+            return _error(404, f"{url.path} はありません")
+
+        key = (url.path, tuple(sorted(params.items())))
+        cached = self._cache.get(key)
+        if cached is None:
+            # 待ち合わせるのは同じ data_version で始まった計算だけ（書き込み前に始まった計算の結果は使わない）
+            inflight_key = (version, key)
+            future = self._inflight.get(inflight_key)
+            if future is None:
+                future = asyncio.ensure_future(asyncio.to_thread(self._compute, handler, params))
+                self._inflight[inflight_key] = future
+                future.add_done_callback(lambda _: self._inflight.pop(inflight_key, None))
+            try:
+                computed_version, body = await asyncio.shield(future)
+            except ValueError as e:
+                return _error(400, str(e))
+            except Exception as e:
+                return _error(500, f"{type(e).__name__}: {e}")
+            # ETag は実際に読んだ版で作る
+            etag = f'"{computed_version}-{zlib.crc32(repr(key).encode()):08x}"'
+            # 計算中に書き込みがあったときは古い版を載せない
+            if computed_version == self._version:
+                if len(self._cache) >= MAX_CACHE_ENTRIES:
+                    self._cache.pop(next(iter(self._cache)))
+                self._cache[key] = (etag, body)
+            cached = (etag, body)
+
+        etag, body = cached
+        if headers.get("if-none-match") == etag:
+            return 304, {"ETag": etag}, b""
+        return 200, {"ETag": etag}, body
+
+def _error(status: int, message: str, extra: dict | None = None) -> tuple[int, dict, bytes]:
+    return status, extra or {}, json.dumps({"error": message}, ensure_ascii=False).encode("utf-8")
+
+# ─────────────────────────────
+# 3. HTTP（keep-alive）
+# ─────────────────────────────
+def _response(status: int, headers: dict, body: bytes, keep_alive: bool, head_only: bool) -> bytes:
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+    if status != 304:
+        lines.append("Content-Type: application/json; charset=utf-8")
+    lines.append(f"Content-Length: {len(body)}")
+    lines.append("Cache-Control: no-cache")
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    lines += [f"{k}: {v}" for k, v in headers.items()]
+    head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+    return head if head_only or status == 304 else head + body
+
+async def handle_connection(app: ApiApp, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            try:
+                raw = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+            except asyncio.LimitOverrunError:
+                writer.write(_response(*_error(431, "ヘッダが大きすぎます"), False, False))
+                await writer.drain()
+                break
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                break
+
+            request_line, *header_lines = raw.decode("latin-1").rstrip("\r\n").split("\r\n")
+            try:
+                method, target, http_version = request_line.split(" ", 2)
+            except ValueError:
+                writer.write(_response(*_error(400, "不正なリクエストです"), False, False))
+                await writer.drain()
+                break
+            headers = {}
+            for line in header_lines:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            # GET に本文は無い想定だが、付いていれば読み捨てる
+            length = headers.get("content-length") or "0"
+            if not (length.isascii() and length.isdigit()):
+                writer.write(_response(*_error(400, f"Content-Length が不正です: {length}"), False, False))
+                await writer.drain()
+                break
+            length = int(length)
+            if length:
+                await reader.readexactly(length)
+
+            connection = headers.get("connection", "").lower()
+            keep_alive = (connection != "close") if http_version == "HTTP/1.1" else (connection == "keep-alive")
+            status, extra, body = await app.respond(method, target, headers)
+            writer.write(_response(status, extra, body, keep_alive, method == "HEAD"))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(db_path=DB, host: str = HOST, port: int = PORT, ready=None):
+    """サーバを起動して止まるまで待つ。ready(サーバ) を起動直後に呼ぶ（ポート 0 の確認用）。"""
+    app = ApiApp(db_path)
+    server = await asyncio.start_server(
+        lambda r, w: handle_connection(app, r, w), host, port, limit=MAX_HEADER_BYTES
+    )
+    if ready:
+        ready(server)
+    async with server:
+        await server.serve_forever()
+
+# ─────────────────────────────
+# 4. CLI
+# ─────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="保有・取引・下落判定の JSON API サーバ")
+    parser.add_argument("--db", default=DB, help="SQLite ファイルのパス")
+    parser.add_argument("--host", default=HOST, help="待ち受けるアドレス（既定: 127.0.0.1）")
+    parser.add_argument("--port", type=int, default=PORT, help="待ち受けるポート")
+    args = parser.parse_args()
+
+    def ready(server):
+        addr = server.sockets[0].getsockname()
+        print(f"🚀 http://{addr[0]}:{addr[1]}/ で待ち受けています（{args.db}、Ctrl+C で終了）", flush=True)
+
+    try:
+        asyncio.run(serve(args.db, args.host, args.port, ready))
+    except KeyboardInterrupt:
+        print("👋 終了しました。")
@@ -0,0 +1,90 @@
+# benchmarks/bench_drop_detection.py
+"""
+drop_detection.detect_drops のベンチマーク。
+
+銘柄数を増やしながら（既定: 1,250 / 2,500 / 5,000 / 10,000 銘柄 × 40 四半期）
+判定にかかる時間を測り、行あたりの時間がほぼ一定（＝線形）であることを確認する。
+
+    python benchmarks/bench_drop_detection.py
+    python benchmarks/bench_drop_detection.py --securities 1000 10000 --quarters 40
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from drop_detection import detect_drops, flagged  # noqa: E402
+
+# 最大規模での行あたり時間が最小規模の何倍までなら線形とみなすか
+LINEAR_TOLERANCE = 2.0
+
+# ─────────────────────────────
+# 1. データ生成
+# ─────────────────────────────
+def make_quarters(n_securities: int, n_quarters: int, seed: int = 0,
+                  first_year: int = 2015) -> pd.DataFrame:
+    """positions_quarter と同じ形（security_code / year / quarter / market_price）の乱数データ。"""
+    rng = np.random.default_rng(seed)
+    codes = np.repeat(np.arange(1000, 1000 + n_securities).astype(str), n_quarters)
+    periods = np.tile(np.arange(first_year * 4, first_year * 4 + n_quarters), n_securities)
+    # 四半期ごとの騰落率（±60%）を累積した株価。下落判定がある程度出るようにする
+    returns = rng.uniform(-0.6, 0.6, size=(n_securities, n_quarters))
+    prices = 1000 * np.cumprod(1 + returns, axis=1).ravel()
+    df = pd.DataFrame({
+        "security_code": codes,
+        "year": (periods // 4).astype(str),
+        "quarter": pd.Series(periods % 4 + 1).map("Q{}".format),
+        "market_price": prices,
+    })
+    # DB から読んだときと同様に順不同にしておく
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+# ─────────────────────────────
+# 2. 計測
+# ─────────────────────────────
+def bench(n_securities: int, n_quarters: int, repeat: int) -> dict:
+    df = make_quarters(n_securities, n_quarters)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = detect_drops(df)
+        n_flagged = len(flagged(result))
+        best = min(best, time.perf_counter() - start)
+    return {
+        "securities": n_securities,
+        "quarters": n_quarters,
+        "rows": len(df),
+        "flagged": n_flagged,
+        "seconds": best,
+        "us_per_row": best / len(df) * 1e6,
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="下落判定エンジンのベンチマーク")
+    parser.add_argument("--securities", type=int, nargs="+", default=[1250, 2500, 5000, 10000],
+                        help="銘柄数（複数指定可）")
+    parser.add_argument("--quarters", type=int, default=40, help="四半期数")
+    parser.add_argument("--repeat", type=int, default=3, help="各規模の試行回数（最速値を採用）")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'銘柄数':>8} {'行数':>10} {'該当':>8} {'秒':>8} {'µs/行':>8}")
+    for n in sorted(args.securities):
+        r = bench(n, args.quarters, args.repeat)
+        results.append(r)
+        print(f"{r['securities']:>10,} {r['rows']:>12,} {r['flagged']:>10,} "
+              f"{r['seconds']:>10.3f} {r['us_per_row']:>9.2f}")
+
+    ratio = results[-1]["us_per_row"] / results[0]["us_per_row"]
+    if ratio <= LINEAR_TOLERANCE:
+        print(f"✅ 行あたりの時間の比（最大/最小規模）= {ratio:.2f}（線形）")
+        return 0
+    print(f"⚠️ 行あたりの時間の比（最大/最小規模）= {ratio:.2f}（許容 {LINEAR_TOLERANCE}）")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
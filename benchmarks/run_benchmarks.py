@@ -0,0 +1,242 @@
+# benchmarks/run_benchmarks.py
+"""
+各ページのデータ処理のベンチマーク（Streamlit なしで実行できる）。
+
+generate_load_data で規模別の DB を作り（benchmarks/.data/ に保存して再利用）、
+次の処理の所要時間（最速値）と Python のピークメモリ（tracemalloc）を測って
+benchmarks/history.json に追記する。前回の同じ規模の結果と比べて遅くなったものを表示する。
+
+- analytics（management_page が使う集計）: transactions_period / prev_positions_quarter /
+  prev_positions_asof / holdings_asof / current_prices / latest_moving_averages / replay_quarter / drop_report
+  （過去の記録と比べられるよう、処理名は以前の load_* の名前のまま）
+- drop_detection.detect_drops
+- price_asof: 直近終値の索引の作成
+- price_matrix: 終値行列の全件作成 / 行列から四半期末終値を切り出して下落判定
+- snapshots.generate_snapshots / update_moving_average.update_all_moving_averages
+
+    python benchmarks/run_benchmarks.py --sizes small medium
+    python benchmarks/run_benchmarks.py --sizes large --fail-on-regression
+"""
+import argparse
+import json
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from analytics import (  # noqa: E402
+    current_prices,
+    drop_report,
+    holdings_asof,
+    latest_moving_averages,
+    prev_positions_asof,
+    prev_positions_quarter,
+    replay_quarter,
+    transactions_period,
+)
+from db import get_pool  # noqa: E402
+from drop_detection import detect_drops  # noqa: E402
+from generate_load_data import generate  # noqa: E402
+from price_asof import build_index, get_asof_index  # noqa: E402
+from price_matrix import open_price_matrix, quarter_end_prices, store_path, sync  # noqa: E402
+from snapshots import generate_snapshots  # noqa: E402
+from update_moving_average import update_all_moving_averages  # noqa: E402
+
+DATA_DIR = Path(__file__).resolve().parent / ".data"
+HISTORY = Path(__file__).resolve().parent / "history.json"
+
+# 規模ごとの generate_load_data の引数
+SIZES = {
+    "small":  {"securities": 100,  "years": 2,  "trades_per_quarter": 5},
+    "medium": {"securities": 500,  "years": 5,  "trades_per_quarter": 10},
+    "large":  {"securities": 2000, "years": 10, "trades_per_quarter": 20},
+}
+
+# 前回よりこの割合以上遅くなったら回帰とみなす
+REGRESSION_THRESHOLD = 0.25
+
+# ─────────────────────────────
+# 1. 準備（DB 生成）
+# ─────────────────────────────
+def prepare_db(size: str, seed: int, regenerate: bool) -> Path:
+    params = SIZES[size]
+    DATA_DIR.mkdir(exist_ok=True)
+    db = DATA_DIR / f"{size}-s{params['securities']}-y{params['years']}-t{params['trades_per_quarter']}-seed{seed}.db"
+    if db.exists() and not regenerate:
+        return db
+    db.unlink(missing_ok=True)
+    print(f"🛠️ {size}: DB を生成中（{db.name}）...", flush=True)
+    generate(str(db), seed=seed, **params)
+    conn = sqlite3.connect(db)
+    with conn:
+        generate_snapshots(conn, full=True)
+    conn.close()
+    return db
+
+def _quarter_of(day: date) -> tuple[str, str, date, date]:
+    """day を含む四半期の (年, 'Qn', 開始日, 終了日)。"""
+    q = (day.month - 1) // 3 + 1
+    start = date(day.year, 3 * q - 2, 1)
+    end = (date(day.year + (q == 4), (3 * q) % 12 + 1, 1)) - timedelta(days=1)
+    return str(day.year), f"Q{q}", start, end
+
+# ─────────────────────────────
+# 2. 計測
+# ─────────────────────────────
+def measure(func, repeat: int) -> dict:
+    """func() を repeat 回実行した最速時間と、別の 1 回分の Python ピークメモリ。"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(best, 6), "peak_mb": round(peak / 2**20, 3)}
+
+def run_size(size: str, db: Path, repeat: int) -> dict:
+    pool = get_pool(db)
+    with pool.read() as conn:
+        first_txn = date.fromisoformat(conn.execute("SELECT MIN(txn_date) FROM transactions").fetchone()[0][:10])
+        last_txn = date.fromisoformat(conn.execute("SELECT MAX(txn_date) FROM transactions").fetchone()[0][:10])
+        last_quote = date.fromisoformat(conn.execute("SELECT MAX(quote_date) FROM price_quotes").fetchone()[0][:10])
+        df_quarters = pd.read_sql_query("SELECT * FROM positions_quarter", conn)
+        codes = dict(conn.execute("SELECT security_id, security_code FROM securities"))
+    matrix = open_price_matrix(db)
+    asof_index = get_asof_index(db)
+
+    # 最後の四半期を「当期」、その前を「前期」とみなす
+    _, _, cur_start, cur_end = _quarter_of(last_txn)
+    prev_year, prev_quarter, _, _ = _quarter_of(cur_start - timedelta(days=1))
+    # 任意日付の保有の復元は、取引期間の中ほどの日で測る
+    midpoint = first_txn + (last_txn - first_txn) / 2
+    with pool.read() as conn:
+        df_prev = prev_positions_quarter(conn, prev_year, prev_quarter)
+        df_txn = transactions_period(conn, cur_start, cur_end)
+
+    def reading(func, *args):
+        # 画面と同じくプールから読み取り用の接続を借りて実行する
+        def run():
+            with pool.read() as conn:
+                return func(conn, *args)
+        return run
+
+    def snapshots_full():
+        c = sqlite3.connect(db)
+        with c:
+            generate_snapshots(c, full=True)
+        c.close()
+
+    def asof_build():
+        with pool.read() as c:
+            build_index(c)
+
+    def matrix_rebuild():
+        c = sqlite3.connect(db)
+        sync(c, store_path(db), rebuild=True)
+        c.close()
+
+    cases = {
+        "load_transactions_period": reading(transactions_period, cur_start, cur_end),
+        "load_prev_positions_quarter": reading(prev_positions_quarter, prev_year, prev_quarter),
+        "prev_positions_asof": reading(prev_positions_asof, cur_start - timedelta(days=1)),
+        "holdings_asof_midpoint": reading(holdings_asof, midpoint),
+        "load_current_prices": reading(current_prices, last_quote, asof_index),
+        "load_latest_moving_averages": reading(latest_moving_averages),
+        "replay_quarter": lambda: replay_quarter(df_prev, df_txn),
+        "detect_drops": lambda: detect_drops(df_quarters),
+        "drop_report": reading(drop_report),
+        "asof_index_build": asof_build,
+        "price_matrix_rebuild": matrix_rebuild,
+        "price_matrix_quarter_drops": lambda: detect_drops(quarter_end_prices(matrix, codes)),
+        "generate_snapshots": snapshots_full,
+        "update_all_moving_averages": lambda: update_all_moving_averages(str(db), recompute_all=True),
+    }
+    results = {}
+    for name, func in cases.items():
+        results[name] = measure(func, repeat)
+        print(f"  {name:<30} {results[name]['seconds']:>10.4f} 秒  {results[name]['peak_mb']:>9.1f} MB",
+              flush=True)
+    return results
+
+# ─────────────────────────────
+# 3. 履歴
+# ─────────────────────────────
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_history(path: Path) -> list[dict]:
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else []
+
+def regressions(history: list[dict], record: dict, threshold: float) -> list[tuple[str, float, float]]:
+    """同じ規模・パラメータの直前の記録より threshold 以上遅い (処理名, 前回秒, 今回秒)。"""
+    previous = next(
+        (r for r in reversed(history) if r["size"] == record["size"] and r["params"] == record["params"]),
+        None
+    )
+    if previous is None:
+        return []
+    out = []
+    for name, result in record["results"].items():
+        before = previous["results"].get(name)
+        if before and result["seconds"] > before["seconds"] * (1 + threshold):
+            out.append((name, before["seconds"], result["seconds"]))
+    return out
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="ページのデータ処理のベンチマーク")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["small", "medium"],
+                        help="実行する規模")
+    parser.add_argument("--repeat", type=int, default=3, help="各処理の試行回数（最速値を採用）")
+    parser.add_argument("--seed", type=int, default=0, help="データ生成の乱数シード")
+    parser.add_argument("--regenerate", action="store_true", help="生成済みの DB を作り直す")
+    parser.add_argument("--history", type=Path, default=HISTORY, help="結果を追記する JSON")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="回帰とみなす遅延の割合（0.25 = 25%%）")
+    parser.add_argument("--fail-on-regression", action="store_true", help="回帰があれば終了コード 1")
+    args = parser.parse_args(argv)
+
+    history = load_history(args.history)
+    found = []
+    for size in args.sizes:
+        db = prepare_db(size, args.seed, args.regenerate)
+        print(f"📏 {size}（{SIZES[size]}）")
+        record = {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "size": size,
+            "params": {**SIZES[size], "seed": args.seed},
+            "results": run_size(size, db, args.repeat),
+        }
+        for name, before, after in regressions(history, record, args.threshold):
+            found.append((size, name, before, after))
+        history.append(record)
+
+    args.history.write_text(json.dumps(history, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"📝 {args.history} に記録しました。")
+    if not found:
+        print("✅ 前回からの回帰はありません。")
+        return 0
+    for size, name, before, after in found:
+        print(f"⚠️ {size} / {name}: {before:.4f} 秒 → {after:.4f} 秒（{after / before - 1:+.0%}）")
+    return 1 if args.fail_on_regression else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,14 @@
 # create_dummy_data.py
 import sqlite3
 import random
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 
+from init_db import ensure_schema
+from positions_current import rebuild as rebuild_positions_current
+from snapshots import generate_snapshots
+from update_moving_average import update_all_moving_averages
+
 DB = "app.db"
 
 # 参考データ（実際の株価データ）
@@ -40,6 +45,7 @@ QUARTERS = [
 def create_dummy_data():
     conn = sqlite3.connect(DB)
     conn.execute("PRAGMA foreign_keys = ON;")
+    ensure_schema(conn)
     
     print("🚀 ダミーデータ作成開始...")
     
@@ -119,89 +125,10 @@ def create_dummy_data():
                     else:
                         cumulative_quantity -= quantity
     
-    # 4. 四半期ポジションデータの生成
-    print("📈 四半期ポジションデータを生成中...")
-    
-    for i, (year, quarter, end_date) in enumerate(QUARTERS):
-        for stock in STOCK_DATA:
-            if i < len(stock["prices"]):
-                cursor = conn.execute("SELECT security_id FROM securities WHERE security_code = ?", (stock["code"],))
-                security_id = cursor.fetchone()[0]
-                
-                # 四半期末時点の累積ポジションを計算
-                cursor = conn.execute("""
-                    SELECT 
-                        SUM(CASE WHEN txn_type = 'BUY' THEN quantity ELSE -quantity END) as holding_qty,
-                        SUM(CASE WHEN txn_type = 'BUY' THEN quantity * price ELSE -quantity * price END) / 
-                        SUM(CASE WHEN txn_type = 'BUY' THEN quantity ELSE -quantity END) as avg_cost
-                    FROM transactions 
-                    WHERE security_id = ? AND txn_date <= ?
-                """, (security_id, end_date))
-                
-                result = cursor.fetchone()
-                holding_qty = result[0] if result[0] else 0
-                avg_cost = result[1] if result[1] else 0
-                
-                if holding_qty > 0:  # 保有がある場合のみ
-                    market_price = stock["prices"][i]
-                    market_cap = holding_qty * market_price
-                    
-                    conn.execute("""
-                        INSERT OR REPLACE INTO positions_quarter 
-                        (security_id, d365_code, security_code, security_name, year, quarter, 
-                        holding_qty, avg_cost, market_price, market_cap)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (security_id, stock["code"], stock["code"], stock["name"], 
-                        year, quarter, holding_qty, avg_cost, market_price, market_cap))
-    
-    # 5. 半期ポジションデータの生成
-    print("📊 半期ポジションデータを生成中...")
-    
-    halfyear_periods = [
-        ("2024", "H1", "2024-06-30"),  # Q2末
-        ("2024", "H2", "2024-12-31"),  # Q4末
-        ("2025", "H1", "2025-03-31")   # Q1末（仮）
-    ]
-    
-    for year, half, end_date in halfyear_periods:
-        for stock in STOCK_DATA:
-            cursor = conn.execute("SELECT security_id FROM securities WHERE security_code = ?", (stock["code"],))
-            security_id = cursor.fetchone()[0]
-            
-            # 半期末時点の累積ポジションを計算
-            cursor = conn.execute("""
-                SELECT 
-                    SUM(CASE WHEN txn_type = 'BUY' THEN quantity ELSE -quantity END) as holding_qty,
-                    SUM(CASE WHEN txn_type = 'BUY' THEN quantity * price ELSE -quantity * price END) / 
-                    SUM(CASE WHEN txn_type = 'BUY' THEN quantity ELSE -quantity END) as avg_cost
-                FROM transactions 
-                WHERE security_id = ? AND txn_date <= ?
-            """, (security_id, end_date))
-            
-            result = cursor.fetchone()
-            holding_qty = result[0] if result[0] else 0
-            avg_cost = result[1] if result[1] else 0
-            
-            if holding_qty > 0:  # 保有がある場合のみ
-                # 半期末の株価を取得
-                cursor = conn.execute("""
-                    SELECT close_price FROM price_quotes 
-                    WHERE security_id = ? AND quote_date <= ? 
-                    ORDER BY quote_date DESC LIMIT 1
-                """, (security_id, end_date))
-                
-                price_result = cursor.fetchone()
-                if price_result:
-                    market_price = price_result[0]
-                    market_cap = holding_qty * market_price
-                    
-                    conn.execute("""
-                        INSERT OR REPLACE INTO positions_halfyear 
-                        (security_id, d365_code, security_code, security_name, year, half, 
-                        holding_qty, avg_cost, market_price, market_cap)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (security_id, stock["code"], stock["code"], stock["name"], 
-                        year, half, holding_qty, avg_cost, market_price, market_cap))
+    # 4. 四半期・半期ポジションデータの生成（取引を 1 回走査して期末ごとに一括書き込み）
+    print("📈 四半期・半期ポジションデータを生成中...")
+    counts = generate_snapshots(conn, through=date.fromisoformat(QUARTERS[-1][2]), full=True)
+    print(f"   四半期 {counts['quarter']} 件 / 半期 {counts['halfyear']} 件")
     
     # 6. 30%下落判定のダミーデータ
     print("⚠️  30%下落判定データを生成中...")
@@ -218,6 +145,17 @@ def create_dummy_data():
             """, (stock["code"], year, quarter, drop_30pct, datetime.now().isoformat()))
     
     conn.commit()
+
+    # 7. 取引を直接 INSERT したので、取引台帳（moving_average / position_state / チェックポイント）を作り直す
+    #    （作り直さないと、既存の DB では record_transaction や positions_asof が古い状態を使う）
+    print("📒 取引台帳を再構築中...")
+    update_all_moving_averages(DB, recompute_all=True)
+
+    # 8. 現在ポジション（positions_current）を作り直す
+    print("🧮 現在ポジションを再構築中...")
+    rebuild_positions_current(conn)
+
+    conn.commit()
     
     # 結果確認
     print("\n📋 データ作成結果:")
@@ -0,0 +1,24 @@
+# data_version.py
+"""
+DB 全体のデータバージョン（書き込みのたびに 1 ずつ増えるカウンタ）。
+画面側のキャッシュ（st.cache_data など）のキーに含めることで、
+書き込みがあったときだけキャッシュを作り直す。
+"""
+import sqlite3
+
+def create_meta_table(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS app_meta (
+        key    TEXT PRIMARY KEY,
+        value  INTEGER NOT NULL
+    );
+    """)
+    conn.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('data_version', 0)")
+
+def get_data_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT value FROM app_meta WHERE key = 'data_version'").fetchone()
+    return row[0] if row else 0
+
+def bump_data_version(conn: sqlite3.Connection):
+    """データバージョンを 1 増やす。書き込みと同じトランザクション内で呼び、commit は呼び出し側で行う。"""
+    conn.execute("UPDATE app_meta SET value = value + 1 WHERE key = 'data_version'")
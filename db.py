@@ -0,0 +1,133 @@
+# db.py
+"""
+app.db への接続の共通化（ページ・CLI 共通）。
+
+- WAL モードで読み取りと書き込みを並行させる（読み取り中でも書き込みがブロックされない）
+- 読み取り用の接続はプールから貸し出し（query_only）、書き込みは 1 本の接続をロックで直列化
+- 接続を使い回すので、各接続の prepared statement キャッシュ（cached_statements）が効く
+
+    pool = get_pool(db_path)
+    with pool.read() as conn:
+        df = pd.read_sql_query("SELECT ...", conn)
+    with pool.write() as conn:      # 正常終了で commit、例外で rollback
+        record_transaction(conn, ...)
+"""
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from init_db import ensure_schema
+
+DB_PATH = Path(__file__).resolve().parent / "app.db"
+
+# 読み取り用プールの最大接続数
+READ_POOL_SIZE = 4
+# 接続ごとに保持する prepared statement の数
+CACHED_STATEMENTS = 256
+# ロック待ちの上限（秒）
+BUSY_TIMEOUT = 10.0
+
+# 接続ごとに設定する PRAGMA（journal_mode=WAL は DB ファイルに保存される）
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",     # WAL では NORMAL でもコミット済みデータは壊れない
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",      # 64MB
+    "PRAGMA mmap_size = 268435456",    # 256MB
+]
+
+# ─────────────────────────────
+# 1. 接続
+# ─────────────────────────────
+def connect(db_path=DB_PATH, readonly: bool = False) -> sqlite3.Connection:
+    """PRAGMA を設定した接続を返す。readonly=True なら書き込みを拒否する（query_only）。"""
+    conn = sqlite3.connect(
+        db_path,
+        timeout=BUSY_TIMEOUT,
+        check_same_thread=False,
+        cached_statements=CACHED_STATEMENTS,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+# ─────────────────────────────
+# 2. 接続プール
+# ─────────────────────────────
+class ConnectionPool:
+    """読み取り用接続のプールと、ロックで直列化した書き込み用接続 1 本。"""
+
+    def __init__(self, db_path=DB_PATH, read_size: int = READ_POOL_SIZE):
+        self.db_path = str(db_path)
+        self.read_size = read_size
+        self._readers = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._writer = connect(self.db_path)
+        # 未適用のマイグレーションがあれば書き込み用接続で 1 度だけ適用
+        ensure_schema(self._writer)
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.read_size:
+                self._created += 1
+                return connect(self.db_path, readonly=True)
+        # 上限まで貸し出し中なら返却を待つ
+        return self._readers.get(timeout=BUSY_TIMEOUT)
+
+    @contextmanager
+    def read(self):
+        """読み取り用の接続を貸し出す。"""
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    @contextmanager
+    def write(self):
+        """
+        書き込み用の接続を排他で貸し出す。
+        ブロックを正常に抜けたら commit、例外なら rollback する。
+        """
+        with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                self._writer.rollback()
+                raise
+            else:
+                self._writer.commit()
+
+    def close(self):
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path=DB_PATH) -> ConnectionPool:
+    """DB ファイルごとに 1 つのプールを返す（プロセス内で共有）。"""
+    key = str(Path(db_path).resolve())
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(key)
+        return pool
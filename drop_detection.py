@@ -0,0 +1,118 @@
+# drop_detection.py
+"""
+四半期ごとの株価下落判定（30％下落・50％下落・30％連続下落）。
+
+(year, quarter) を整数の期間番号 year*4 + (Q-1) に変換し、
+銘柄・期間順に並べて 1 行前（同じ銘柄内の shift）から前期の値を取り出す。
+前期のデータが欠けている（期間番号が連続しない）場合は前期なしとして扱う。
+"""
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from data_version import bump_data_version
+
+# 下落判定のしきい値（前期比）
+DROP_30PCT = -0.3
+DROP_50PCT = -0.5
+
+# 下落理由
+REASON_50PCT = "50％下落"
+REASON_STREAK = "連続下落"
+REASON_COLUMN = "下落理由"
+
+# ─────────────────────────────
+# 1. 期間番号
+# ─────────────────────────────
+def quarter_period(year: pd.Series, quarter: pd.Series) -> np.ndarray:
+    """('2024', 'Q3') → 2024*4 + 2 のような整数の期間番号。"""
+    # 年・四半期の種類は少ないので、ユニーク値だけ変換して引き当てる
+    year_codes, years = pd.factorize(year)
+    quarter_codes, quarters = pd.factorize(quarter)
+    year_nums = years.astype(int).to_numpy()
+    quarter_nums = pd.Index(quarters).str[1:].astype(int).to_numpy()
+    return year_nums[year_codes] * 4 + quarter_nums[quarter_codes] - 1
+
+# ─────────────────────────────
+# 2. 判定
+# ─────────────────────────────
+def detect_drops(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    security_code / year / quarter / market_price を持つ四半期データに
+    prev_market_price, price_drop_rate, drop_30pct, drop_50pct, prev_drop_30pct, 下落理由
+    の列を追加して返す（銘柄コード・期間順）。
+    下落理由は 50％下落を優先し、次に「今期・前期とも 30％下落」を連続下落とする。
+    """
+    year = df["year"].astype(str)
+    period = quarter_period(year, df["quarter"])
+    # 銘柄コード（昇順の整数コード）→ 期間の順に並べる
+    code_ids, _ = pd.factorize(df["security_code"], sort=True)
+    order = np.lexsort((period, code_ids))
+    out = df.take(order).reset_index(drop=True)
+    out["year"] = year.to_numpy()[order]
+    code_ids = code_ids[order]
+    period = period[order]
+
+    # 直前の行が同じ銘柄の前期（期間番号が 1 つ前）のときだけ前期の値を使う
+    # 並べ替え済みなので groupby shift は 1 行ずらしと同銘柄チェックで済む
+    contiguous = np.zeros(len(out), dtype=bool)
+    contiguous[1:] = (code_ids[1:] == code_ids[:-1]) & (period[1:] == period[:-1] + 1)
+
+    price = out["market_price"].to_numpy(dtype=float)
+    prev_price = np.full(len(out), np.nan)
+    prev_price[1:] = price[:-1]
+    prev_price[~contiguous] = np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = (price - prev_price) / prev_price
+    drop_30 = rate <= DROP_30PCT
+    drop_50 = rate <= DROP_50PCT
+    prev_drop_30 = np.zeros(len(out), dtype=bool)
+    prev_drop_30[1:] = drop_30[:-1]
+    prev_drop_30 &= contiguous
+
+    out["prev_market_price"] = prev_price
+    out["price_drop_rate"] = rate
+    out["drop_30pct"] = drop_30
+    out["drop_50pct"] = drop_50
+    out["prev_drop_30pct"] = prev_drop_30
+    out[REASON_COLUMN] = np.select(
+        [drop_50, drop_30 & prev_drop_30], [REASON_50PCT, REASON_STREAK], default=""
+    )
+    return out
+
+def flagged(df: pd.DataFrame) -> pd.DataFrame:
+    """detect_drops の結果から、下落理由が付いた行（50％下落・連続下落）だけを返す。"""
+    return df[df[REASON_COLUMN] != ""].copy()
+
+# ─────────────────────────────
+# 3. 判定結果の保存
+# ─────────────────────────────
+def save_judgements(conn: sqlite3.Connection, df: pd.DataFrame,
+                    judged_at: str | None = None) -> int:
+    """
+    detect_drops の結果の drop_30pct を drop_judgement に upsert し、件数を返す。
+    (security_code, year, quarter) の一意制約（マイグレーション 4）が前提。
+    データバージョンも更新する。commit は呼び出し側で行う（with conn: で囲む想定）。
+    """
+    judged_at = judged_at or datetime.now().isoformat(timespec="seconds")
+    rows = zip(
+        df["security_code"].astype(str),
+        df["year"].astype(str),
+        df["quarter"],
+        df["drop_30pct"].astype(int).tolist(),
+        [judged_at] * len(df),
+    )
+    cur = conn.executemany(
+        """
+        INSERT INTO drop_judgement (security_code, year, quarter, drop_30pct, judged_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(security_code, year, quarter) DO UPDATE SET
+            drop_30pct = excluded.drop_30pct,
+            judged_at  = excluded.judged_at
+        """,
+        rows
+    )
+    bump_data_version(conn)
+    return cur.rowcount
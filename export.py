@@ -0,0 +1,229 @@
+# export.py
+"""
+一覧・集計結果を CSV / Parquet に書き出す（チャンク単位のストリーミング）。
+
+問い合わせ結果を CHUNK_SIZE 行ずつ読み、読んだ分から書き出すので、
+全件の DataFrame → CSV 文字列 → bytes を同時にメモリへ載せることはない。
+圧縮は gzip / zstd（CSV はファイル全体を圧縮、Parquet は列ごとの圧縮コーデック）。
+
+    python export.py transactions --start 2024-01-01 --end 2024-12-31 --compression gzip
+    python export.py price_quotes --format parquet --compression zstd --out prices.parquet
+
+画面からは export_bytes(chunks, fmt, compression) の結果を st.download_button に渡す。
+"""
+import argparse
+import gzip
+import io
+import os
+import sqlite3
+import sys
+import time
+from collections.abc import Callable, Iterable, Iterator
+from datetime import date, timedelta
+from itertools import chain
+from pathlib import Path
+from typing import BinaryIO
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from analytics import drop_report, quarter_performance
+from db import get_pool
+from transaction_queries import SALE_RESULT_COLUMNS, TRANSACTION_CHECK_COLUMNS, iter_transactions
+
+DB = "app.db"
+
+# 1 回に読み込む行数
+CHUNK_SIZE = 50_000
+
+FORMATS = ("csv", "parquet")
+COMPRESSIONS = (None, "gzip", "zstd")
+
+EXTENSIONS = {"csv": ".csv", "parquet": ".parquet"}
+COMPRESSED_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+MIME_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet",
+              "gzip": "application/gzip", "zstd": "application/zstd"}
+
+# ─────────────────────────────
+# 1. 読み出し（DataFrame のチャンク列）
+# ─────────────────────────────
+def query_chunks(conn: sqlite3.Connection, sql: str, params: Iterable = (),
+                 chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """sql の結果を chunk_size 行ずつ返す（0 件でも列名付きの空 DataFrame を 1 つ返す）。"""
+    yield from pd.read_sql_query(sql, conn, params=list(params), chunksize=chunk_size)
+
+def frame_chunks(df: pd.DataFrame, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """計算済みの DataFrame を chunk_size 行ずつ返す（画面で表示中の表をそのまま書き出す用）。"""
+    if df.empty:
+        yield df
+        return
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+
+# ─────────────────────────────
+# 2. 書き出し
+# ─────────────────────────────
+def write_csv(chunks: Iterable[pd.DataFrame], out: BinaryIO, compression: str | None = None) -> int:
+    """
+    CSV（UTF-8 BOM 付き。Excel でそのまま開ける）を out に書き、行数を返す。
+    zstd はチャンクごとのフレームを連結する（zstd のフレーム連結は 1 つのファイルとして展開できる）。
+    """
+    sink = gzip.GzipFile(fileobj=out, mode="wb") if compression == "gzip" else out
+    rows = 0
+    for i, chunk in enumerate(chunks):
+        data = chunk.to_csv(index=False, header=(i == 0)).encode("utf-8-sig" if i == 0 else "utf-8")
+        if compression == "zstd":
+            data = pa.compress(data, codec="zstd", asbytes=True)
+        sink.write(data)
+        rows += len(chunk)
+    if sink is not out:
+        sink.close()
+    return rows
+
+def _resolve_types(tables: Iterator[pa.Table]) -> tuple[pa.Schema, list[pa.Table]]:
+    """
+    Parquet のスキーマを決める。全て NULL の列（null 型）があれば、型が決まるまで後続のチャンクを先読みし、
+    読んだチャンクのスキーマを統合する（int64 と float64 は float64 になる）。最後まで NULL だった列は文字列。
+    戻り値は (スキーマ, 先読みしたチャンク)。
+    """
+    buffered = []
+    schema = None
+    for table in tables:
+        buffered.append(table)
+        schema = table.schema if schema is None else pa.unify_schemas(
+            [schema, table.schema], promote_options="permissive"
+        )
+        if not any(pa.types.is_null(f.type) for f in schema):
+            break
+    if schema is None:
+        return pa.schema([]), buffered
+    fields = [f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in schema]
+    return pa.schema(fields, metadata=buffered[0].schema.metadata), buffered
+
+def write_parquet(chunks: Iterable[pd.DataFrame], out: BinaryIO, compression: str | None = None) -> int:
+    """
+    Parquet を out に書き、行数を返す。チャンクごとに 1 つの row group。
+    列の型は最初のチャンクで決める（全て NULL の列は値が現れるチャンクまで先読みして決める）。
+    以降のチャンクはその型に変換する。
+    """
+    tables = (pa.Table.from_pandas(chunk, preserve_index=False) for chunk in chunks)
+    schema, buffered = _resolve_types(tables)
+    rows = 0
+    with pq.ParquetWriter(out, schema, compression=compression or "snappy") as writer:
+        for table in chain(buffered, tables):
+            writer.write_table(table.cast(schema))
+            rows += table.num_rows
+    return rows
+
+WRITERS: dict[str, Callable[..., int]] = {"csv": write_csv, "parquet": write_parquet}
+
+def export(chunks: Iterable[pd.DataFrame], out: str | Path | BinaryIO,
+           fmt: str = "csv", compression: str | None = None) -> int:
+    """
+    chunks を fmt（'csv' / 'parquet'）で out（パスまたはバイナリのファイル）に書き出し、行数を返す。
+    パスの場合は <out>.part に書いてから置き換えるので、途中で止まっても書きかけのファイルは残らない。
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"未対応の形式です: {fmt}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"未対応の圧縮です: {compression}")
+    if not isinstance(out, (str, Path)):
+        return WRITERS[fmt](chunks, out, compression)
+
+    out = Path(out)
+    part = out.with_name(out.name + ".part")
+    try:
+        with open(part, "wb") as f:
+            rows = WRITERS[fmt](chunks, f, compression)
+        os.replace(part, out)
+    finally:
+        part.unlink(missing_ok=True)
+    return rows
+
+def export_bytes(chunks: Iterable[pd.DataFrame], fmt: str = "csv", compression: str | None = None) -> bytes:
+    """画面のダウンロード用。書き出した内容（圧縮後）だけをメモリに持つ。"""
+    buffer = io.BytesIO()
+    export(chunks, buffer, fmt, compression)
+    return buffer.getvalue()
+
+def file_name(base: str, fmt: str = "csv", compression: str | None = None) -> str:
+    """'transactions' → 'transactions.csv.gz' など。Parquet は内部で圧縮するので拡張子を足さない。"""
+    name = base + EXTENSIONS[fmt]
+    if fmt == "csv" and compression:
+        name += COMPRESSED_EXTENSIONS[compression]
+    return name
+
+def mime_type(fmt: str = "csv", compression: str | None = None) -> str:
+    return MIME_TYPES[compression] if fmt == "csv" and compression else MIME_TYPES[fmt]
+
+# ─────────────────────────────
+# 3. CLI で書き出せるデータ
+# ─────────────────────────────
+def _transactions(columns: str, order_by: str):
+    def chunks(conn, start, end, code, chunk_size):
+        return iter_transactions(conn, columns, start, end, code, order_by, chunk_size)
+    return chunks
+
+def _price_quotes(conn, start, end, code, chunk_size):
+    sql = """
+        SELECT pq.quote_date, s.security_code, s.security_name, pq.close_price
+        FROM price_quotes pq
+        JOIN securities s ON pq.security_id = s.security_id
+        WHERE pq.quote_date >= ? AND pq.quote_date < ?
+    """
+    params = [start.isoformat(), (end + timedelta(days=1)).isoformat()]
+    if code:
+        sql += " AND s.security_code = ?"
+        params.append(code)
+    return query_chunks(conn, sql + " ORDER BY pq.quote_date, s.security_code", params, chunk_size)
+
+def _drop_report(conn, start, end, code, chunk_size):
+    df = drop_report(conn)
+    if code:
+        df = df[df["security_code"] == code]
+    return frame_chunks(df, chunk_size)
+
+def _performance(conn, start, end, code, chunk_size):
+    df = quarter_performance(conn, end)
+    if code:
+        df = df[df["security_code"] == code]
+    return frame_chunks(df, chunk_size)
+
+DATASETS = {
+    # 売買結果一覧・取引チェックの画面と同じ列・並び順
+    "sale_results": _transactions(SALE_RESULT_COLUMNS, "t.txn_date DESC, security_code ASC, t.transaction_id DESC"),
+    "transactions": _transactions(TRANSACTION_CHECK_COLUMNS, "t.txn_date DESC, t.transaction_id DESC"),
+    "price_quotes": _price_quotes,
+    "drop_report": _drop_report,          # 全四半期の下落判定
+    "performance": _performance,          # --end の日の投資パフォーマンス
+}
+
+# ─────────────────────────────
+# 4. CLI
+# ─────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="一覧・集計結果を CSV / Parquet に書き出す")
+    parser.add_argument("dataset", choices=list(DATASETS), help="書き出すデータ")
+    parser.add_argument("--db", default=DB, help="SQLite ファイルのパス")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="出力形式")
+    parser.add_argument("--compression", choices=[c for c in COMPRESSIONS if c], help="圧縮（既定: なし）")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(1900, 1, 1), help="開始日 YYYY-MM-DD")
+    parser.add_argument("--end", type=date.fromisoformat, default=date.today(), help="終了日 YYYY-MM-DD（既定: 今日）")
+    parser.add_argument("--code", help="銘柄コードで絞り込む")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="1 回に読み込む行数")
+    parser.add_argument("--out", type=Path, help="出力先（既定: <dataset>.<拡張子>）")
+    args = parser.parse_args()
+
+    out = args.out or Path(file_name(args.dataset, args.format, args.compression))
+    began = time.perf_counter()
+    try:
+        with get_pool(args.db).read() as conn:
+            chunks = DATASETS[args.dataset](conn, args.start, args.end, args.code, args.chunk_size)
+            rows = export(chunks, out, args.format, args.compression)
+    except KeyboardInterrupt:
+        print("\n⏸️ 中断しました（書きかけのファイルは削除しました）。")
+        sys.exit(130)
+    seconds = time.perf_counter() - began
+    print(f"✅ {rows:,} 行を {out} に書き出しました"
+          f"（{out.stat().st_size / 1e6:.1f} MB、{seconds:.1f} 秒）。")
@@ -0,0 +1,32 @@
+# export_ui.py
+"""
+画面のダウンロード欄（形式・圧縮の選択 → 作成 → ダウンロード）。書き出し自体は export で行う。
+"""
+from collections.abc import Callable, Iterable
+
+import pandas as pd
+import streamlit as st
+
+from export import FORMATS, export_bytes, file_name, mime_type
+
+COMPRESSION_LABELS = {"なし": None, "gzip": "gzip", "zstd": "zstd"}
+
+def export_buttons(make_chunks: Callable[[], Iterable[pd.DataFrame]], base_name: str,
+                   label: str = "📥 ダウンロード", key: str | None = None):
+    """
+    形式（CSV / Parquet）と圧縮を選ばせ、「ファイルを作成」が押されたときだけ
+    make_chunks() のチャンクを書き出してダウンロードボタンを出す。
+    """
+    key = key or base_name
+    col1, col2, col3 = st.columns([1, 1, 2])
+    fmt = col1.selectbox("形式", FORMATS, format_func=str.upper, key=f"{key}_format")
+    compression = COMPRESSION_LABELS[col2.selectbox("圧縮", list(COMPRESSION_LABELS), key=f"{key}_compression")]
+    col3.write("")
+    if col3.button("ファイルを作成", key=f"{key}_create"):
+        st.download_button(
+            label,
+            data=export_bytes(make_chunks(), fmt, compression),
+            file_name=file_name(base_name, fmt, compression),
+            mime=mime_type(fmt, compression),
+            key=f"{key}_download"
+        )
@@ -0,0 +1,254 @@
+# generate_load_data.py
+"""
+負荷試験用の合成データ生成。
+
+銘柄数・年数・四半期あたりの取引数・乱数シードを指定して、
+securities / 日次 price_quotes / transactions（moving_average 計算済み）と
+position_state / position_checkpoints / positions_current を一括で作る。
+
+- 行は executemany で --batch-size 件ずつ流し込み、--commit-rows 件ごとに commit
+- 取り込み中は journal / 同期を切り、二次インデックスは最後にまとめて作り直す
+
+    python generate_load_data.py --securities 2000 --years 10 --trades-per-quarter 20
+    # → 取引 160 万件 / 日次株価 約 500 万件（load_test.db）
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import date
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from data_version import bump_data_version
+from init_db import ensure_schema
+from position_ledger import CHECKPOINT_INTERVAL, apply_txn, moving_average, upsert_positions_current
+from positions_current import apply_prices
+
+DB = "load_test.db"
+
+# 取り込み中の PRAGMA（終了後に通常の設定へ戻す）
+LOAD_PRAGMAS = [
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",   # 256MB
+    "PRAGMA locking_mode = EXCLUSIVE",
+]
+RESTORE_PRAGMAS = [
+    "PRAGMA locking_mode = NORMAL",
+    "PRAGMA journal_mode = DELETE",
+    "PRAGMA synchronous = FULL",
+]
+
+# 株価の日次ボラティリティ・初期値の範囲
+DAILY_VOLATILITY = 0.02
+INITIAL_PRICE_RANGE = (300.0, 8000.0)
+
+# ─────────────────────────────
+# 1. 銘柄ごとの行の生成
+# ─────────────────────────────
+def _security_rows(rng: np.random.Generator, security_id: int, day_strs: list[str],
+                   quarter_starts: np.ndarray, trades_per_quarter: int, next_id: int):
+    """
+    1 銘柄分の (株価行, 取引行, チェックポイント行, 最終状態) を作る。
+    取引は日付順に apply_txn を適用し、moving_average をその場で計算する。
+    """
+    n_days = len(day_strs)
+    closes = np.round(
+        rng.uniform(*INITIAL_PRICE_RANGE)
+        * np.exp(np.cumsum(rng.normal(0.0, DAILY_VOLATILITY, n_days))),
+        1
+    )
+    prices = list(zip(day_strs, repeat(security_id), closes.tolist()))
+
+    # 四半期ごとに trades_per_quarter 件、期内の営業日から取引日を選ぶ
+    lengths = np.diff(np.append(quarter_starts, n_days))
+    n_quarters = len(quarter_starts)
+    offsets = (rng.random((n_quarters, trades_per_quarter)) * lengths[:, None]).astype(np.int64)
+    positions = np.sort((quarter_starts[:, None] + offsets).ravel())
+    n = len(positions)
+    buy_draw = rng.random(n)
+    lots = rng.integers(1, 11, n) * 100
+    slippage = rng.uniform(0.98, 1.02, n)
+
+    txns, checkpoints = [], []
+    holding_qty = holding_cost = 0.0
+    txn_id = next_id
+    for k, pos in enumerate(positions.tolist()):
+        # 未保有なら必ず買い、保有中は 6 割買い・4 割売り（保有数を超えない）
+        if holding_qty <= 0 or buy_draw[k] < 0.6:
+            txn_type, qty = "BUY", float(lots[k])
+        else:
+            txn_type, qty = "SEL", float(min(lots[k], holding_qty))
+        price = round(float(closes[pos] * slippage[k]), 1)
+        holding_qty, holding_cost = apply_txn(holding_qty, holding_cost, txn_type, qty, price)
+        txns.append((txn_id, security_id, txn_type, qty, price, day_strs[pos],
+                     moving_average(holding_qty, holding_cost)))
+        if (k + 1) % CHECKPOINT_INTERVAL == 0:
+            checkpoints.append((security_id, k + 1, day_strs[pos], txn_id, holding_qty, holding_cost))
+        txn_id += 1
+
+    state = (security_id, holding_qty, holding_cost, n,
+             day_strs[positions[-1]] if n else None, txn_id - 1 if n else None)
+    latest_price = (day_strs[-1], security_id, float(closes[-1]))
+    return prices, txns, checkpoints, state, latest_price
+
+# ─────────────────────────────
+# 2. 一括書き込み
+# ─────────────────────────────
+def _insert_batched(conn: sqlite3.Connection, sql: str, rows: list, batch_size: int):
+    for i in range(0, len(rows), batch_size):
+        conn.executemany(sql, rows[i:i + batch_size])
+
+def _drop_secondary_indexes(conn: sqlite3.Connection) -> list[str]:
+    """transactions / price_quotes の二次インデックスを削除し、作り直し用の DDL を返す。"""
+    rows = conn.execute(
+        """
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'index' AND sql IS NOT NULL
+          AND tbl_name IN ('transactions', 'price_quotes')
+        """
+    ).fetchall()
+    for name, _ in rows:
+        conn.execute(f"DROP INDEX {name}")
+    return [sql for _, sql in rows]
+
+def generate(db_path=DB, securities=1000, years=5, trades_per_quarter=5, seed=0,
+             batch_size=50_000, commit_rows=1_000_000, with_prices=True, on_progress=None) -> dict:
+    """
+    db_path（新規ファイル）に合成データを作り、件数と経過秒の辞書を返す。
+    期間は (今年 - years) 年 1 月から前年末までの営業日。
+    """
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    last_year = date.today().year - 1
+    days = pd.bdate_range(f"{last_year - years + 1}-01-01", f"{last_year}-12-31")
+    day_strs = [d.strftime("%Y-%m-%d") for d in days]
+    quarter_starts = np.flatnonzero(np.r_[True, days.quarter[1:] != days.quarter[:-1]])
+
+    conn = sqlite3.connect(db_path)
+    ensure_schema(conn)
+    for pragma in LOAD_PRAGMAS:
+        conn.execute(pragma)
+    index_ddl = _drop_secondary_indexes(conn)
+
+    conn.executemany(
+        "INSERT INTO securities (security_id, security_code, d365_code, security_name) VALUES (?, ?, ?, ?)",
+        [(sid, str(1000 + sid), str(1000 + sid), f"合成銘柄{sid:05d}") for sid in range(1, securities + 1)]
+    )
+
+    counts = {"securities": securities, "price_quotes": 0, "transactions": 0}
+    pending = {"price_quotes": [], "transactions": [], "checkpoints": [],
+               "states": [], "latest_prices": []}
+    next_id = 1
+
+    def flush():
+        if with_prices:
+            # 主キー (quote_date, security_id) の順に並べてから入れる（B-tree への追記が局所的になる）
+            pending["price_quotes"].sort()
+            _insert_batched(
+                conn, "INSERT INTO price_quotes (quote_date, security_id, close_price) VALUES (?, ?, ?)",
+                pending["price_quotes"], batch_size
+            )
+        _insert_batched(
+            conn,
+            """
+            INSERT INTO transactions
+                (transaction_id, security_id, txn_type, quantity, price, txn_date, moving_average)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            pending["transactions"], batch_size
+        )
+        conn.executemany(
+            """
+            INSERT INTO position_checkpoints
+                (security_id, txn_count, txn_date, transaction_id, holding_qty, holding_cost)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            pending["checkpoints"]
+        )
+        conn.executemany(
+            """
+            INSERT INTO position_state
+                (security_id, holding_qty, holding_cost, txn_count,
+                 last_txn_date, last_transaction_id, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """,
+            pending["states"]
+        )
+        upsert_positions_current(conn, [(sid, qty, cost) for sid, qty, cost, *_ in pending["states"]])
+        if with_prices:
+            apply_prices(conn, pending["latest_prices"])
+        conn.commit()
+        for rows in pending.values():
+            rows.clear()
+
+    for sid in range(1, securities + 1):
+        prices, txns, checkpoints, state, latest_price = _security_rows(
+            rng, sid, day_strs, quarter_starts, trades_per_quarter, next_id
+        )
+        next_id += len(txns)
+        pending["price_quotes"] += prices
+        pending["transactions"] += txns
+        pending["checkpoints"] += checkpoints
+        pending["states"].append(state)
+        pending["latest_prices"].append(latest_price)
+        counts["price_quotes"] += len(prices) if with_prices else 0
+        counts["transactions"] += len(txns)
+        if len(pending["price_quotes"]) + len(pending["transactions"]) >= commit_rows:
+            flush()
+            if on_progress:
+                on_progress(sid, securities)
+    flush()
+
+    if on_progress:
+        on_progress(securities, securities)
+    for ddl in index_ddl:
+        conn.execute(ddl)
+    bump_data_version(conn)
+    conn.commit()
+    for pragma in RESTORE_PRAGMAS:
+        conn.execute(pragma)
+    conn.execute("ANALYZE")
+    conn.close()
+
+    counts["seconds"] = time.perf_counter() - started
+    return counts
+
+# ─────────────────────────────
+# 3. CLI
+# ─────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="負荷試験用の合成データを生成する")
+    parser.add_argument("--db", default=DB, help="出力先 SQLite ファイル（既定: load_test.db）")
+    parser.add_argument("--securities", type=int, default=1000, help="銘柄数")
+    parser.add_argument("--years", type=int, default=5, help="年数（前年末まで）")
+    parser.add_argument("--trades-per-quarter", type=int, default=5, help="1 銘柄・1 四半期あたりの取引数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+    parser.add_argument("--batch-size", type=int, default=50_000, help="executemany 1 回あたりの件数")
+    parser.add_argument("--commit-rows", type=int, default=1_000_000, help="この件数ごとに commit")
+    parser.add_argument("--no-prices", action="store_true", help="日次株価を作らない")
+    parser.add_argument("--overwrite", action="store_true", help="出力先が既にあれば削除して作り直す")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.overwrite:
+            print(f"⚠️ {args.db} は既に存在します（--overwrite で作り直します）。")
+            sys.exit(1)
+        os.remove(args.db)
+
+    def progress(done, total):
+        print(f"  {done:,} / {total:,} 銘柄", flush=True)
+
+    stats = generate(
+        args.db, args.securities, args.years, args.trades_per_quarter, args.seed,
+        args.batch_size, args.commit_rows, not args.no_prices, progress
+    )
+    rows = stats["price_quotes"] + stats["transactions"]
+    print(f"✅ {args.db} を作成しました（銘柄 {stats['securities']:,} / 取引 {stats['transactions']:,} 件 / "
+          f"株価 {stats['price_quotes']:,} 件 / {stats['seconds']:.1f} 秒 / "
+          f"{rows / stats['seconds']:,.0f} rows/s）")
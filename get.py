@@ -1,6 +1,16 @@
-import yfinance as yf
+import argparse
+import sqlite3
+from datetime import date
+
 import pandas as pd
 
+from db import connect
+from init_db import ensure_schema
+from market_data import get_market_data, to_ticker
+from positions_current import apply_prices
+
+DB = "app.db"
+
 # 会社名と証券コード（.T を付与）を定義
 companies = {
     "森永製菓": "2201.T",
@@ -24,48 +34,149 @@ companies = {
     "第一三共": "4568.T",
 }
 
-# 四半期末日を定義
-quarter_ends = {
-    "2024Q1": "2024-03-29",
-    "2024Q2": "2024-06-28",
-    "2024Q3": "2024-09-30",
-    "2024Q4": "2024-12-30",
-    "2025Q1": "2025-03-31",
-}
+# ─────────────────────────────
+# 1. 四半期末日の定義
+# ─────────────────────────────
+def quarter_end_dates(first: str, last: str) -> pd.DataFrame:
+    """
+    first〜last（例: '2024Q1'〜'2025Q1'）の各四半期について
+    year / quarter / period ('2024Q1') / target_date（暦上の四半期末日）を返す。
+    """
+    periods = pd.period_range(first, last, freq="Q")
+    return pd.DataFrame({
+        "year": periods.year.astype(str),
+        "quarter": "Q" + periods.quarter.astype(str),
+        "period": periods.astype(str),
+        "target_date": periods.end_time.normalize(),
+    })
+
+# ─────────────────────────────
+# 2. 四半期末終値の抽出（as-of 結合）
+# ─────────────────────────────
+def quarter_end_closes(bars: pd.DataFrame, quarters: pd.DataFrame) -> pd.DataFrame:
+    """
+    日足 bars（ticker, date, close の縦持ち。複数銘柄可）から、各銘柄・各四半期末の終値を求める。
+
+    四半期末日以前で最も近い取引日の終値を採用し（backward）、
+    それが無い場合（上場前など）は四半期末日以降で最も近い取引日の終値を使う（forward）。
+    戻り値は ticker / year / quarter / period / target_date / quote_date / close の縦持ち。
+    """
+    prices = bars[["ticker", "date", "close"]].copy()
+    prices["date"] = pd.to_datetime(prices["date"])
+    prices = prices.dropna(subset=["close"]).sort_values("date")
+    prices["quote_date"] = prices["date"]
+
+    # 銘柄 × 四半期 の全組み合わせ
+    targets = (
+        pd.DataFrame({"ticker": prices["ticker"].unique()})
+        .merge(quarters, how="cross")
+        .sort_values("target_date")
+    )
+
+    backward = pd.merge_asof(
+        targets, prices, left_on="target_date", right_on="date",
+        by="ticker", direction="backward"
+    )
+    forward = pd.merge_asof(
+        targets, prices, left_on="target_date", right_on="date",
+        by="ticker", direction="forward"
+    )
+    use_forward = backward["close"].isna()
+    backward.loc[use_forward, ["quote_date", "close"]] = (
+        forward.loc[use_forward, ["quote_date", "close"]].to_numpy()
+    )
+
+    cols = ["ticker", "year", "quarter", "period", "target_date", "quote_date", "close"]
+    return backward[cols].sort_values(["ticker", "period"]).reset_index(drop=True)
+
+# ─────────────────────────────
+# 3. DB への書き込み
+# ─────────────────────────────
+def write_quarter_end_closes(conn: sqlite3.Connection, closes: pd.DataFrame) -> tuple[int, int]:
+    """
+    四半期末終値を price_quotes（実際の取引日で INSERT OR IGNORE）と positions_current に登録し、
+    既存の positions_quarter 行の market_price / market_cap を更新する。
+    securities に登録されていない銘柄は無視する。
+    戻り値は (price_quotes 追加件数, positions_quarter 更新件数)。
+    """
+    sec = pd.read_sql_query("SELECT security_id, security_code FROM securities", conn)
+    df = closes.dropna(subset=["close"]).copy()
+    df["security_code"] = df["ticker"].str.split(".").str[0]
+    df = df.merge(sec, on="security_code", how="inner")
+    df["quote_date"] = pd.to_datetime(df["quote_date"]).dt.strftime("%Y-%m-%d")
+
+    with conn:
+        # 既に登録済みの (日付, 銘柄) は上書きしないので、positions_current へは実際に追加した行だけ反映する
+        added = []
+        for row in df[["quote_date", "security_id", "close"]].itertuples(index=False, name=None):
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO price_quotes (quote_date, security_id, close_price) VALUES (?, ?, ?)",
+                row
+            )
+            if cur.rowcount:
+                added.append(row)
+        inserted = len(added)
+        apply_prices(conn, added)
+
+        before = conn.total_changes
+        conn.executemany(
+            """
+            UPDATE positions_quarter
+            SET market_price = ?,
+                market_cap   = holding_qty * ?
+            WHERE security_id = ? AND year = ? AND quarter = ?
+            """,
+            df[["close", "close", "security_id", "year", "quarter"]].itertuples(index=False, name=None)
+        )
+        updated = conn.total_changes - before
+    return inserted, updated
+
+# ─────────────────────────────
+# 4. CLI
+# ─────────────────────────────
+def main():
+    parser = argparse.ArgumentParser(description="四半期末の終値を一括で抽出する")
+    parser.add_argument("--first", default="2024Q1", help="最初の四半期（例: 2024Q1）")
+    parser.add_argument("--last", default="2025Q1", help="最後の四半期（例: 2025Q1）")
+    parser.add_argument("--db", default=DB, help="SQLite ファイルのパス")
+    parser.add_argument("--from-db", action="store_true",
+                        help="companies ではなく securities テーブルの全銘柄を対象にする")
+    parser.add_argument("--write-db", action="store_true",
+                        help="結果を price_quotes / positions_quarter に書き込む")
+    args = parser.parse_args()
+
+    quarters = quarter_end_dates(args.first, args.last)
+
+    if args.from_db:
+        with sqlite3.connect(args.db) as conn:
+            rows = conn.execute(
+                "SELECT security_name, security_code FROM securities ORDER BY security_code"
+            ).fetchall()
+        names = {to_ticker(code): name for name, code in rows}
+    else:
+        names = {ticker: name for name, ticker in companies.items()}
+
+    # 全銘柄の日足をまとめて取得（ローカルキャッシュに無い期間だけ yfinance から取得）
+    # forward 補完用に最終四半期末から 1 週間先まで取得する
+    start = quarters["target_date"].min() - pd.offsets.QuarterBegin(startingMonth=1)
+    end = quarters["target_date"].max() + pd.Timedelta(days=7)
+    bars = get_market_data().get_history(list(names), start.date(), min(end.date(), date.today()))
+
+    closes = quarter_end_closes(bars, quarters)
+
+    # 会社名と証券コードを行、四半期を列にした表で表示
+    table = closes.pivot(index="ticker", columns="period", values="close")
+    table = table.reindex(index=list(names), columns=quarters["period"])
+    table.index = [f"{names[tk]} ({tk})" for tk in table.index]
+    table.columns.name = None
+    print(table)
+
+    if args.write_db:
+        conn = connect(args.db)
+        ensure_schema(conn)
+        inserted, updated = write_quarter_end_closes(conn, closes)
+        conn.close()
+        print(f"price_quotes に {inserted} 件追加、positions_quarter を {updated} 件更新しました。")
 
-# 結果を格納するデータフレームを作成
-# インデックスに会社名と証券コードを表示するための形式に変更
-index_with_ticker = [f"{name} ({ticker})" for name, ticker in companies.items()]
-df = pd.DataFrame(index=index_with_ticker, columns=quarter_ends.keys())
-
-for name, ticker in companies.items():
-    # yfinance でティッカーを取得
-    tk = yf.Ticker(ticker)
-    # 過去半年分の月次データを取得（十分にカバーするため）
-    hist = tk.history(start="2024-01-01", end="2025-04-05", interval="1d")
-    # 各四半期末の終値を抜き出し
-    index_key = f"{name} ({ticker})"
-    for q, d in quarter_ends.items():
-        try:
-            df.loc[index_key, q] = hist.loc[d]["Close"]
-        except KeyError:
-            # 取引日の関係で前後にずれる場合は最も近い直前の終値を取得
-            try:
-                # 指定日以前のデータがあるか確認
-                filtered_hist = hist[:d]
-                if not filtered_hist.empty:
-                    nearest = filtered_hist.iloc[-1]["Close"]
-                    df.loc[index_key, q] = nearest
-                else:
-                    # 過去のデータがない場合は未来の最も近いデータを使用
-                    filtered_hist = hist[hist.index > d]
-                    if not filtered_hist.empty:
-                        nearest = filtered_hist.iloc[0]["Close"]
-                        df.loc[index_key, q] = nearest
-                    else:
-                        df.loc[index_key, q] = float('nan')  # データがない場合はNaNを設定
-            except Exception as e:
-                print(f"データ取得エラー ({name} ({ticker}), {q}): {e}")
-                df.loc[index_key, q] = float('nan')  # エラーが発生した場合もNaNを設定
-
-print(df)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+# import_trades.py
+"""
+証券会社の約定 CSV を transactions に一括登録する。
+
+1. 読み込み・検証（列名の表記ゆれ・Shift_JIS・桁区切りのカンマに対応。不正な行は行番号付きで報告）
+2. securities をまとめて解決（既存はコードで 1 回の SELECT、無い銘柄は CSV の銘柄名でまとめて INSERT。
+   ネットワークには問い合わせない）
+3. 全行を executemany で INSERT し、影響のあった銘柄だけ
+   「取り込んだ最も古い取引日」以前の直近チェックポイントから再生して moving_average を更新
+   （position_ledger.replay_from_checkpoint。position_state / positions_current も更新される）
+
+2〜3 は 1 つのトランザクションで行い、失敗したら何も登録しない。
+
+    python import_trades.py executions.csv
+    python import_trades.py executions.csv --skip-existing   # 登録済みと同じ取引は飛ばす（再取り込み用）
+    python import_trades.py executions.csv --dry-run         # 検証だけ
+    python import_trades.py executions.csv --skip-invalid    # 不正な行を除いて登録（既定は 1 行でもあれば中止）
+
+CSV の列（1 行目が見出し。英語・日本語どちらでもよい）:
+    約定日 / trade_date, 銘柄コード / code, 売買 / side, 数量 / quantity, 単価 / price, 銘柄名 / name（任意）
+"""
+import argparse
+import io
+import sqlite3
+import time
+from collections import Counter
+from pathlib import Path
+
+import pandas as pd
+
+from data_version import bump_data_version
+from db import connect
+from init_db import ensure_schema
+from position_ledger import replay_from_checkpoint
+from snapshots import SNAPSHOT_KINDS, latest_snapshot_end
+
+DB = "app.db"
+
+# 見出しの表記ゆれ → 内部の列名
+COLUMN_ALIASES = {
+    "txn_date":      ["txn_date", "trade_date", "date", "約定日", "約定日付", "取引日"],
+    "security_code": ["security_code", "code", "symbol", "銘柄コード", "コード"],
+    "txn_type":      ["txn_type", "side", "type", "売買", "売買区分", "取引"],
+    "quantity":      ["quantity", "qty", "shares", "数量", "約定数量", "株数"],
+    "price":         ["price", "unit_price", "単価", "約定単価", "約定価格"],
+    "security_name": ["security_name", "name", "銘柄名", "銘柄"],
+}
+REQUIRED_COLUMNS = ["txn_date", "security_code", "txn_type", "quantity", "price"]
+
+# 売買の表記 → transactions.txn_type
+SIDES = {"BUY": "BUY", "B": "BUY", "買": "BUY", "買付": "BUY", "現物買": "BUY",
+         "SEL": "SEL", "SELL": "SEL", "S": "SEL", "売": "SEL", "売付": "SEL", "現物売": "SEL"}
+
+# 読み込みを試す文字コード（証券会社の CSV は Shift_JIS が多い）
+ENCODINGS = ("utf-8-sig", "cp932")
+
+# IN 句に並べる件数の上限（SQLite の変数の上限より小さく）
+IN_CHUNK = 500
+
+# ─────────────────────────────
+# 1. 読み込み・検証
+# ─────────────────────────────
+def read_trades(source) -> pd.DataFrame:
+    """
+    CSV（パス・バイト列・ファイルオブジェクト）を読み、列名を内部の名前にそろえる。
+    値はすべて文字列のまま返す（検証は validate_trades で行う）。
+    """
+    if isinstance(source, bytes):
+        raw = source
+    elif hasattr(source, "read"):
+        raw = source.read()
+    else:
+        raw = Path(source).read_bytes()
+    for encoding in ENCODINGS:
+        try:
+            text = raw.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise ValueError(f"文字コードを判別できません（{' / '.join(ENCODINGS)} を試しました）")
+
+    df = pd.read_csv(io.StringIO(text), dtype=str, keep_default_na=False, skipinitialspace=True)
+    lookup = {alias.lower(): name for name, aliases in COLUMN_ALIASES.items() for alias in aliases}
+    df = df.rename(columns={c: lookup[c.strip().lower()] for c in df.columns if c.strip().lower() in lookup})
+    missing = [c for c in REQUIRED_COLUMNS if c not in df]
+    if missing:
+        raise ValueError(f"必須の列がありません: {', '.join(missing)}（見出し: {', '.join(df.columns)}）")
+    if "security_name" not in df:
+        df["security_name"] = ""
+    return df[REQUIRED_COLUMNS + ["security_name"]]
+
+def _number(series: pd.Series) -> pd.Series:
+    return pd.to_numeric(series.str.replace(",", "", regex=False).str.strip(), errors="coerce")
+
+def validate_trades(df: pd.DataFrame) -> tuple[pd.DataFrame, list[tuple[int, str]]]:
+    """
+    (正しい行の DataFrame, [(CSV の行番号, 理由), ...]) を返す。
+    正しい行は txn_date（'YYYY-MM-DD'）/ security_code / txn_type（BUY / SEL）/ quantity / price / security_name。
+    """
+    out = pd.DataFrame(index=df.index)
+    out["security_code"] = df["security_code"].str.strip()
+    out["security_name"] = df["security_name"].str.strip()
+    out["txn_type"] = df["txn_type"].str.strip().str.upper().map(SIDES)
+    out["quantity"] = _number(df["quantity"])
+    out["price"] = _number(df["price"])
+    dates = pd.to_datetime(df["txn_date"].str.strip().str.replace("/", "-", regex=False),
+                           format="%Y-%m-%d", errors="coerce")
+    out["txn_date"] = dates.dt.strftime("%Y-%m-%d")
+
+    checks = [
+        (out["security_code"] == "", "銘柄コードが空です"),
+        (dates.isna(), "約定日が不正です（YYYY-MM-DD または YYYY/MM/DD）"),
+        (out["txn_type"].isna(), "売買区分が不正です（BUY / SELL / 買 / 売 など）"),
+        (~(out["quantity"] > 0), "数量が不正です（正の数）"),
+        (~(out["price"] >= 0), "単価が不正です（0 以上の数）"),
+    ]
+    errors = []
+    bad = pd.Series(False, index=df.index)
+    for mask, message in checks:
+        # 見出しが 1 行目なので、データの行番号は index + 2
+        errors += [(int(i) + 2, message) for i in df.index[mask & ~bad]]
+        bad |= mask
+    errors.sort()
+    return out[~bad].reset_index(drop=True), errors
+
+# ─────────────────────────────
+# 2. securities の解決
+# ─────────────────────────────
+def resolve_securities(conn: sqlite3.Connection, trades: pd.DataFrame) -> tuple[dict[str, int], int]:
+    """
+    trades の銘柄コード → security_id の辞書と、新しく登録した銘柄数を返す。
+    未登録の銘柄は CSV の銘柄名（無ければコード）で登録する（d365_code はコードと同じ）。
+    """
+    codes = list(dict.fromkeys(trades["security_code"]))
+    ids: dict[str, int] = {}
+    for i in range(0, len(codes), IN_CHUNK):
+        chunk = codes[i:i + IN_CHUNK]
+        rows = conn.execute(
+            f"SELECT security_code, security_id FROM securities "
+            f"WHERE security_code IN ({','.join('?' * len(chunk))})",
+            chunk
+        ).fetchall()
+        ids.update(rows)
+
+    names = trades.drop_duplicates("security_code").set_index("security_code")["security_name"]
+    new = [(code, code, names.get(code) or code) for code in codes if code not in ids]
+    if new:
+        conn.executemany(
+            "INSERT INTO securities (security_code, d365_code, security_name) VALUES (?, ?, ?)", new
+        )
+        for i in range(0, len(new), IN_CHUNK):
+            chunk = [code for code, _, _ in new[i:i + IN_CHUNK]]
+            ids.update(conn.execute(
+                f"SELECT security_code, security_id FROM securities "
+                f"WHERE security_code IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall())
+    return ids, len(new)
+
+# ─────────────────────────────
+# 3. 登録・再計算
+# ─────────────────────────────
+def _drop_existing(conn: sqlite3.Connection, rows: list[tuple]) -> list[tuple]:
+    """
+    登録済みの取引と (銘柄, 売買, 数量, 単価, 約定日) が同じ行を、登録済みの件数分だけ除く
+    （同じファイルを取り込み直しても重複しない。同じ内容の取引が複数あっても件数で突き合わせる）。
+    """
+    sids = sorted({r[0] for r in rows})
+    first = min(r[4] for r in rows)
+    existing = Counter()
+    for i in range(0, len(sids), IN_CHUNK):
+        chunk = sids[i:i + IN_CHUNK]
+        existing.update(conn.execute(
+            f"""
+            SELECT security_id, txn_type, quantity, price, txn_date
+            FROM transactions
+            WHERE txn_date >= ? AND security_id IN ({','.join('?' * len(chunk))})
+            """,
+            [first, *chunk]
+        ).fetchall())
+    kept = []
+    for row in rows:
+        if existing[row] > 0:
+            existing[row] -= 1
+        else:
+            kept.append(row)
+    return kept
+
+def import_trades(conn: sqlite3.Connection, trades: pd.DataFrame, skip_existing: bool = False) -> dict:
+    """
+    validate_trades 済みの trades を登録し、件数の辞書を返す。commit は呼び出し側で行う
+    （with conn: / pool.write() で囲む想定。途中で失敗すれば全件が取り消される）。
+    """
+    started = time.perf_counter()
+    stats = {"rows": len(trades), "inserted": 0, "skipped": 0, "new_securities": 0,
+             "securities": 0, "replayed": 0, "stale_snapshots": False, "seconds": 0.0}
+    if trades.empty:
+        return stats
+
+    ids, stats["new_securities"] = resolve_securities(conn, trades)
+    rows = list(zip(
+        trades["security_code"].map(ids).astype(int).tolist(),
+        trades["txn_type"].tolist(),
+        trades["quantity"].astype(float).tolist(),
+        trades["price"].astype(float).tolist(),
+        trades["txn_date"].tolist(),
+    ))
+    if skip_existing:
+        kept = _drop_existing(conn, rows)
+        stats["skipped"] = len(rows) - len(kept)
+        rows = kept
+    if not rows:
+        stats["seconds"] = time.perf_counter() - started
+        return stats
+
+    conn.executemany(
+        "INSERT INTO transactions (security_id, txn_type, quantity, price, txn_date) VALUES (?, ?, ?, ?, ?)",
+        rows
+    )
+    stats["inserted"] = len(rows)
+
+    # 銘柄ごとに、取り込んだ最も古い取引日から moving_average を作り直す
+    earliest: dict[int, str] = {}
+    for sid, _, _, _, txn_date in rows:
+        if sid not in earliest or txn_date < earliest[sid]:
+            earliest[sid] = txn_date
+    for sid, txn_date in earliest.items():
+        replay_from_checkpoint(conn, sid, txn_date)
+    stats["securities"] = len(earliest)
+    stats["replayed"] = sum(
+        conn.execute(
+            "SELECT COUNT(*) FROM transactions WHERE security_id = ? AND txn_date >= ?", (sid, txn_date)
+        ).fetchone()[0]
+        for sid, txn_date in earliest.items()
+    )
+    bump_data_version(conn)
+
+    # 作成済みの期末スナップショットより前の取引を取り込んだら、スナップショットは古くなる
+    first = min(earliest.values())
+    ends = [latest_snapshot_end(conn, kind) for kind in SNAPSHOT_KINDS]
+    stats["stale_snapshots"] = any(end is not None and first <= end.isoformat() for end in ends)
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+# ─────────────────────────────
+# 4. CLI
+# ─────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="証券会社の約定 CSV を transactions に一括登録する")
+    parser.add_argument("csv", type=Path, help="約定 CSV のパス")
+    parser.add_argument("--db", default=DB, help="SQLite ファイルのパス")
+    parser.add_argument("--skip-existing", action="store_true", help="登録済みと同じ取引は登録しない")
+    parser.add_argument("--skip-invalid", action="store_true", help="不正な行を除いて登録する")
+    parser.add_argument("--dry-run", action="store_true", help="検証だけ行い、登録しない")
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    try:
+        trades, errors = validate_trades(read_trades(args.csv))
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise SystemExit(1)
+    parsed = time.perf_counter() - began
+
+    for line, message in errors[:20]:
+        print(f"⚠️ {line} 行目: {message}")
+    if len(errors) > 20:
+        print(f"⚠️ ほか {len(errors) - 20:,} 行")
+    print(f"📄 {len(trades) + len(errors):,} 行中 {len(trades):,} 行が有効（{parsed:.2f} 秒）")
+    if errors and not args.skip_invalid and not args.dry_run:
+        print("❌ 不正な行があるため登録しませんでした（--skip-invalid で有効な行だけ登録）。")
+        raise SystemExit(1)
+    if args.dry_run or trades.empty:
+        raise SystemExit(1 if errors else 0)
+
+    conn = connect(args.db)
+    ensure_schema(conn)
+    try:
+        with conn:
+            stats = import_trades(conn, trades, args.skip_existing)
+    finally:
+        conn.close()
+
+    rate = stats["inserted"] / stats["seconds"] if stats["seconds"] else 0
+    print(f"✅ {stats['inserted']:,} 件を登録しました（新規銘柄 {stats['new_securities']:,} / "
+          f"再計算 {stats['securities']:,} 銘柄・{stats['replayed']:,} 件 / "
+          f"{stats['seconds']:.2f} 秒・{rate:,.0f} 件/秒）")
+    if stats["skipped"]:
+        print(f"⏭️ 登録済みと同じ {stats['skipped']:,} 件は飛ばしました。")
+    if stats["stale_snapshots"]:
+        print("ℹ️ 作成済みの期末スナップショットより前の取引を含みます。"
+              "python snapshots.py --full で作り直してください。")
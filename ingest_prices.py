@@ -0,0 +1,259 @@
+# ingest_prices.py
+"""
+日次終値のバックフィル（画面を使わずに price_quotes へ過去の終値を取り込む）。
+
+securities の全銘柄について、指定期間のうち price_quotes に無い営業日だけを
+プロバイダ（既定は yfinance、MARKET_DATA_FIXTURES でファイルに差し替え可）から取得する。
+
+- 欠けている期間が同じ銘柄を --batch-size 件ずつまとめて 1 回のリクエストで取得
+- INSERT OR IGNORE を executemany で流し込み、positions_current の最新株価も更新
+- 終わった銘柄は price_ingest_checkpoints に記録し、バッチごとに commit する
+  （中断しても同じ期間で再実行すれば、記録済みの銘柄を飛ばして続きから取り込む）
+
+取引所の休日は price_quotes に行ができないため、取得した期間を price_quote_coverage に
+銘柄ごとに記録し、記録済みの期間は（休日で行が無くても）取得し直さない。
+
+    python ingest_prices.py --start 2015-01-01 --end 2024-12-31
+    python ingest_prices.py --start 2015-01-01 --end 2024-12-31 --reset   # 進捗と取得済み期間を消して最初から
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from db import connect
+from init_db import ensure_schema
+from market_data import get_market_data, to_ticker
+from positions_current import apply_prices
+
+DB = "app.db"
+
+# 1 回のリクエストでまとめるティッカー数
+BATCH_SIZE = 50
+
+# ─────────────────────────────
+# 1. 欠けている期間の算出
+# ─────────────────────────────
+def job_key(start: date, end: date) -> str:
+    """進捗を記録するジョブ名（対象期間）。"""
+    return f"{start.isoformat()}:{end.isoformat()}"
+
+def business_days(start: date, end: date) -> np.ndarray:
+    """start〜end（両端含む）の平日を 'YYYY-MM-DD' の配列で返す。"""
+    return pd.bdate_range(start, end).strftime("%Y-%m-%d").to_numpy(dtype=str)
+
+def missing_windows(conn, security_ids: list[int], days: np.ndarray) -> dict[int, tuple[date, date] | None]:
+    """
+    銘柄ごとに、days のうち price_quotes に無く取得済み期間にも含まれない日を含む
+    最小の期間 (最初の日, 最後の日) を返す。欠けている日が無ければ None。
+    """
+    existing: dict[int, list[str]] = {sid: [] for sid in security_ids}
+    covered: dict[int, list[tuple[str, str]]] = {sid: [] for sid in security_ids}
+    if len(days) and security_ids:
+        placeholders = ",".join("?" * len(security_ids))
+        next_day = (date.fromisoformat(days[-1]) + timedelta(days=1)).isoformat()
+        for sid, quote_date in conn.execute(
+            f"""
+            SELECT security_id, quote_date
+            FROM price_quotes
+            WHERE security_id IN ({placeholders})
+              AND quote_date >= ? AND quote_date < ?
+            """,
+            (*security_ids, days[0], next_day)
+        ):
+            existing[sid].append(quote_date[:10])
+        for sid, start_date, end_date in conn.execute(
+            f"""
+            SELECT security_id, start_date, end_date
+            FROM price_quote_coverage
+            WHERE security_id IN ({placeholders})
+              AND end_date >= ? AND start_date <= ?
+            """,
+            (*security_ids, days[0], days[-1])
+        ):
+            covered[sid].append((start_date, end_date))
+
+    windows = {}
+    for sid, dates in existing.items():
+        missing = days[~np.isin(days, dates)] if dates else days
+        for start_date, end_date in covered[sid]:
+            missing = missing[(missing < start_date) | (missing > end_date)]
+        windows[sid] = (
+            (date.fromisoformat(missing[0]), date.fromisoformat(missing[-1])) if len(missing) else None
+        )
+    return windows
+
+def _mark_covered(conn, security_id: int, start: date, end: date):
+    """取得済み期間を追加し、重なる・隣接する期間を 1 つにまとめる（market_data の bar_coverage と同じ）。"""
+    rows = conn.execute(
+        """
+        SELECT start_date, end_date FROM price_quote_coverage
+        WHERE security_id = ? AND end_date >= ? AND start_date <= ?
+        """,
+        (security_id, (start - timedelta(days=1)).isoformat(), (end + timedelta(days=1)).isoformat())
+    ).fetchall()
+    for s, e in rows:
+        start = min(start, date.fromisoformat(s))
+        end = max(end, date.fromisoformat(e))
+    conn.execute(
+        "DELETE FROM price_quote_coverage WHERE security_id = ? AND start_date >= ? AND start_date <= ?",
+        (security_id, start.isoformat(), end.isoformat())
+    )
+    conn.execute(
+        "INSERT INTO price_quote_coverage (security_id, start_date, end_date) VALUES (?, ?, ?)",
+        (security_id, start.isoformat(), end.isoformat())
+    )
+
+# ─────────────────────────────
+# 2. 取り込み
+# ─────────────────────────────
+def _save_batch(conn, job: str, bars: pd.DataFrame, ticker_ids: dict[str, int], done_ids: list[int],
+                window: tuple[date, date] | None = None) -> int:
+    """
+    取得した日足を登録し、done_ids を完了として記録して commit する。追加件数を返す。
+    window を渡すと、日足が 1 本でも返ってきた銘柄はその期間（前日まで）を取得済みとして記録する
+    （何も返ってこなかった銘柄は取得失敗の可能性があるので、次回また取りにいく）。
+    """
+    rows = []
+    if not bars.empty:
+        bars = bars[bars["ticker"].isin(ticker_ids.keys())]
+        rows = list(zip(
+            bars["date"].astype(str).str[:10],
+            bars["ticker"].map(ticker_ids).astype(int).tolist(),
+            bars["close"].astype(float).tolist(),
+        ))
+
+    with conn:
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO price_quotes (quote_date, security_id, close_price) VALUES (?, ?, ?)",
+            rows
+        )
+        inserted = conn.total_changes - before
+
+        per_security = dict.fromkeys(done_ids, 0)
+        latest = {}
+        for quote_date, sid, close in rows:
+            per_security[sid] = per_security.get(sid, 0) + 1
+            if sid not in latest or quote_date > latest[sid][0]:
+                latest[sid] = (quote_date, sid, close)
+        if latest:
+            # 既存の株価より古い日付は apply_prices 側で無視される（データバージョンも更新）
+            apply_prices(conn, latest.values())
+        if window is not None:
+            # 当日分は未確定なので前日までとする
+            covered_end = min(window[1], date.today() - timedelta(days=1))
+            if covered_end >= window[0]:
+                for sid in latest:
+                    _mark_covered(conn, sid, window[0], covered_end)
+        conn.executemany(
+            """
+            INSERT INTO price_ingest_checkpoints (job, security_id, inserted)
+            VALUES (?, ?, ?)
+            ON CONFLICT(job, security_id) DO UPDATE SET
+                inserted    = excluded.inserted,
+                finished_at = CURRENT_TIMESTAMP;
+            """,
+            [(job, sid, per_security[sid]) for sid in done_ids]
+        )
+    return inserted
+
+def ingest(conn, start: date, end: date, batch_size: int = BATCH_SIZE,
+           provider=None, reset: bool = False, on_progress=None) -> dict:
+    """
+    securities の全銘柄について start〜end の欠けている終値を取り込み、件数の辞書を返す。
+    provider 省略時は get_market_data() のプロバイダを使う。
+    取得に失敗したバッチは記録せずに続行する（再実行で取り直す）。
+    on_progress(完了銘柄数, 全銘柄数) をバッチごとに呼び出す。
+    """
+    started = time.perf_counter()
+    provider = provider or get_market_data().provider
+    job = job_key(start, end)
+    if reset:
+        with conn:
+            conn.execute("DELETE FROM price_ingest_checkpoints WHERE job = ?", (job,))
+            conn.execute(
+                "DELETE FROM price_quote_coverage WHERE end_date >= ? AND start_date <= ?",
+                (start.isoformat(), end.isoformat())
+            )
+
+    securities = conn.execute(
+        """
+        SELECT s.security_id, s.security_code
+        FROM securities s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM price_ingest_checkpoints c
+            WHERE c.job = ? AND c.security_id = s.security_id
+        )
+        ORDER BY s.security_id
+        """,
+        (job,)
+    ).fetchall()
+    total = conn.execute("SELECT COUNT(*) FROM securities").fetchone()[0]
+    stats = {"securities": total, "resumed": total - len(securities), "requests": 0,
+             "inserted": 0, "failed": 0, "seconds": 0.0}
+    done = stats["resumed"]
+    days = business_days(start, end)
+
+    for i in range(0, len(securities), batch_size):
+        chunk = securities[i:i + batch_size]
+        windows = missing_windows(conn, [sid for sid, _ in chunk], days)
+
+        # 欠けている期間が同じ銘柄をまとめて 1 回で取得する
+        groups: dict[tuple[date, date] | None, dict[str, int]] = {}
+        for sid, code in chunk:
+            groups.setdefault(windows[sid], {})[to_ticker(code)] = sid
+
+        for window, ticker_ids in groups.items():
+            bars = pd.DataFrame()
+            if window is not None:
+                stats["requests"] += 1
+                try:
+                    bars = provider.history(list(ticker_ids), *window)
+                except Exception as e:
+                    stats["failed"] += len(ticker_ids)
+                    print(f"⚠️ {window[0]}〜{window[1]} の {len(ticker_ids)} 銘柄の取得に失敗しました: {e}",
+                          flush=True)
+                    continue
+            stats["inserted"] += _save_batch(conn, job, bars, ticker_ids, list(ticker_ids.values()), window)
+            done += len(ticker_ids)
+        if on_progress:
+            on_progress(done, total)
+
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+# ─────────────────────────────
+# 3. CLI
+# ─────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="全銘柄の日次終値を price_quotes にバックフィルする")
+    parser.add_argument("--db", default=DB, help="SQLite ファイルのパス")
+    parser.add_argument("--start", type=date.fromisoformat, required=True, help="開始日（YYYY-MM-DD）")
+    parser.add_argument("--end", type=date.fromisoformat, default=date.today() - timedelta(days=1),
+                        help="終了日（YYYY-MM-DD、既定: 昨日）")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="1 回のリクエストでまとめるティッカー数")
+    parser.add_argument("--reset", action="store_true", help="同じ期間の進捗と取得済み期間を消して最初から取り込む")
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    ensure_schema(conn)
+
+    def progress(done, total):
+        print(f"  {done:,} / {total:,} 銘柄", flush=True)
+
+    try:
+        stats = ingest(conn, args.start, args.end, args.batch_size, reset=args.reset, on_progress=progress)
+    except KeyboardInterrupt:
+        print("⏸️ 中断しました。同じ期間で再実行すると続きから取り込みます。")
+        raise SystemExit(130)
+    finally:
+        conn.close()
+
+    print(f"✅ {args.start}〜{args.end}: {stats['inserted']:,} 件を追加しました"
+          f"（銘柄 {stats['securities']:,} / うち前回までに完了 {stats['resumed']:,} / "
+          f"リクエスト {stats['requests']:,} 回 / {stats['seconds']:.1f} 秒）")
+    if stats["failed"]:
+        print(f"⚠️ {stats['failed']:,} 銘柄の取得に失敗しました。再実行すると取り直します。")
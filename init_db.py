@@ -1,12 +1,19 @@
 # stock_schema_single_user.py
+import argparse
+import re
 import sqlite3
+import sys
 
-DB = "app.db"
+from data_version import create_meta_table
+from position_ledger import create_ledger_tables
+from positions_current import rebuild as rebuild_positions_current
 
-def main():
-    conn = sqlite3.connect(DB)
-    conn.execute("PRAGMA foreign_keys = ON;")
+DB = "app.db"
 
+# ─────────────────────────────
+# 1. 基本スキーマ（バージョン 0）
+# ─────────────────────────────
+def create_schema(conn: sqlite3.Connection):
     # ── 銘柄マスター ───────────────────────────────
     conn.execute("""
     CREATE TABLE IF NOT EXISTS securities (
@@ -124,10 +131,259 @@ def main():
     );
     """)
 
+    # --- 移動平均の累積状態・チェックポイント ---
+    create_ledger_tables(conn)
+    create_meta_table(conn)
+
+# ─────────────────────────────
+# 2. マイグレーション（PRAGMA user_version で適用済みを管理）
+# ─────────────────────────────
+def _add_moving_average_column(conn: sqlite3.Connection):
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(transactions)")]
+    if "moving_average" not in cols:
+        conn.execute("ALTER TABLE transactions ADD COLUMN moving_average REAL")
 
+def _create_hot_path_indexes(conn: sqlite3.Connection):
+    # 銘柄ごとの取引履歴（WHERE security_id=? ORDER BY txn_date, transaction_id）
+    # transaction_id は rowid なのでインデックス末尾に暗黙で含まれる
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_transactions_security_date
+        ON transactions (security_id, txn_date);
+    """)
+    # 期間指定の取引一覧（WHERE txn_date >= ? AND txn_date < ?）
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_transactions_date
+        ON transactions (txn_date);
+    """)
+    # latest_prices ビューの GROUP BY security_id / MAX(quote_date) 用のカバリングインデックス
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_price_quotes_security_date
+        ON price_quotes (security_id, quote_date, close_price);
+    """)
+
+def _materialize_positions(conn: sqlite3.Connection):
+    # positions_current を全件から作り、2 つのビューをその上に載せ替える
+    # （毎回 transactions / price_quotes 全体を集計していた処理を O(銘柄数) にする）
+    rebuild_positions_current(conn)
+    conn.execute("DROP VIEW IF EXISTS v_positions;")
+    conn.execute("DROP VIEW IF EXISTS latest_prices;")
+    conn.execute("""
+    CREATE VIEW latest_prices AS
+    SELECT security_id,
+           market_price
+    FROM positions_current
+    WHERE market_price IS NOT NULL;
+    """)
+    conn.execute("""
+    CREATE VIEW v_positions AS
+    SELECT
+        s.d365_code          AS d365_code,
+        s.security_code      AS security_code,
+        s.security_name      AS security_name,
+        pc.holding_qty       AS holding_qty,
+        pc.avg_cost          AS avg_cost,
+        pc.market_price      AS market_price,
+        pc.valuation_diff    AS valuation_diff
+    FROM positions_current pc
+    JOIN securities s ON pc.security_id = s.security_id
+    WHERE EXISTS (SELECT 1 FROM transactions t WHERE t.security_id = pc.security_id);
+    """)
+
+def _unique_drop_judgement(conn: sqlite3.Connection):
+    # 同じ (銘柄コード, 年, 四半期) の重複は最後に登録したもの（id 最大）だけ残す
+    conn.execute("""
+    DELETE FROM drop_judgement
+    WHERE id NOT IN (
+        SELECT MAX(id) FROM drop_judgement GROUP BY security_code, year, quarter
+    );
+    """)
+    conn.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_drop_judgement_period
+        ON drop_judgement (security_code, year, quarter);
+    """)
+
+def _create_price_ingest_checkpoints(conn: sqlite3.Connection):
+    # 株価バックフィル（ingest_prices.py）の進捗。job は対象期間 'YYYY-MM-DD:YYYY-MM-DD'
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS price_ingest_checkpoints (
+        job          TEXT    NOT NULL,
+        security_id  INTEGER NOT NULL,
+        inserted     INTEGER NOT NULL,     -- この銘柄で追加した price_quotes の件数
+        finished_at  DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (job, security_id),
+        FOREIGN KEY (security_id) REFERENCES securities(security_id) ON DELETE CASCADE
+    );
+    """)
+
+def _create_price_quote_coverage(conn: sqlite3.Connection):
+    # 株価バックフィルで取得済みの期間（銘柄ごと・両端含む）。
+    # 休日は price_quotes に行が無いので、行の有無だけでは取得済みかどうか分からない
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS price_quote_coverage (
+        security_id  INTEGER NOT NULL,
+        start_date   DATE    NOT NULL,
+        end_date     DATE    NOT NULL,
+        PRIMARY KEY (security_id, start_date),
+        FOREIGN KEY (security_id) REFERENCES securities(security_id) ON DELETE CASCADE
+    );
+    """)
+
+# (version, 説明, 適用関数) の順で追加していく。適用済みの番号は変更しないこと。
+MIGRATIONS = [
+    (1, "transactions.moving_average 列を追加", _add_moving_average_column),
+    (2, "取引・株価の参照用インデックスを追加", _create_hot_path_indexes),
+    (3, "positions_current を作成し v_positions / latest_prices を載せ替え", _materialize_positions),
+    (4, "drop_judgement の重複を除き (security_code, year, quarter) を一意化", _unique_drop_judgement),
+    (5, "株価バックフィルの進捗テーブル price_ingest_checkpoints を作成", _create_price_ingest_checkpoints),
+    (6, "株価バックフィルの取得済み期間 price_quote_coverage を作成", _create_price_quote_coverage),
+]
+
+def migrate(conn: sqlite3.Connection, target: int | None = None) -> list[int]:
+    """
+    未適用のマイグレーションを順番に（target 指定時はそのバージョンまで）適用し、
+    適用したバージョン番号のリストを返す。
+    各マイグレーションは user_version の更新と同一トランザクションで実行する。
+    """
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    applied = []
+    for version, _, func in MIGRATIONS:
+        if version <= current or (target is not None and version > target):
+            continue
+        with conn:
+            func(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+        applied.append(version)
+    return applied
+
+def ensure_schema(conn: sqlite3.Connection):
+    """基本スキーマを作成し、未適用のマイグレーションがあれば適用する。"""
+    create_schema(conn)
     conn.commit()
+    migrate(conn)
+
+# ─────────────────────────────
+# 3. 主要クエリの実行計画チェック
+# ─────────────────────────────
+# 画面・バッチが実際に発行しているクエリ: 名前 → (SQL, パラメータ, 全件走査を禁止するテーブル/別名)
+HOT_QUERIES = {
+    "銘柄別の取引履歴": (
+        """
+        SELECT transaction_id, txn_type, quantity, price
+        FROM transactions
+        WHERE security_id = ?
+        ORDER BY txn_date, transaction_id
+        """,
+        (1,),
+        ("transactions",),
+    ),
+    "当期の取引一覧": (
+        """
+        SELECT t.txn_type, t.quantity, t.price, t.txn_date,
+               s.security_code, s.security_name
+        FROM transactions t
+        JOIN securities s ON t.security_id = s.security_id
+        WHERE t.txn_date >= ? AND t.txn_date < ?
+        ORDER BY t.txn_date
+        """,
+        ("2025-04-01", "2025-07-01"),
+        ("t",),
+    ),
+    "最新の移動平均": (
+        """
+        SELECT moving_average
+        FROM transactions t
+        JOIN securities s ON t.security_id = s.security_id
+        WHERE s.security_code = ?
+          AND moving_average IS NOT NULL
+        ORDER BY t.txn_date DESC, t.transaction_id DESC
+        LIMIT 1
+        """,
+        ("7203",),
+        ("t",),
+    ),
+    "最新株価ビュー": (
+        "SELECT security_id, market_price FROM latest_prices",
+        (),
+        ("price_quotes", "pq"),
+    ),
+}
+
+# インデックスを使わない全件走査（例: "SCAN t"）を検出する
+_FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+def explain_hot_queries(conn: sqlite3.Connection) -> dict[str, list[str]]:
+    """HOT_QUERIES それぞれの EXPLAIN QUERY PLAN を {名前: [detail, ...]} で返す。"""
+    plans = {}
+    for name, (sql, params, _) in HOT_QUERIES.items():
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        plans[name] = [r[3] for r in rows]
+    return plans
+
+def full_scans(plans: dict[str, list[str]]) -> dict[str, list[str]]:
+    """取引・株価テーブルを全件走査している行だけを抜き出す。"""
+    found = {}
+    for name, details in plans.items():
+        tables = HOT_QUERIES[name][2]
+        hits = [d for d in details
+                if (m := _FULL_SCAN.match(d)) and m.group(1) in tables]
+        if hits:
+            found[name] = hits
+    return found
+
+def explain_check() -> bool:
+    """
+    空のメモリ DB に基本スキーマを作り、インデックス追加のマイグレーション（_create_hot_path_indexes）
+    だけを挟んだ前後の実行計画を表示する（以降のマイグレーションは適用しない）。
+    インデックス追加後に全件走査が残っていなければ True。
+    """
+    index_version = next(v for v, _, func in MIGRATIONS if func is _create_hot_path_indexes)
+    conn = sqlite3.connect(":memory:")
+    create_schema(conn)
+    migrate(conn, target=index_version - 1)
+    before = explain_hot_queries(conn)
+    migrate(conn, target=index_version)
+    after = explain_hot_queries(conn)
+    conn.close()
+
+    for name in HOT_QUERIES:
+        print(f"■ {name}")
+        print("  before:")
+        for d in before[name]:
+            print(f"    {d}")
+        print("  after:")
+        for d in after[name]:
+            print(f"    {d}")
+
+    remaining = full_scans(after)
+    if remaining:
+        print("⚠️ インデックス追加後も全件走査が残っています:", remaining)
+        return False
+    print("✅ インデックス追加後は全件走査なし")
+    return True
+
+# ─────────────────────────────
+# 4. エントリポイント
+# ─────────────────────────────
+def main(db_path=DB):
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA foreign_keys = ON;")
+    create_schema(conn)
+    conn.commit()
+    applied = migrate(conn)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
     conn.close()
     print("🎉 スキーマ（1 ユーザー版）構築完了")
+    if applied:
+        print(f"  適用したマイグレーション: {applied}")
+    print(f"  スキーマバージョン: {version}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="スキーマ作成とマイグレーション")
+    parser.add_argument("--db", default=DB, help="SQLite ファイルのパス")
+    parser.add_argument("--explain", action="store_true",
+                        help="インデックス追加の前後の EXPLAIN QUERY PLAN を表示して終了")
+    args = parser.parse_args()
+
+    if args.explain:
+        sys.exit(0 if explain_check() else 1)
+    main(args.db)
@@ -0,0 +1,74 @@
+# listing_cache.py
+"""
+取引一覧ページ（売買結果一覧・取引チェック）用のキャッシュ付きローダー。
+
+transaction_queries の結果を st.cache_data に載せ、キーに data_version を含める。
+ウィジェット操作による再実行では data_version（app_meta の 1 行）だけを読み、
+書き込みが無ければ SQLite への問い合わせも日付の再パースも行わない。
+"""
+from datetime import date
+
+import pandas as pd
+import streamlit as st
+
+from data_version import get_data_version
+from db import get_pool
+from transaction_queries import (
+    PAGE_SIZE,
+    count_transactions,
+    fetch_transactions,
+    security_codes,
+    transaction_summary,
+)
+
+# 条件・ページの組み合わせごとに保持する上限
+MAX_ENTRIES = 256
+
+# ─────────────────────────────
+# 1. 型付け（読み込み時に 1 回だけ）
+# ─────────────────────────────
+def typed_transactions(df: pd.DataFrame) -> pd.DataFrame:
+    """txn_date を datetime64 に、security_code / txn_type をカテゴリ型にする。"""
+    if "txn_date" in df:
+        df["txn_date"] = pd.to_datetime(df["txn_date"], format="ISO8601")
+    for col in ("security_code", "txn_type"):
+        if col in df:
+            df[col] = df[col].astype("category")
+    return df
+
+def data_version(db_key: str) -> int:
+    """キャッシュキーに使う現在のデータバージョン（毎回の再実行で読むのはこの 1 行だけ）。"""
+    with get_pool(db_key).read() as conn:
+        return get_data_version(conn)
+
+# ─────────────────────────────
+# 2. キャッシュ付きの問い合わせ
+#    db_key（DB パス）と version をキーに含め、接続はプールから借りる
+# ─────────────────────────────
+@st.cache_data(max_entries=MAX_ENTRIES)
+def load_summary(db_key: str, version: int):
+    with get_pool(db_key).read() as conn:
+        return transaction_summary(conn)
+
+@st.cache_data(max_entries=MAX_ENTRIES)
+def load_security_codes(db_key: str, version: int) -> list[str]:
+    with get_pool(db_key).read() as conn:
+        return security_codes(conn)
+
+@st.cache_data(max_entries=MAX_ENTRIES)
+def load_count(db_key: str, version: int,
+               start_date: date, end_date: date, code: str | None) -> int:
+    with get_pool(db_key).read() as conn:
+        return count_transactions(conn, start_date, end_date, code)
+
+@st.cache_data(max_entries=MAX_ENTRIES)
+def load_page(db_key: str, version: int, columns: str,
+              start_date: date, end_date: date, code: str | None,
+              order_by: str, page: int) -> pd.DataFrame:
+    """表示する 1 ページ分を型付きで返す（page は 1 始まり）。"""
+    with get_pool(db_key).read() as conn:
+        df = fetch_transactions(
+            conn, columns, start_date, end_date, code,
+            order_by=order_by, limit=PAGE_SIZE, offset=(page - 1) * PAGE_SIZE
+        )
+    return typed_transactions(df)
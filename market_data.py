@@ -0,0 +1,298 @@
+# market_data.py
+"""
+yfinance の前段に置くローカルキャッシュ。
+
+- 銘柄情報（Ticker.info）は TTL 付きのスナップショットとして保存
+- 日足（OHLCV）は (ticker, date) 単位で保存し、取得済み期間を bar_coverage で管理
+- キャッシュに無い期間だけをプロバイダ（既定は yfinance）から取得する
+
+テストやオフライン環境では FixtureProvider（または環境変数 MARKET_DATA_FIXTURES）で
+ネットワークをローカルのファイルに差し替えられる。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+CACHE_DB = (Path(__file__).resolve().parent / "market_cache.db").resolve()
+
+# 銘柄情報スナップショットの有効期間（秒）
+INFO_TTL_SECONDS = 600
+
+BAR_COLUMNS = ["ticker", "date", "open", "high", "low", "close", "volume"]
+
+def to_ticker(code: str) -> str:
+    """'7203' → '7203.T'。既に市場サフィックスが付いていればそのまま返す。"""
+    return code if "." in code else f"{code}.T"
+
+# ─────────────────────────────
+# 1. プロバイダ（データの取得元）
+# ─────────────────────────────
+class YFinanceProvider:
+    """yfinance から銘柄情報・日足を取得する。"""
+
+    def info(self, ticker: str) -> dict:
+        import yfinance as yf
+        return dict(yf.Ticker(ticker).info or {})
+
+    def history(self, tickers: list[str], start: date, end: date) -> pd.DataFrame:
+        """start〜end（両端含む）の日足を BAR_COLUMNS 形式の縦持ち DataFrame で返す。"""
+        import yfinance as yf
+        df = yf.download(
+            tickers, start=start.isoformat(), end=(end + timedelta(days=1)).isoformat(),
+            interval="1d", group_by="ticker", progress=False, threads=True, auto_adjust=False
+        )
+        frames = []
+        for tk in tickers:
+            try:
+                sub = df[tk]
+            except KeyError:
+                continue
+            sub = sub.dropna(subset=["Close"])
+            if sub.empty:
+                continue
+            frames.append(pd.DataFrame({
+                "ticker": tk,
+                "date": pd.to_datetime(sub.index).strftime("%Y-%m-%d"),
+                "open": sub["Open"].to_numpy(),
+                "high": sub["High"].to_numpy(),
+                "low": sub["Low"].to_numpy(),
+                "close": sub["Close"].to_numpy(),
+                "volume": sub["Volume"].to_numpy(),
+            }))
+        if not frames:
+            return pd.DataFrame(columns=BAR_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+class FixtureProvider:
+    """
+    ネットワークの代わりにローカルのファイルを返すテスト用プロバイダ。
+
+    fixture_dir/info.json : {"7203.T": {"shortName": ..., "currentPrice": ...}, ...}
+    fixture_dir/bars.csv  : ticker,date,open,high,low,close,volume
+    calls には (メソッド名, 引数) が記録されるので、キャッシュが効いたかを確認できる。
+    """
+
+    def __init__(self, fixture_dir):
+        self.fixture_dir = Path(fixture_dir)
+        self.calls = []
+
+    def info(self, ticker: str) -> dict:
+        self.calls.append(("info", ticker))
+        path = self.fixture_dir / "info.json"
+        if not path.exists():
+            return {}
+        return json.loads(path.read_text(encoding="utf-8")).get(ticker, {})
+
+    def history(self, tickers: list[str], start: date, end: date) -> pd.DataFrame:
+        self.calls.append(("history", tuple(tickers), start, end))
+        path = self.fixture_dir / "bars.csv"
+        if not path.exists():
+            return pd.DataFrame(columns=BAR_COLUMNS)
+        df = pd.read_csv(path, dtype={"ticker": str, "date": str})
+        mask = (
+            df["ticker"].isin(tickers)
+            & (df["date"] >= start.isoformat())
+            & (df["date"] <= end.isoformat())
+        )
+        return df.loc[mask, BAR_COLUMNS].reset_index(drop=True)
+
+# ─────────────────────────────
+# 2. キャッシュ本体
+# ─────────────────────────────
+class MarketDataCache:
+    """
+    銘柄情報と日足のローカルキャッシュ（SQLite）。
+    当日分の日足は確定していないため取得済み期間には含めず、毎回取り直す。
+    """
+
+    def __init__(self, cache_path=CACHE_DB, provider=None, info_ttl: int = INFO_TTL_SECONDS):
+        self.cache_path = str(cache_path)
+        self.provider = provider or YFinanceProvider()
+        self.info_ttl = info_ttl
+        with self._connect() as conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS info_cache (
+                ticker      TEXT PRIMARY KEY,
+                fetched_at  REAL NOT NULL,     -- UNIX 秒
+                payload     TEXT NOT NULL      -- Ticker.info の JSON
+            );
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS daily_bars (
+                ticker  TEXT NOT NULL,
+                date    DATE NOT NULL,
+                open    REAL,
+                high    REAL,
+                low     REAL,
+                close   REAL NOT NULL,
+                volume  REAL,
+                PRIMARY KEY (ticker, date)
+            );
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS bar_coverage (
+                ticker      TEXT NOT NULL,
+                start_date  DATE NOT NULL,
+                end_date    DATE NOT NULL,     -- 両端含む。取得済みの期間
+                PRIMARY KEY (ticker, start_date)
+            );
+            """)
+
+    @contextmanager
+    def _connect(self):
+        # 呼び出しごとに接続し、抜けるときに commit して閉じる（スレッドをまたいで共有しない）
+        conn = sqlite3.connect(self.cache_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # ── 銘柄情報 ─────────────────────────────
+    def get_info(self, ticker: str, max_age: int | None = None) -> dict:
+        """TTL 内のスナップショットがあればそれを、無ければ取得して保存したものを返す。"""
+        max_age = self.info_ttl if max_age is None else max_age
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT fetched_at, payload FROM info_cache WHERE ticker = ?", (ticker,)
+            ).fetchone()
+        if row and time.time() - row[0] <= max_age:
+            return json.loads(row[1])
+
+        info = self.provider.info(ticker)
+        if info:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO info_cache (ticker, fetched_at, payload) VALUES (?, ?, ?)",
+                    (ticker, time.time(), json.dumps(info, default=str))
+                )
+        return info
+
+    # ── 日足 ─────────────────────────────────
+    def missing_ranges(self, ticker: str, start: date, end: date) -> list[tuple[date, date]]:
+        """start〜end のうち、まだ取得していない期間（両端含む）のリストを返す。"""
+        with self._connect() as conn:
+            covered = conn.execute(
+                """
+                SELECT start_date, end_date FROM bar_coverage
+                WHERE ticker = ? AND end_date >= ? AND start_date <= ?
+                ORDER BY start_date
+                """,
+                (ticker, start.isoformat(), end.isoformat())
+            ).fetchall()
+
+        gaps = []
+        cursor = start
+        for s, e in covered:
+            s, e = date.fromisoformat(s), date.fromisoformat(e)
+            if s > cursor:
+                gaps.append((cursor, min(s - timedelta(days=1), end)))
+            cursor = max(cursor, e + timedelta(days=1))
+            if cursor > end:
+                break
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def _mark_covered(self, conn, ticker: str, start: date, end: date):
+        """取得済み期間を追加し、重なる・隣接する期間を 1 つにまとめる。"""
+        rows = conn.execute(
+            """
+            SELECT start_date, end_date FROM bar_coverage
+            WHERE ticker = ? AND end_date >= ? AND start_date <= ?
+            """,
+            (ticker, (start - timedelta(days=1)).isoformat(), (end + timedelta(days=1)).isoformat())
+        ).fetchall()
+        for s, e in rows:
+            start = min(start, date.fromisoformat(s))
+            end = max(end, date.fromisoformat(e))
+        conn.execute(
+            "DELETE FROM bar_coverage WHERE ticker = ? AND start_date >= ? AND start_date <= ?",
+            (ticker, start.isoformat(), end.isoformat())
+        )
+        conn.execute(
+            "INSERT INTO bar_coverage (ticker, start_date, end_date) VALUES (?, ?, ?)",
+            (ticker, start.isoformat(), end.isoformat())
+        )
+
+    def get_history(self, tickers: list[str], start: date, end: date | None = None) -> pd.DataFrame:
+        """
+        tickers の start〜end（両端含む）の日足を BAR_COLUMNS 形式で返す。
+        未取得の期間だけをプロバイダから取得し、同じ期間が欠けている銘柄はまとめて 1 回で取得する。
+        """
+        today = date.today()
+        end = min(end or today, today)
+
+        # 欠けている期間ごとに銘柄をまとめる
+        gaps: dict[tuple[date, date], list[str]] = {}
+        for tk in tickers:
+            for gap in self.missing_ranges(tk, start, end):
+                gaps.setdefault(gap, []).append(tk)
+
+        for (gap_start, gap_end), gap_tickers in gaps.items():
+            bars = self.provider.history(gap_tickers, gap_start, gap_end)
+            # 取得済みとするのは実際に日足が返ってきた銘柄だけ（yfinance は銘柄ごとの取得失敗を
+            # 例外にしないので、返ってこなかった銘柄は次回また取りにいく）。期間の末尾が週末・休日でも
+            # 取り直さないよう、返ってきた銘柄は要求した期間の終わりまで（当日分は未確定なので前日まで）とする
+            returned = bars["ticker"].unique()
+            covered_end = min(gap_end, today - timedelta(days=1))
+            with self._connect() as conn:
+                conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO daily_bars
+                        (ticker, date, open, high, low, close, volume)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    bars[BAR_COLUMNS].itertuples(index=False, name=None)
+                )
+                if covered_end >= gap_start:
+                    for tk in returned:
+                        self._mark_covered(conn, tk, gap_start, covered_end)
+
+        if not tickers:
+            return pd.DataFrame(columns=BAR_COLUMNS)
+        placeholders = ",".join("?" * len(tickers))
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                f"""
+                SELECT {", ".join(BAR_COLUMNS)}
+                FROM daily_bars
+                WHERE ticker IN ({placeholders}) AND date BETWEEN ? AND ?
+                ORDER BY ticker, date
+                """,
+                conn,
+                params=(*tickers, start.isoformat(), end.isoformat())
+            )
+
+    def latest_close(self, tickers: list[str], lookback_days: int = 7) -> dict[str, float | None]:
+        """直近 lookback_days 日の中で最も新しい終値を {ticker: close} で返す（無ければ None）。"""
+        today = date.today()
+        bars = self.get_history(tickers, today - timedelta(days=lookback_days), today)
+        latest = bars.groupby("ticker")["close"].last().to_dict()
+        return {tk: (float(latest[tk]) if tk in latest else None) for tk in tickers}
+
+# ─────────────────────────────
+# 3. 共有インスタンス
+# ─────────────────────────────
+_default_cache = None
+_default_lock = threading.Lock()
+
+def get_market_data() -> MarketDataCache:
+    """
+    プロセス内で共有する MarketDataCache を返す。
+    環境変数 MARKET_DATA_FIXTURES が設定されていればそのディレクトリの FixtureProvider を使う。
+    """
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            fixtures = os.environ.get("MARKET_DATA_FIXTURES")
+            provider = FixtureProvider(fixtures) if fixtures else None
+            _default_cache = MarketDataCache(provider=provider)
+        return _default_cache
@@ -1,9 +1,14 @@
-import sqlite3
-import yfinance as yf
 from datetime import date
+import pandas as pd
 import streamlit as st
 from pathlib import Path
 
+from data_version import bump_data_version
+from db import get_pool
+from import_trades import import_trades, read_trades, validate_trades
+from position_ledger import record_transaction
+from security_resolver import get_resolver
+
 # --------------------------------------------------
 # 1) DB ファイルのパスを定義
 # --------------------------------------------------
@@ -50,8 +55,14 @@ def fetch_callback():
     if not code:
         return
 
-    # yfinance から情報を取得し、セッションステートに格納する（１回だけ実行）
-    info = fetch(code)                             # ← 変更：fetch() をここで呼ぶ
+    # 登録済み → キャッシュ → yfinance の順に取得し、セッションステートに格納する（１回だけ実行）
+    try:
+        info = fetch(code)                         # ← 変更：fetch() をここで呼ぶ
+    except TimeoutError:
+        st.error("銘柄情報の取得がタイムアウトしました。少し待ってからもう一度お試しください")
+        st.session_state.latest_info = None
+        st.session_state.stage = "input"
+        return
     st.session_state.latest_info = info            # ← 変更：取得結果を保存
 
     # 銘柄名が取れなかったらステージを戻す
@@ -63,6 +74,11 @@ def fetch_callback():
         st.session_state.stage = "info"             # ← 変更：ステージを遷移
 
 
+def prefetch_callback():
+    # 入力が確定したら（Enter・フォーカスが外れたとき）銘柄情報を裏で取得し始める
+    # （Enter で確定してからボタンを押せば、押した時点で取得が済んでいることが多い）
+    get_resolver(db_path).prefetch(st.session_state.code)
+
 def register_callback():
     st.session_state.stage = "registered"
 
@@ -84,34 +100,26 @@ def set_code_callback(selected_code: str):
     # 例: st.session_state.stage = "info"
 
 # --------------------------------------------------
-# 4) DB 接続を返す関数（キャッシュ付き。外で明示的に close() する）
+# 4) DB 接続プール（読み取りはプールから、書き込みは 1 本の接続を排他で使う）
+#    初回取得時に累積状態テーブル・インデックス等のマイグレーションも適用される
 # --------------------------------------------------
-@st.cache_resource(show_spinner=False)
-def conn():
-    c = sqlite3.connect(db_path, check_same_thread=False)
-    c.execute("PRAGMA foreign_keys = ON;")
-    return c
+pool = get_pool(db_path)
 
 # --------------------------------------------------
-# 5) yfinance から銘柄情報を取得（キャッシュ付き）
+# 5) 銘柄情報を取得（登録済みの securities → TTL キャッシュ → yfinance の順）
 # --------------------------------------------------
-# キャッシュ用。必要ならコメントアウトを外す。
-# @st.cache_data(ttl=600)
-
 def fetch(code: str):
-    q = f"{code}.T" if not code.endswith(".T") else code
-    t = yf.Ticker(q).info
-    return {
-        "security_code": code,
-        "d365_code": code,
-        "security_name": t.get("shortName", ""),
-        "market_price": t.get("currentPrice", None)
-    }
+    """
+    security_resolver で銘柄情報を引く。見つからなければ None。
+    yfinance の応答が NETWORK_TIMEOUT 秒を超えたら TimeoutError。
+    """
+    return get_resolver(db_path).resolve(code)
 
 # --------------------------------------------------
 # 6) securities テーブルに存在確認 → ID を返す（なければ INSERT）
 # --------------------------------------------------
 def ensure_security(cn, row):
+    """commit は呼び出し側（pool.write()）で行う。"""
     cur = cn.execute(
         "SELECT security_id FROM securities WHERE security_code=?", (row["security_code"],)
     ).fetchone()
@@ -121,7 +129,7 @@ def ensure_security(cn, row):
         "INSERT INTO securities (security_code, d365_code, security_name) VALUES (?,?,?)",
         (row["security_code"], row["d365_code"], row["security_name"])
     )
-    cn.commit()
+    bump_data_version(cn)
     return cur.lastrowid
 
 # --------------------------------------------------
@@ -129,13 +137,9 @@ def ensure_security(cn, row):
 # --------------------------------------------------
 @st.cache_data(ttl=600)
 def get_security_codes():
-    c = conn()
-    try:
+    with pool.read() as c:
         rows = c.execute("SELECT security_code FROM securities").fetchall()
-        return [str(r[0]) for r in rows]
-    finally:
-        # キャッシュされた conn() は close しない
-        pass
+    return [str(r[0]) for r in rows]
 
 # --------------------------------------------------
 # 8) 画面描画
@@ -148,6 +152,7 @@ st.text_input(
     label="銘柄コード（例 7203）",
     key="code",  
     placeholder="ここにコードを入力",
+    on_change=prefetch_callback,
 )
 
 st.button(
@@ -175,6 +180,8 @@ if st.session_state.stage == "info":
 
     # 銘柄名と現在値を表示
     st.success(f"{info['security_name']}   現在値: {info['market_price']} 円")
+    if info.get("source") == "local":
+        st.caption("登録済みの銘柄です（現在値は price_quotes の最新株価）")
 
     # 売買タイプ
     st.radio("売買タイプ", ["BUY", "SEL"], horizontal=True, key="txn_type")
@@ -193,7 +200,7 @@ if st.session_state.stage == "info":
         "株価",
         min_value=0.0,
         step=1.0,
-        value=st.session_state.price or float(info["market_price"]),
+        value=st.session_state.price or float(info["market_price"] or 0.0),
         key="price",
     )
 
@@ -210,67 +217,24 @@ if st.session_state.stage == "info":
 # 【3】 ステージ "registered" のとき：DB に INSERT ＆ フォームリセット
 # --------------------------------------------------
 if st.session_state.stage == "registered":
-    c = None
     try:
-        c = conn()
-
-        # securities テーブルに存在確認 → sid を取得（なければ INSERT）
-        # sid = ensure_security(c, fetch(st.session_state.code))
-        sid = ensure_security(c, st.session_state.latest_info)
-
         # 取引日を文字列化（"YYYY-MM-DD"）
         txn_date_str = st.session_state.txn_date.strftime("%Y-%m-%d")
 
-        # 過去の取引履歴を取得（同一銘柄、BUY/SEL両方）
-        cur = c.execute(
-            "SELECT txn_type, quantity, price FROM transactions WHERE security_id=? ORDER BY txn_date, transaction_id",
-            (sid,)
-        )
-        rows = cur.fetchall()
-        # 保有株数・保有コストを計算
-        holding_qty = 0.0
-        holding_cost = 0.0
-        for txn_type, qty, price in rows:
-            if txn_type == "BUY":
-                holding_cost += qty * price
-                holding_qty += qty
-            elif txn_type == "SEL":
-                if holding_qty > 0:
-                    # 売却分のコストは直近の平均単価で減算
-                    avg = holding_cost / holding_qty if holding_qty > 0 else 0
-                    sell_qty = min(qty, holding_qty)
-                    holding_cost -= avg * sell_qty
-                    holding_qty -= sell_qty
-        # 今回の取引を反映
-        if st.session_state.txn_type == "BUY":
-            holding_cost += st.session_state.qty * st.session_state.price
-            holding_qty += st.session_state.qty
-        elif st.session_state.txn_type == "SEL":
-            if holding_qty > 0:
-                avg = holding_cost / holding_qty if holding_qty > 0 else 0
-                sell_qty = min(st.session_state.qty, holding_qty)
-                holding_cost -= avg * sell_qty
-                holding_qty -= sell_qty
-        moving_average = holding_cost / holding_qty if holding_qty > 0 else 0
-
-        # INSERT 文を実行（moving_averageカラムを追加）
-        c.execute(
-            """
-            INSERT INTO transactions
-                (security_id, txn_type, quantity, price, txn_date, moving_average)
-            VALUES
-                (?, ?, ?, ?, ?, ?)
-            """,
-            (
+        # 銘柄の登録・取引の INSERT・累積状態 (position_state) の更新を同一トランザクションで実行
+        # 最終取引日以降なら O(1)、遡り登録は直近チェックポイントから再計算
+        with pool.write() as c:
+            # securities テーブルに存在確認 → sid を取得（なければ INSERT）
+            # sid = ensure_security(c, fetch(st.session_state.code))
+            sid = ensure_security(c, st.session_state.latest_info)
+            record_transaction(
+                c,
                 sid,
                 st.session_state.txn_type,
                 st.session_state.qty,
                 st.session_state.price,
                 txn_date_str,
-                moving_average
             )
-        )
-        c.commit()
         st.success("登録しました ✅")
         # reset_callback()
         st.session_state.stage = "input"
@@ -316,3 +280,46 @@ if st.session_state.stage == "registered":
 
 # else:
 #     st.write("過去の銘柄コードはまだ登録されていません。")
+
+# 【5】 約定 CSV の一括登録（証券会社の約定ファイルをまとめて取り込む）
+# --------------------------------------------------
+st.markdown("---")
+st.subheader("📂 約定 CSV の一括登録")
+st.caption("列: 約定日 / 銘柄コード / 売買 / 数量 / 単価（銘柄名は任意）。未登録の銘柄は CSV の銘柄名で登録します。")
+
+uploaded = st.file_uploader("約定 CSV", type=["csv"], key="trades_csv")
+if uploaded is not None:
+    try:
+        trades, errors = validate_trades(read_trades(uploaded.getvalue()))
+    except ValueError as e:
+        st.error(str(e))
+        st.stop()
+
+    st.write(f"{len(trades) + len(errors):,} 行中 {len(trades):,} 行が有効です。")
+    if errors:
+        st.warning(f"{len(errors):,} 行は不正なため登録しません。")
+        st.dataframe(
+            pd.DataFrame(errors, columns=["行", "理由"]).head(100),
+            use_container_width=True,
+            hide_index=True
+        )
+    skip_existing = st.checkbox("登録済みと同じ取引は登録しない（同じファイルの取り込み直し用）", value=True)
+
+    if st.button("一括登録する", disabled=trades.empty):
+        try:
+            # 全件の INSERT と、影響のあった銘柄の moving_average の再計算を同一トランザクションで実行
+            with pool.write() as c:
+                stats = import_trades(c, trades, skip_existing)
+        except Exception as e:
+            st.error(f"一括登録に失敗しました（何も登録していません）: {e}")
+        else:
+            rate = stats["inserted"] / stats["seconds"] if stats["seconds"] else 0
+            st.success(
+                f"{stats['inserted']:,} 件を登録しました ✅（新規銘柄 {stats['new_securities']:,} / "
+                f"再計算 {stats['securities']:,} 銘柄 / {stats['seconds']:.2f} 秒・{rate:,.0f} 件/秒）"
+            )
+            if stats["skipped"]:
+                st.info(f"登録済みと同じ {stats['skipped']:,} 件は飛ばしました。")
+            if stats["stale_snapshots"]:
+                st.info("作成済みの期末スナップショットより前の取引を含みます。"
+                        "`python snapshots.py --full` で作り直してください。")
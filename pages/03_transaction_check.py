@@ -1,39 +1,28 @@
 # transaction_check.py
 from pathlib import Path
-from datetime import date
 
-import sqlite3
 import pandas as pd
 import streamlit as st
 
+from db import get_pool
+from export_ui import export_buttons
+from listing_cache import (
+    data_version,
+    load_count,
+    load_page,
+    load_security_codes,
+    load_summary,
+)
+from transaction_queries import PAGE_SIZE, TRANSACTION_CHECK_COLUMNS, iter_transactions
+
 # ─────────────────────────────
 # DB パスを決定
 # ─────────────────────────────
 DB = "../app.db"
 db_path = (Path(__file__).resolve().parent / DB).resolve()
 
-def load_transactions_with_security_code(db_file: Path) -> pd.DataFrame:
-    try:
-        conn = sqlite3.connect(db_file)
-        df_txn = pd.read_sql_query("SELECT * FROM transactions", conn)
-        df_sec = pd.read_sql_query(
-            "SELECT security_id, security_code FROM securities",
-            conn
-        )
-
-        conn.close()
-
-        # ③ security_id でマージし、「security_code」列を結合
-        df = df_txn.merge(df_sec, on="security_id", how="left")
-
-        # マージ結果として security_code が欠損するケースがあれば埋める（例: 未登録時は "不明"）
-        df["security_code"] = df["security_code"].fillna("不明")
-
-        return df
-
-    except Exception as e:
-        st.error(f"DB からの読み込みに失敗しました: {e}")
-        return pd.DataFrame()
+# 一覧の並び順：日付降順
+ORDER_BY = "t.txn_date DESC, t.transaction_id DESC"
 
 # ─────────────────────────────
 # Streamlit UI
@@ -41,67 +30,70 @@ def load_transactions_with_security_code(db_file: Path) -> pd.DataFrame:
 st.set_page_config(page_title="取引チェック（開発用）", layout="wide")
 st.title("🛠️ 取引トランザクション確認（銘柄コード付き）")
 
-# 3-1. データ取得（結合済みの DataFrame を返す関数を呼ぶ）
-df = load_transactions_with_security_code(db_path)
-if df.empty:
+# 3-1. 概要（件数・最古/最新の取引日は集計クエリで取得）
+try:
+    # 書き込みがあったときだけ増えるカウンタ。以降のキャッシュキーに含める
+    key = (str(db_path), data_version(str(db_path)))
+    total, oldest, newest = load_summary(*key)
+except Exception as e:
+    st.error(f"DB からの読み込みに失敗しました: {e}")
     st.stop()
 
-# 3-2. 基本統計（txn_date を文字列に変換して st.metric に渡す）
+if total == 0:
+    st.stop()
+
+# 3-2. 基本統計
 st.subheader("概要")
 col1, col2, col3 = st.columns(3)
-
-# 件数
-col1.metric("件数", f"{len(df):,}")
-
-# txn_date から最古・最新の日付を求め、文字列に変換して表示
-oldest = pd.to_datetime(df["txn_date"]).min().date()
-newest = pd.to_datetime(df["txn_date"]).max().date()
+col1.metric("件数", f"{total:,}")
 col2.metric("最古の取引日", oldest.strftime("%Y-%m-%d"))
 col3.metric("最新の取引日", newest.strftime("%Y-%m-%d"))
 
-# 3-3. フィルタ（期間 & 銘柄コード）
+# 3-3. フィルタ（期間 & 銘柄コード）→ SQL の WHERE 句に渡す
 st.subheader("フィルタ")
-min_d = pd.to_datetime(df["txn_date"]).min()
-max_d = pd.to_datetime(df["txn_date"]).max()
-
 start_date = st.date_input(
     "開始日",
-    value=min_d.date(),
-    min_value=min_d.date(),
-    max_value=max_d.date()
+    value=oldest,
+    min_value=oldest,
+    max_value=newest
 )
 end_date = st.date_input(
     "終了日",
-    value=max_d.date(),
-    min_value=max_d.date(),
-    max_value=max_d.date()
+    value=newest,
+    min_value=oldest,
+    max_value=newest
 )
 
-# 「security_code（銘柄コード）」で選べるようにユニーク値を取得
-codes = ["すべて"] + sorted(df["security_code"].dropna().unique().tolist())
+codes = ["すべて"] + load_security_codes(*key)
 sel_code = st.selectbox("銘柄コード（security_code）", codes)
+code = None if sel_code == "すべて" else sel_code
 
-# 期間フィルタと銘柄コードフィルタをマスクにまとめる
-mask = pd.to_datetime(df["txn_date"]).dt.date.between(start_date, end_date)
-if sel_code != "すべて":
-    mask &= (df["security_code"] == sel_code)
+# 件数とページ指定
+matched = load_count(*key, start_date, end_date, code)
+n_pages = max(1, -(-matched // PAGE_SIZE))
 
-# フィルタ後のデータを日付降順にソート
-view = df.loc[mask].sort_values("txn_date", ascending=False)
-view = view.reset_index(drop=True)
-view.index = pd.RangeIndex(start=1, stop=len(view)+1, step=1)
+col1, col2 = st.columns(2)
+col1.metric("該当件数", f"{matched:,}")
+page = col2.number_input(f"ページ（全 {n_pages} ページ）", min_value=1, max_value=n_pages, value=1, step=1)
+
+# 日付降順で表示中のページ分だけ取得
+offset = (page - 1) * PAGE_SIZE
+view = load_page(*key, TRANSACTION_CHECK_COLUMNS, start_date, end_date, code, ORDER_BY, page)
+view = view.set_axis(pd.RangeIndex(start=offset + 1, stop=offset + len(view) + 1, step=1))
 
 # 3-4. テーブル表示
 st.subheader("トランザクション一覧")
 # DataFrame には以下のような列が含まれている想定です:
 #   transaction_id / security_id / txn_type / quantity / price / txn_date / security_code
-st.dataframe(view, use_container_width=True)
-
-# 3-5. CSV ダウンロード
-csv = view.to_csv(index=False).encode("utf-8-sig")
-st.download_button(
-    "CSV でダウンロード",
-    data=csv,
-    file_name="transactions_with_security_code.csv",
-    mime="text/csv"
+st.dataframe(
+    view,
+    use_container_width=True,
+    column_config={"txn_date": st.column_config.DateColumn("txn_date", format="YYYY-MM-DD")}
 )
+
+# 3-5. ダウンロード（フィルタに一致する全件を CSV / Parquet に。ボタン押下時のみ、チャンク単位で書き出す）
+def export_chunks():
+    with get_pool(db_path).read() as conn:
+        yield from iter_transactions(conn, TRANSACTION_CHECK_COLUMNS, start_date, end_date, code, ORDER_BY)
+
+export_buttons(export_chunks, "transactions_with_security_code")
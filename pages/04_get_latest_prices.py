@@ -5,7 +5,12 @@ import sqlite3
 
 import streamlit as st
 import pandas as pd
-import yfinance as yf
+from analytics import securities
+from db import get_pool
+from export import frame_chunks
+from export_ui import export_buttons
+from market_data import get_market_data, to_ticker
+from positions_current import apply_prices
 
 # ──────────────────────────────────────────
 # 0) 設定：DB のパスを決定
@@ -14,17 +19,11 @@ DB = "../app.db"
 db_path = (Path(__file__).resolve().parent / DB).resolve()
 
 # ──────────────────────────────────────────
-# 1) SQLite から接続を取得する関数
+# 1) SQLite の接続プール
 # ──────────────────────────────────────────
-@st.cache_resource
-def get_conn():
-    """
-    DB に接続し、foreign_keys を有効化したコネクションを返す。
-    Streamlit セッション中は同じ接続を使いまわす。
-    """
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
+# 読み取りは pool.read()、書き込みは pool.write()（1 本の接続を排他で使い、抜けるときに commit）
+# 初回取得時に未適用のマイグレーションも適用される
+pool = get_pool(db_path)
 
 # ──────────────────────────────────────────
 # 2) 当日の価格データ登録状況を取得する関数
@@ -32,17 +31,16 @@ def get_conn():
 def load_today_quotes_ids() -> set[int]:
     """
     今日の日付で price_quotes に登録されている security_id のセットを返す。
-    get_conn() を使って内部で接続を取得するため、
-    引数に conn を受け取らなくてもよい。
+    接続はプールから借りるため、引数に conn を受け取らなくてもよい。
     """
-    conn = get_conn()
     today_str = date.today().isoformat()
     query = """
         SELECT security_id
         FROM price_quotes
         WHERE quote_date = ?
     """
-    df = pd.read_sql_query(query, conn, params=(today_str,))
+    with pool.read() as conn:
+        df = pd.read_sql_query(query, conn, params=(today_str,))
     return set(df["security_id"].tolist())
 
 # ──────────────────────────────────────────
@@ -52,36 +50,73 @@ def load_today_quotes_ids() -> set[int]:
 def load_securities() -> pd.DataFrame:
     """
     securities テーブルから (security_id, security_code, security_name) を読み込んで返す。
-    中で get_conn() を呼び出すので引数は不要。
-    """
-    conn = get_conn()
-    query = """
-        SELECT security_id, security_code, security_name
-        FROM securities
-        ORDER BY security_code
+    接続はプールから借りるので引数は不要。
     """
-    df = pd.read_sql_query(query, conn)
-    return df
+    with pool.read() as conn:
+        return securities(conn)
 
 # ──────────────────────────────────────────
 # 4) yfinance で当日終値を取得する関数
 # ──────────────────────────────────────────
 # @st.cache_data(ttl=900, show_spinner="最新株価を取得中…")
 def fetch_price_yfinance(code: str) -> float | None:
-    tk = code if "." in code else f"{code}.T"
+    tk = to_ticker(code)
     try:
-        # 直近 5 日で取得してみる
-        df = yf.download(
-            tk, period="5d", interval="1d",
-            progress=False, threads=False, auto_adjust=False
-        )
-        # データが無ければ None
-        if df.empty or df["Close"].dropna().empty:
-            return None
-        return float(df["Close"].dropna().iloc[-1])
+        # 直近 1 週間の日足から最新終値を取得（取得済みの日はローカルキャッシュを使う）
+        return get_market_data().latest_close([tk])[tk]
     except Exception:
         return None
 
+# ──────────────────────────────────────────
+# 4-2) 複数銘柄をまとめて取得する関数
+# ──────────────────────────────────────────
+# 1 回の取得でまとめるティッカー数
+BULK_CHUNK_SIZE = 50
+
+def fetch_prices_bulk(codes: list[str], chunk_size: int = BULK_CHUNK_SIZE,
+                      on_progress=None) -> dict[str, float | None]:
+    """
+    codes を chunk_size 件ずつまとめて取得し（キャッシュに無い期間だけ 1 回の yf.download）、
+    { '7203': 3075.5, '9999': None, ... } の辞書を返す（取得失敗は None）。
+    on_progress(完了件数, 全件数, code) を銘柄ごとに呼び出す。
+    """
+    market_data = get_market_data()
+    results: dict[str, float | None] = {}
+    done = 0
+    for i in range(0, len(codes), chunk_size):
+        chunk = codes[i:i + chunk_size]
+        tickers = {code: to_ticker(code) for code in chunk}
+        try:
+            closes = market_data.latest_close(list(tickers.values()))
+        except Exception:
+            closes = {}
+
+        for code, tk in tickers.items():
+            results[code] = closes.get(tk)
+            done += 1
+            if on_progress:
+                on_progress(done, len(codes), code)
+    return results
+
+def insert_prices(rows: list[tuple[str, int, float]]) -> set[int]:
+    """
+    (quote_date, security_id, close_price) のリストを 1 つのトランザクションで登録し、
+    実際に追加した security_id のセットを返す。
+    既に登録済みの (quote_date, security_id) は上書きしないので（別タブ・別プロセスで先に登録された場合など）、
+    positions_current の最新株価へは実際に追加した行だけ反映する。
+    """
+    with pool.write() as conn:
+        added = []
+        for row in rows:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO price_quotes (quote_date, security_id, close_price) VALUES (?, ?, ?)",
+                row
+            )
+            if cur.rowcount:
+                added.append(row)
+        apply_prices(conn, added)
+    return {sec_id for _, sec_id, _ in added}
+
 # ──────────────────────────────────────────
 # 5) Streamlit 画面の構築
 # ──────────────────────────────────────────
@@ -122,12 +157,70 @@ st.markdown("---")
 # 5) 「登録されていない銘柄」に対して価格取得ボタンを用意
 st.subheader("未登録銘柄の価格を取得して price_quotes に追加")
 
+# 直前の一括取得の結果（成否の内訳）
+bulk_result = st.session_state.pop("bulk_fetch_result", None)
+if bulk_result:
+    failed = [r for r in bulk_result["rows"] if r["結果"] == "取得失敗"]
+    skipped = [r for r in bulk_result["rows"] if r["結果"] == "登録済みのためスキップ"]
+    st.success(f"一括取得: {bulk_result['inserted']} 件を price_quotes に追加しました。")
+    if skipped:
+        st.info(f"{len(skipped)} 件は既に今日の株価が登録されていたためスキップしました。")
+    if failed:
+        st.error(f"{len(failed)} 件の株価取得に失敗しました。")
+    st.dataframe(pd.DataFrame(bulk_result["rows"]), use_container_width=True)
+
 df_not_registered = df_securities[df_securities["security_id"].apply(lambda i: i not in today_ids)]
 
 if df_not_registered.empty:
     st.success("今日未登録の銘柄はありません。すべて登録済みです。")
 else:
     st.write(f"未登録銘柄数: {len(df_not_registered)} 件")
+
+    # まとめて取得：全未登録銘柄を一括ダウンロード → 1 回の executemany で登録
+    if st.button("未登録銘柄の価格をまとめて取得", key="fetch_all_missing", type="primary"):
+        progress = st.progress(0.0, text="価格を取得中…")
+
+        def _on_progress(done, total, code):
+            progress.progress(done / total, text=f"{code} を取得しました（{done}/{total}）")
+
+        prices = fetch_prices_bulk(
+            df_not_registered["security_code"].tolist(), on_progress=_on_progress
+        )
+        quote_date = date.today().isoformat()
+        rows = [
+            (quote_date, int(sec_id), prices[code])
+            for sec_id, code in zip(df_not_registered["security_id"], df_not_registered["security_code"])
+            if prices.get(code) is not None
+        ]
+        try:
+            inserted_ids = insert_prices(rows)
+        except Exception as e:
+            st.error(f"登録中にエラーが発生しました: {e}")
+            inserted_ids = set()
+
+        def _result(sec_id, code):
+            if prices.get(code) is None:
+                return "取得失敗"
+            return "登録" if int(sec_id) in inserted_ids else "登録済みのためスキップ"
+
+        # 結果（銘柄ごとの成否）をリロード後も表示できるよう保存
+        st.session_state.bulk_fetch_result = {
+            "inserted": len(inserted_ids),
+            "rows": [
+                {
+                    "コード": code,
+                    "銘柄名": name,
+                    "終値": prices.get(code),
+                    "結果": _result(sec_id, code),
+                }
+                for sec_id, code, name in zip(df_not_registered["security_id"],
+                                              df_not_registered["security_code"],
+                                              df_not_registered["security_name"])
+            ],
+        }
+        st.rerun()
+
+    st.markdown("##### 個別に取得")
     for idx, row in df_not_registered.iterrows():
         sec_id   = row["security_id"]
         code     = row["security_code"]
@@ -149,13 +242,13 @@ else:
                     st.error(f"{code} の株価取得に失敗しました。")
                 else:
                     quote_date = date.today().isoformat()
-                    conn = get_conn()
                     try:
-                        conn.execute(
-                            "INSERT INTO price_quotes (quote_date, security_id, close_price) VALUES (?, ?, ?)",
-                            (quote_date, sec_id, price)
-                        )
-                        conn.commit()
+                        with pool.write() as conn:
+                            conn.execute(
+                                "INSERT INTO price_quotes (quote_date, security_id, close_price) VALUES (?, ?, ?)",
+                                (quote_date, sec_id, price)
+                            )
+                            apply_prices(conn, [(quote_date, int(sec_id), price)])
                         st.success(f"{code} を price_quotes に追加しました → {price} 円")
                     except sqlite3.IntegrityError:
                         st.warning(f"{code} は既に今日のデータが登録されています。")
@@ -170,21 +263,21 @@ st.markdown("---")
 # 登録済み銘柄の CSV ダウンロード
 st.subheader("今日登録された price_quotes 一覧 (CSV ダウンロード)")
 
-conn = get_conn()
-today_quote_df = pd.read_sql_query(
-    """
-    SELECT
-        pq.security_id,
-        s.security_code,
-        s.security_name,
-        pq.close_price
-    FROM price_quotes pq
-    JOIN securities s ON pq.security_id = s.security_id
-    WHERE pq.quote_date = ?
-    """,
-    conn,
-    params=(today_str,)
-)
+with pool.read() as conn:
+    today_quote_df = pd.read_sql_query(
+        """
+        SELECT
+            pq.security_id,
+            s.security_code,
+            s.security_name,
+            pq.close_price
+        FROM price_quotes pq
+        JOIN securities s ON pq.security_id = s.security_id
+        WHERE pq.quote_date = ?
+        """,
+        conn,
+        params=(today_str,)
+    )
 
 if today_quote_df.empty:
     st.info("今日の price_quotes データはまだありません。")
@@ -195,10 +288,8 @@ else:
     ]
     st.dataframe(today_quote_df, use_container_width=True)
 
-    csv = today_quote_df.to_csv(index=False).encode("utf-8-sig")
-    st.download_button(
-        "📥 今日の price_quotes を CSV ダウンロード",
-        data=csv,
-        file_name=f"price_quotes_{today_str}.csv",
-        mime="text/csv"
+    export_buttons(
+        lambda: frame_chunks(today_quote_df),
+        f"price_quotes_{today_str}",
+        label="📥 今日の price_quotes をダウンロード"
     )
\ No newline at end of file
@@ -1,10 +1,13 @@
 # quarterly_input.py
 from pathlib import Path
 from datetime import date
-import sqlite3
 
 import streamlit as st
-import pandas as pd
+
+from analytics import drop_report, judgement_history, period_snapshots, securities
+from data_version import bump_data_version
+from drop_detection import flagged, save_judgements
+from db import get_pool
 
 # ─────────────────────────────
 # 1. DB 接続ユーティリティ
@@ -12,28 +15,22 @@ import pandas as pd
 DB = "../app.db"
 db_path = (Path(__file__).resolve().parent / DB).resolve()
 
-@st.cache_resource
-def get_conn():
-    conn = sqlite3.connect(db_path, check_same_thread=False)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
+# 読み取りは pool.read()、書き込みは pool.write()（抜けるときに commit、例外なら rollback）
+# 初回取得時に未適用のマイグレーションも適用される
+pool = get_pool(db_path)
 
 # ─────────────────────────────
 # 2. 既存 securities / positions_quarter 一覧
 # ─────────────────────────────
 # @st.cache_data(ttl=600)
 def load_securities():
-    conn = get_conn()
-    df = pd.read_sql_query(
-        "SELECT security_id, security_code, security_name FROM securities", conn
-    )
-    return df
+    with pool.read() as conn:
+        return securities(conn)
 
 # @st.cache_data(ttl=600)
 def load_positions_quarter():
-    conn = get_conn()
-    df = pd.read_sql_query("SELECT * FROM positions_quarter", conn)
-    return df
+    with pool.read() as conn:
+        return period_snapshots(conn, "quarter")
 
 # ─────────────────────────────
 # 3. 画面レイアウト
@@ -65,37 +62,37 @@ with st.form("quarter_form", clear_on_submit=False):
     submitted = st.form_submit_button("登録 / 上書き")
 
 if submitted:
-    conn = get_conn()
     market_cap = qty_in * price_in
 
     try:
-        conn.execute(
-            """
-            INSERT INTO positions_quarter
-                (security_id, d365_code, security_code, security_name,
-                 year, quarter, holding_qty, avg_cost, market_price, market_cap)
-            VALUES (?,?,?,?,?,?,?,?,?,?)
-            ON CONFLICT(security_id, year, quarter)
-            DO UPDATE SET
-                holding_qty  = excluded.holding_qty,
-                avg_cost     = excluded.avg_cost,
-                market_price = excluded.market_price,
-                market_cap   = excluded.market_cap;
-            """,
-            (
-                security_id,
-                sel_code,          # d365_code を security_code と同一運用
-                sel_code,
-                security_name,
-                str(year_in),
-                quarter_in,        # Q1〜Q4 を格納
-                qty_in,
-                cost_in,
-                price_in,
-                market_cap,
+        with pool.write() as conn:
+            conn.execute(
+                """
+                INSERT INTO positions_quarter
+                    (security_id, d365_code, security_code, security_name,
+                     year, quarter, holding_qty, avg_cost, market_price, market_cap)
+                VALUES (?,?,?,?,?,?,?,?,?,?)
+                ON CONFLICT(security_id, year, quarter)
+                DO UPDATE SET
+                    holding_qty  = excluded.holding_qty,
+                    avg_cost     = excluded.avg_cost,
+                    market_price = excluded.market_price,
+                    market_cap   = excluded.market_cap;
+                """,
+                (
+                    security_id,
+                    sel_code,          # d365_code を security_code と同一運用
+                    sel_code,
+                    security_name,
+                    str(year_in),
+                    quarter_in,        # Q1〜Q4 を格納
+                    qty_in,
+                    cost_in,
+                    price_in,
+                    market_cap,
+                )
             )
-        )
-        conn.commit()
+            bump_data_version(conn)
         st.success("登録 / 更新が完了しました ✅")
         # load_positions_quarter.clear()
     except Exception as e:
@@ -120,15 +117,15 @@ else:
         try:
             # 選択キーから行を特定
             target = df_pq[df_pq["row_key"] == del_key].iloc[0]
-            conn   = get_conn()
-            conn.execute(
-                """
-                DELETE FROM positions_quarter
-                WHERE security_id = ? AND year = ? AND quarter = ?
-                """,
-                (int(target["security_id"]), target["year"], target["quarter"])
-            )
-            conn.commit()
+            with pool.write() as conn:
+                conn.execute(
+                    """
+                    DELETE FROM positions_quarter
+                    WHERE security_id = ? AND year = ? AND quarter = ?
+                    """,
+                    (int(target["security_id"]), target["year"], target["quarter"])
+                )
+                bump_data_version(conn)
             st.success(f"削除しました: {del_key}")
             # load_positions_quarter.clear()  # キャッシュ更新
         except Exception as e:
@@ -144,80 +141,12 @@ else:
 # ─────────────────────────────
 st.markdown("---")
 st.subheader("現在登録されている四半期データ")
-df_latest = load_positions_quarter()
+# (A)〜(D) 前期比の下落率・30%／50% 下落・連続下落を判定
+with pool.read() as conn:
+    df_latest = drop_report(conn)
 if df_latest.empty:
     st.info("まだデータがありません。")
 else:
-    # 年・四半期でソート
-    df_latest = df_latest.sort_values(["security_code", "year", "quarter"])
-    df_latest["year"] = df_latest["year"].astype(str)
-
-    # ─────────────────────────────
-    # (A) 前期の年・四半期を計算
-    # ─────────────────────────────
-    def get_prev_quarter(row):
-        y = int(row["year"])
-        q = row["quarter"]
-        if q == "Q1":
-            return y - 1, "Q4"
-        elif q == "Q2":
-            return y, "Q1"
-        elif q == "Q3":
-            return y, "Q2"
-        else:  # Q4
-            return y, "Q3"
-
-    prev_periods = df_latest.apply(get_prev_quarter, axis=1)
-    df_latest["prev_year_val"] = [y for y, _ in prev_periods]
-    df_latest["prev_quarter_val"] = [q for _, q in prev_periods]
-    df_latest["prev_year_val"] = df_latest["prev_year_val"].astype(str)
-
-    # ─────────────────────────────
-    # (B) 前期の market_price をマージして price_drop_rate を計算
-    # ─────────────────────────────
-    temp = df_latest[["security_code", "year", "quarter", "market_price"]].rename(
-        columns={
-            "year": "prev_year_val",
-            "quarter": "prev_quarter_val",
-            "market_price": "prev_market_price"
-        }
-    )
-    df_latest = pd.merge(
-        df_latest,
-        temp,
-        how="left",
-        left_on=["security_code", "prev_year_val", "prev_quarter_val"],
-        right_on=["security_code", "prev_year_val", "prev_quarter_val"]
-    )
-    df_latest["price_drop_rate"] = (
-        (df_latest["market_price"] - df_latest["prev_market_price"])
-        / df_latest["prev_market_price"]
-    )
-
-    # ─────────────────────────────
-    # (C) 今期の drop_30pct / drop_50pct を計算
-    # ─────────────────────────────
-    df_latest["drop_30pct"] = df_latest["price_drop_rate"] <= -0.3
-    df_latest["drop_50pct"] = df_latest["price_drop_rate"] <= -0.5
-
-    # ─────────────────────────────
-    # (D) 【ここから追加】前期の drop_30pct をマージ
-    # ─────────────────────────────
-    prev_flags = df_latest[["security_code", "year", "quarter", "drop_30pct"]].rename(
-        columns={
-            "year": "prev_year_val",
-            "quarter": "prev_quarter_val",
-            "drop_30pct": "prev_drop_30pct"
-        }
-    )
-    df_latest = pd.merge(
-        df_latest,
-        prev_flags,
-        how="left",
-        left_on=["security_code", "prev_year_val", "prev_quarter_val"],
-        right_on=["security_code", "prev_year_val", "prev_quarter_val"]
-    )
-
 
     # ─────────────────────────────
     # (E) 判定結果を表示
@@ -234,37 +163,14 @@ else:
         use_container_width=True
     )
 
-    conn = get_conn()
-
     # ─────────────────────────────
     # (E-2) 30％下落判定結果をDBに保存するボタン
     # ─────────────────────────────
     if st.button("30％下落判定結果をDBに保存", key="save_drop_30pct"):
-        import datetime
-        for _, row in df_latest.iterrows():
-            code = row["security_code"]
-            year = str(row["year"])
-            quarter = row["quarter"]
-            drop_30 = int(row["drop_30pct"])
-            judged_at = datetime.datetime.now().isoformat(timespec="seconds")
-            # 既存レコードがあればUPDATE、なければINSERT
-            cur = conn.execute(
-                "SELECT id FROM drop_judgement WHERE security_code=? AND year=? AND quarter=?",
-                (code, year, quarter)
-            )
-            res = cur.fetchone()
-            if res:
-                conn.execute(
-                    "UPDATE drop_judgement SET drop_30pct=?, judged_at=? WHERE id=?",
-                    (drop_30, judged_at, res[0])
-                )
-            else:
-                conn.execute(
-                    "INSERT INTO drop_judgement (security_code, year, quarter, drop_30pct, judged_at) VALUES (?, ?, ?, ?, ?)",
-                    (code, year, quarter, drop_30, judged_at)
-                )
-        conn.commit()
-        st.success("30％下落判定結果をDBに保存しました。")
+        # (security_code, year, quarter) の一意制約に対して 1 トランザクションで一括 upsert
+        with pool.write() as conn:
+            n = save_judgements(conn, df_latest)
+        st.success(f"30％下落判定結果をDBに保存しました（{n:,} 件）。")
 
 
 
@@ -272,21 +178,7 @@ else:
     # (F) 30%・50%下落または連続下落銘柄を表示（理由付き）
     # ─────────────────────────────
     # 「前期で30％連続下落」または「50％下落」のみを対象とするフィルタ
-    df_drop = df_latest[
-        (df_latest["drop_50pct"]) |
-        ((df_latest["drop_30pct"]) & (df_latest["prev_drop_30pct"] == True))
-    ].copy()
-
-    def get_reason(row):
-        # 50%下落が最優先
-        if row["drop_50pct"]:
-            return "50％下落"
-        # 30%連続下落の場合
-        if row["drop_30pct"] and row.get("prev_drop_30pct", False):
-            return "連続下落"
-        return ""
-
-    df_drop["下落理由"] = df_drop.apply(get_reason, axis=1)
+    df_drop = flagged(df_latest)
 
     st.markdown("#### 前期で30％連続下落または50％下落した銘柄一覧（理由付き）")
     st.dataframe(
@@ -306,5 +198,6 @@ else:
     # (G) drop_judgementテーブルの内容を表示
     # ─────────────────────────────
     st.markdown("#### 30%下落判定結果（DB保存）")
-    df_judge = pd.read_sql_query("SELECT * FROM drop_judgement", conn)
+    with pool.read() as conn:
+        df_judge = judgement_history(conn)
     st.dataframe(df_judge, use_container_width=True)
\ No newline at end of file
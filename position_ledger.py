@@ -0,0 +1,361 @@
+# position_ledger.py
+"""
+取引（transactions）を追記専用のイベント列とみなし、銘柄ごとの累積状態を管理する。
+
+- position_state:        銘柄ごとの最新の累積状態（最後に反映した取引のキー付き）
+- position_checkpoints:  CHECKPOINT_INTERVAL 件ごとの累積状態（スナップショット）
+- positions_current:     画面表示用の現在ポジション
+
+どの時点の状態も「その時点以前で直近のチェックポイント + それ以降の取引（最大 CHECKPOINT_INTERVAL 件程度）」
+の再生で求まる（positions_asof）。遡り登録も同じく直近チェックポイントから再生する（replay_from_checkpoint）。
+"""
+import sqlite3
+from collections.abc import Iterable, Iterator
+from datetime import date, timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from data_version import bump_data_version
+
+DB = "app.db"
+
+# 何件の取引ごとにチェックポイントを残すか
+CHECKPOINT_INTERVAL = 50
+
+# ─────────────────────────────
+# 1. テーブル定義
+# ─────────────────────────────
+def create_ledger_tables(conn: sqlite3.Connection):
+    """
+    銘柄ごとの累積状態 (position_state)、遡り登録用のチェックポイント (position_checkpoints)、
+    画面表示用の現在ポジション (positions_current) を作成する。
+    """
+    # ── 銘柄ごとの最新累積状態 ──────────────────────
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS position_state (
+        security_id          INTEGER PRIMARY KEY,
+        holding_qty          REAL    NOT NULL,
+        holding_cost         REAL    NOT NULL,
+        txn_count            INTEGER NOT NULL,   -- 反映済みの取引件数
+        last_txn_date        DATE,               -- 最後に反映した取引のキー
+        last_transaction_id  INTEGER,
+        updated_at           DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (security_id) REFERENCES securities(security_id) ON DELETE CASCADE
+    );
+    """)
+
+    # ── CHECKPOINT_INTERVAL 件ごとの累積状態 ─────────
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS position_checkpoints (
+        security_id     INTEGER NOT NULL,
+        txn_count       INTEGER NOT NULL,
+        txn_date        DATE    NOT NULL,
+        transaction_id  INTEGER NOT NULL,
+        holding_qty     REAL    NOT NULL,
+        holding_cost    REAL    NOT NULL,
+        PRIMARY KEY (security_id, txn_count),
+        FOREIGN KEY (security_id) REFERENCES securities(security_id) ON DELETE CASCADE
+    );
+    """)
+
+    # ── 現在ポジション（v_positions / latest_prices の実体）──
+    # 保有数・平均単価は取引登録時に、株価は price_quotes 登録時に更新する
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS positions_current (
+        security_id     INTEGER PRIMARY KEY,
+        holding_qty     REAL    NOT NULL DEFAULT 0,
+        avg_cost        REAL    NOT NULL DEFAULT 0,   -- 移動平均単価
+        market_price    REAL,                         -- 最新終値
+        quote_date      DATE,                         -- market_price の日付
+        valuation_diff  REAL,                         -- (market_price - avg_cost) * holding_qty
+        updated_at      DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (security_id) REFERENCES securities(security_id) ON DELETE CASCADE
+    );
+    """)
+
+# ─────────────────────────────
+# 2. 移動平均の計算ルール
+# ─────────────────────────────
+def apply_txn(holding_qty: float, holding_cost: float,
+              txn_type: str, qty: float, price: float) -> tuple[float, float]:
+    """
+    1 件の取引を反映した (holding_qty, holding_cost) を返す。
+    売却分のコストは直前の平均単価で減算し、保有数を超える売りは保有数までとする。
+    """
+    if txn_type == "BUY":
+        holding_cost += qty * price
+        holding_qty += qty
+    elif txn_type == "SEL":
+        if holding_qty > 0:
+            avg = holding_cost / holding_qty
+            sell_qty = min(qty, holding_qty)
+            holding_cost -= avg * sell_qty
+            holding_qty -= sell_qty
+    return holding_qty, holding_cost
+
+def moving_average(holding_qty: float, holding_cost: float) -> float:
+    return holding_cost / holding_qty if holding_qty > 0 else 0
+
+def replay_events(rows: Iterable[tuple], holding_qty: float = 0.0, holding_cost: float = 0.0,
+                  txn_count: int = 0) -> Iterator[tuple[tuple, float, float, int]]:
+    """
+    1 銘柄の取引を (txn_date, transaction_id) 順に反映していく。
+    rows の各行は (transaction_id, txn_date, txn_type, quantity, price, ...)（6 列目以降は任意）。
+    1 件ごとに (行, 反映後の holding_qty, holding_cost, txn_count) を返す。
+    txn_count が CHECKPOINT_INTERVAL の倍数になった行の直後がチェックポイント。
+    """
+    for row in rows:
+        holding_qty, holding_cost = apply_txn(holding_qty, holding_cost, row[2], row[3], row[4])
+        txn_count += 1
+        yield row, holding_qty, holding_cost, txn_count
+
+# ─────────────────────────────
+# 3. チェックポイントからの再計算（遡り登録・初回用）
+# ─────────────────────────────
+def nearest_checkpoint(conn: sqlite3.Connection, security_id: int, txn_date: str) -> tuple | None:
+    """
+    txn_date 以前で最も新しいチェックポイント
+    (txn_count, txn_date, transaction_id, holding_qty, holding_cost)。無ければ None。
+    """
+    return conn.execute(
+        """
+        SELECT txn_count, txn_date, transaction_id, holding_qty, holding_cost
+        FROM position_checkpoints
+        WHERE security_id = ? AND txn_date <= ?
+        ORDER BY txn_count DESC
+        LIMIT 1
+        """,
+        (security_id, txn_date)
+    ).fetchone()
+
+def replay_from_checkpoint(conn: sqlite3.Connection, security_id: int, txn_date: str):
+    """
+    txn_date 以前で最も新しいチェックポイントから取引を再生し、
+    それ以降の transactions.moving_average / position_state / チェックポイントを作り直す。
+    チェックポイントが無ければ先頭から再生する。
+    """
+    cp = nearest_checkpoint(conn, security_id, txn_date)
+    if cp:
+        txn_count, cp_date, cp_id, holding_qty, holding_cost = cp
+        rows = conn.execute(
+            """
+            SELECT transaction_id, txn_date, txn_type, quantity, price
+            FROM transactions
+            WHERE security_id = ?
+              AND (txn_date > ? OR (txn_date = ? AND transaction_id > ?))
+            ORDER BY txn_date, transaction_id
+            """,
+            (security_id, cp_date, cp_date, cp_id)
+        ).fetchall()
+    else:
+        txn_count, holding_qty, holding_cost = 0, 0.0, 0.0
+        rows = conn.execute(
+            """
+            SELECT transaction_id, txn_date, txn_type, quantity, price
+            FROM transactions
+            WHERE security_id = ?
+            ORDER BY txn_date, transaction_id
+            """,
+            (security_id,)
+        ).fetchall()
+
+    # 再生範囲より後ろのチェックポイントは古くなるので捨てる
+    conn.execute(
+        "DELETE FROM position_checkpoints WHERE security_id = ? AND txn_count > ?",
+        (security_id, txn_count)
+    )
+
+    updates = []
+    checkpoints = []
+    last_date, last_id = (cp[1], cp[2]) if cp else (None, None)
+    for (transaction_id, row_date, *_), holding_qty, holding_cost, txn_count in replay_events(
+        rows, holding_qty, holding_cost, txn_count
+    ):
+        updates.append((moving_average(holding_qty, holding_cost), transaction_id))
+        if txn_count % CHECKPOINT_INTERVAL == 0:
+            checkpoints.append(
+                (security_id, txn_count, row_date, transaction_id, holding_qty, holding_cost)
+            )
+        last_date, last_id = row_date, transaction_id
+
+    conn.executemany(
+        "UPDATE transactions SET moving_average = ? WHERE transaction_id = ?", updates
+    )
+    conn.executemany(
+        """
+        INSERT INTO position_checkpoints
+            (security_id, txn_count, txn_date, transaction_id, holding_qty, holding_cost)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        checkpoints
+    )
+    _save_state(conn, security_id, holding_qty, holding_cost, txn_count, last_date, last_id)
+
+def upsert_positions_current(conn: sqlite3.Connection, rows):
+    """
+    (security_id, holding_qty, holding_cost) の列を positions_current に反映する。
+    株価は保持したまま valuation_diff だけ再計算する。
+    """
+    conn.executemany(
+        """
+        INSERT INTO positions_current
+            (security_id, holding_qty, avg_cost, updated_at)
+        VALUES (?1, ?2, CASE WHEN ?2 > 0 THEN ?3 / ?2 ELSE 0 END, CURRENT_TIMESTAMP)
+        ON CONFLICT(security_id) DO UPDATE SET
+            holding_qty    = excluded.holding_qty,
+            avg_cost       = excluded.avg_cost,
+            valuation_diff = (positions_current.market_price - excluded.avg_cost) * excluded.holding_qty,
+            updated_at     = excluded.updated_at;
+        """,
+        rows
+    )
+
+def _save_state(conn, security_id, holding_qty, holding_cost, txn_count, last_date, last_id):
+    conn.execute(
+        """
+        INSERT INTO position_state
+            (security_id, holding_qty, holding_cost, txn_count,
+             last_txn_date, last_transaction_id, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(security_id) DO UPDATE SET
+            holding_qty         = excluded.holding_qty,
+            holding_cost        = excluded.holding_cost,
+            txn_count           = excluded.txn_count,
+            last_txn_date       = excluded.last_txn_date,
+            last_transaction_id = excluded.last_transaction_id,
+            updated_at          = excluded.updated_at;
+        """,
+        (security_id, holding_qty, holding_cost, txn_count, last_date, last_id)
+    )
+    upsert_positions_current(conn, [(security_id, holding_qty, holding_cost)])
+
+# ─────────────────────────────
+# 4. 取引登録（INSERT と状態更新を同一トランザクションで行う）
+# ─────────────────────────────
+def record_transaction(conn: sqlite3.Connection, security_id: int, txn_type: str,
+                       quantity: float, price: float, txn_date: str) -> float:
+    """
+    transactions に 1 件 INSERT し、position_state を更新して moving_average を返す。
+    データバージョンも同じトランザクションで更新する。commit は呼び出し側で行う（with conn: で囲む想定）。
+
+    - 最終取引日以降の取引: position_state に 1 件反映するだけ（O(1)）
+    - 遡り登録・状態未作成: 直近チェックポイントから再生し、以降の moving_average も更新
+    """
+    state = conn.execute(
+        """
+        SELECT holding_qty, holding_cost, txn_count, last_txn_date
+        FROM position_state
+        WHERE security_id = ?
+        """,
+        (security_id,)
+    ).fetchone()
+
+    if state is None or (state[3] is not None and txn_date < state[3]):
+        cur = conn.execute(
+            """
+            INSERT INTO transactions
+                (security_id, txn_type, quantity, price, txn_date)
+            VALUES
+                (?, ?, ?, ?, ?)
+            """,
+            (security_id, txn_type, quantity, price, txn_date)
+        )
+        replay_from_checkpoint(conn, security_id, txn_date)
+        bump_data_version(conn)
+        return conn.execute(
+            "SELECT moving_average FROM transactions WHERE transaction_id = ?",
+            (cur.lastrowid,)
+        ).fetchone()[0]
+
+    holding_qty, holding_cost, txn_count, _ = state
+    holding_qty, holding_cost = apply_txn(holding_qty, holding_cost, txn_type, quantity, price)
+    txn_count += 1
+    ma = moving_average(holding_qty, holding_cost)
+
+    cur = conn.execute(
+        """
+        INSERT INTO transactions
+            (security_id, txn_type, quantity, price, txn_date, moving_average)
+        VALUES
+            (?, ?, ?, ?, ?, ?)
+        """,
+        (security_id, txn_type, quantity, price, txn_date, ma)
+    )
+    if txn_count % CHECKPOINT_INTERVAL == 0:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO position_checkpoints
+                (security_id, txn_count, txn_date, transaction_id, holding_qty, holding_cost)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (security_id, txn_count, txn_date, cur.lastrowid, holding_qty, holding_cost)
+        )
+    _save_state(conn, security_id, holding_qty, holding_cost, txn_count, txn_date, cur.lastrowid)
+    bump_data_version(conn)
+    return ma
+
+# ─────────────────────────────
+# 5. 任意の日付時点の状態（直近チェックポイント + 以降の取引の再生）
+# ─────────────────────────────
+def positions_asof(conn: sqlite3.Connection, day: date | str,
+                   security_ids: Iterable[int] | None = None) -> dict[int, tuple[float, float, int]]:
+    """
+    day の取引まで反映した時点の { security_id: (holding_qty, holding_cost, txn_count) } を返す。
+    security_ids を省略すると、day 以前に取引のある全銘柄。
+
+    銘柄ごとに day 以前で直近のチェックポイントを読み、その後の day までの取引だけを再生する
+    （チェックポイントが無い銘柄は先頭から。いずれも再生するのは最大 CHECKPOINT_INTERVAL 件程度）。
+    """
+    params = {"next_day": (date.fromisoformat(str(day)[:10]) + timedelta(days=1)).isoformat()}
+    where = ""
+    if security_ids is not None:
+        params.update({f"sid{i}": sid for i, sid in enumerate(security_ids)})
+        if len(params) == 1:
+            return {}
+        where = f"WHERE s.security_id IN ({', '.join(':' + k for k in params if k != 'next_day')})"
+
+    # 銘柄ごとの直近チェックポイント（無ければ NULL）を起点に、
+    # (security_id, txn_date) のインデックスでそれ以降の取引だけを引く
+    cur = conn.execute(
+        f"""
+        WITH base AS (
+            SELECT s.security_id, c.txn_count, c.txn_date, c.transaction_id, c.holding_qty, c.holding_cost
+            FROM securities s
+            LEFT JOIN position_checkpoints c
+                   ON c.security_id = s.security_id
+                  AND c.txn_count = (
+                      SELECT txn_count FROM position_checkpoints
+                      WHERE security_id = s.security_id AND txn_date < :next_day
+                      ORDER BY txn_count DESC
+                      LIMIT 1
+                  )
+            {where}
+        )
+        SELECT b.security_id, b.txn_count, b.holding_qty, b.holding_cost,
+               t.transaction_id, t.txn_date, t.txn_type, t.quantity, t.price
+        FROM base b
+        LEFT JOIN transactions t
+               ON t.security_id = b.security_id
+              AND t.txn_date >= COALESCE(b.txn_date, '')
+              AND t.txn_date < :next_day
+              AND (b.txn_date IS NULL OR t.txn_date > b.txn_date OR t.transaction_id > b.transaction_id)
+        WHERE b.txn_count IS NOT NULL OR t.transaction_id IS NOT NULL
+        ORDER BY b.security_id, t.txn_date, t.transaction_id
+        """,
+        params
+    )
+
+    out = {}
+    for sid, rows in groupby(cur, key=itemgetter(0)):
+        rows = list(rows)
+        _, txn_count, holding_qty, holding_cost = rows[0][:4]
+        state = (holding_qty or 0.0, holding_cost or 0.0, txn_count or 0)
+        tail = [row[4:] for row in rows if row[4] is not None]
+        for _, *state in replay_events(tail, *state):
+            pass
+        out[sid] = tuple(state)
+    return out
+
+def position_asof(conn: sqlite3.Connection, security_id: int, day: date | str) -> tuple[float, float, int]:
+    """1 銘柄の day 時点の (holding_qty, holding_cost, txn_count)。取引が無ければ (0.0, 0.0, 0)。"""
+    return positions_asof(conn, day, [security_id]).get(security_id, (0.0, 0.0, 0))
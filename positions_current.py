@@ -0,0 +1,172 @@
+# positions_current.py
+"""
+positions_current（現在ポジションのマテリアライズ）の更新・検査。
+
+- 保有数・平均単価: 取引登録時に position_ledger が更新
+- 最新株価: price_quotes への登録時に apply_prices() で更新
+- 検査・再構築: `python positions_current.py --check` / `--rebuild`
+"""
+import argparse
+import sqlite3
+import sys
+
+from data_version import bump_data_version
+from position_ledger import apply_txn, moving_average
+
+DB = "app.db"
+
+# 検査時に一致とみなす誤差
+TOLERANCE = 1e-6
+
+# ─────────────────────────────
+# 1. 株価登録時の更新
+# ─────────────────────────────
+def apply_prices(conn: sqlite3.Connection, rows):
+    """
+    price_quotes に登録した (quote_date, security_id, close_price) の列を positions_current に反映する。
+    既に保持している株価より古い日付のものは無視する。
+    データバージョンも更新する。commit は呼び出し側で行う。
+    """
+    conn.executemany(
+        """
+        INSERT INTO positions_current
+            (security_id, market_price, quote_date, valuation_diff, updated_at)
+        VALUES (?2, ?3, ?1, 0, CURRENT_TIMESTAMP)
+        ON CONFLICT(security_id) DO UPDATE SET
+            market_price   = excluded.market_price,
+            quote_date     = excluded.quote_date,
+            valuation_diff = (excluded.market_price - positions_current.avg_cost)
+                             * positions_current.holding_qty,
+            updated_at     = excluded.updated_at
+        WHERE positions_current.quote_date IS NULL
+           OR excluded.quote_date >= positions_current.quote_date;
+        """,
+        rows
+    )
+    bump_data_version(conn)
+
+# ─────────────────────────────
+# 2. 全件からの再計算
+# ─────────────────────────────
+def compute_from_scratch(conn: sqlite3.Connection) -> dict[int, tuple]:
+    """
+    transactions / price_quotes を全件読み直して
+    { security_id: (holding_qty, avg_cost, market_price, quote_date, valuation_diff) } を返す。
+    """
+    holdings = {}
+    current_sid = None
+    holding_qty = holding_cost = 0.0
+    cur = conn.execute(
+        """
+        SELECT security_id, txn_type, quantity, price
+        FROM transactions
+        ORDER BY security_id, txn_date, transaction_id
+        """
+    )
+    for sid, txn_type, qty, price in cur:
+        if sid != current_sid:
+            if current_sid is not None:
+                holdings[current_sid] = (holding_qty, holding_cost)
+            current_sid = sid
+            holding_qty = holding_cost = 0.0
+        holding_qty, holding_cost = apply_txn(holding_qty, holding_cost, txn_type, qty, price)
+    if current_sid is not None:
+        holdings[current_sid] = (holding_qty, holding_cost)
+
+    prices = {
+        sid: (price, quote_date)
+        for sid, quote_date, price in conn.execute(
+            """
+            SELECT security_id, quote_date, close_price
+            FROM (
+                SELECT security_id, quote_date, close_price,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY security_id ORDER BY quote_date DESC
+                       ) AS rn
+                FROM price_quotes
+            )
+            WHERE rn = 1
+            """
+        )
+    }
+
+    expected = {}
+    for sid in holdings.keys() | prices.keys():
+        holding_qty, holding_cost = holdings.get(sid, (0.0, 0.0))
+        avg_cost = moving_average(holding_qty, holding_cost)
+        market_price, quote_date = prices.get(sid, (None, None))
+        valuation_diff = (
+            (market_price - avg_cost) * holding_qty if market_price is not None else None
+        )
+        expected[sid] = (holding_qty, avg_cost, market_price, quote_date, valuation_diff)
+    return expected
+
+def rebuild(conn: sqlite3.Connection) -> int:
+    """positions_current を全件から作り直し、行数を返す。commit は呼び出し側で行う。"""
+    expected = compute_from_scratch(conn)
+    conn.execute("DELETE FROM positions_current")
+    conn.executemany(
+        """
+        INSERT INTO positions_current
+            (security_id, holding_qty, avg_cost, market_price, quote_date, valuation_diff, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """,
+        [(sid, *values) for sid, values in expected.items()]
+    )
+    bump_data_version(conn)
+    return len(expected)
+
+def check(conn: sqlite3.Connection) -> list[tuple]:
+    """
+    positions_current と全件再計算の結果を比較し、
+    食い違う (security_id, 列名, 保存値, 再計算値) のリストを返す。
+    """
+    columns = ["holding_qty", "avg_cost", "market_price", "quote_date", "valuation_diff"]
+    expected = compute_from_scratch(conn)
+    stored = {
+        row[0]: row[1:]
+        for row in conn.execute(
+            f"SELECT security_id, {', '.join(columns)} FROM positions_current"
+        )
+    }
+
+    diffs = []
+    for sid in sorted(expected.keys() | stored.keys()):
+        want = expected.get(sid)
+        have = stored.get(sid)
+        if want is None or have is None:
+            diffs.append((sid, "(row)", have, want))
+            continue
+        for col, h, w in zip(columns, have, want):
+            if isinstance(w, float) and isinstance(h, float):
+                if abs(h - w) > TOLERANCE * max(1.0, abs(w)):
+                    diffs.append((sid, col, h, w))
+            elif h != w:
+                diffs.append((sid, col, h, w))
+    return diffs
+
+# ─────────────────────────────
+# 3. CLI
+# ─────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="positions_current の整合性チェック / 再構築")
+    parser.add_argument("--db", default=DB, help="SQLite ファイルのパス")
+    parser.add_argument("--rebuild", action="store_true", help="全件から作り直す")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if args.rebuild:
+        with conn:
+            n = rebuild(conn)
+        print(f"positions_current を再構築しました（{n} 銘柄）。")
+        sys.exit(0)
+
+    diffs = check(conn)
+    conn.close()
+    if not diffs:
+        print("✅ positions_current は transactions / price_quotes と一致しています。")
+        sys.exit(0)
+    print(f"⚠️ {len(diffs)} 件の不一致があります（--rebuild で作り直せます）:")
+    for sid, col, have, want in diffs:
+        print(f"  security_id={sid} {col}: 保存値={have} 再計算値={want}")
+    sys.exit(1)
@@ -0,0 +1,174 @@
+# price_asof.py
+"""
+「指定日以前の直近終値」を全銘柄まとめて引く as-of 参照。
+
+price_quotes を (security_id, 日付) 順に並べた配列としてメモリに持ち、
+キー security_id * KEY_SPAN + 日数 に対する searchsorted 1 回で全銘柄分を求める
+（銘柄ごとの ORDER BY quote_date DESC LIMIT 1 や、日付の完全一致を使わない）。
+
+- get_asof_index(db_path, conn) は DB ファイルごとにプロセス内で保持する
+- data_version が変わったときだけ price_quotes を確認し、
+  追記分だけ読み足す（行が消えていれば読み直す。quote_changes の判定は price_matrix の同期でも使う）
+
+    index = get_asof_index(db_path)     # プールの接続を借りている中では get_asof_index(db_path, conn)
+    index.asof(date.today())            # { security_id: 終値 }（週末・休日は前営業日まで遡る）
+    index.asof_many([d1, d2, ...])      # 日付 × 銘柄の終値（無ければ NaN）
+"""
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from data_version import get_data_version
+from db import DB_PATH, get_pool
+
+# キーの security_id 側の桁（日数は ±2^31 日に収まる）
+KEY_SPAN = 1 << 32
+
+# price_quotes から 1 回に読む行数
+READ_CHUNK = 100_000
+
+def _days(values) -> np.ndarray:
+    """date / 'YYYY-MM-DD' / datetime64 の列を 1970-01-01 からの日数にする。"""
+    return np.asarray(values, dtype="datetime64[D]").astype(np.int64)
+
+# ─────────────────────────────
+# 1. price_quotes の読み出し
+# ─────────────────────────────
+def read_quotes(conn, after_rowid: int = 0):
+    """price_quotes の rowid > after_rowid の行を (日付, 銘柄 ID, 終値) の配列で返す。"""
+    # 日付は SQLite 側で 1970-01-01 からの日数にし、READ_CHUNK 行ずつ数値配列に詰める（文字列を作らない）
+    cur = conn.execute(
+        """
+        SELECT CAST(julianday(substr(quote_date, 1, 10)) - 2440587.5 AS INTEGER),
+               security_id, close_price
+        FROM price_quotes
+        WHERE rowid > ?
+        ORDER BY rowid
+        """,
+        (after_rowid,)
+    )
+    chunks = [np.empty((0, 3))]
+    while rows := cur.fetchmany(READ_CHUNK):
+        chunks.append(np.array(rows, dtype=np.float64))
+    data = np.concatenate(chunks)
+    return (
+        data[:, 0].astype(np.int64).astype("datetime64[D]"),
+        data[:, 1].astype(np.int64),
+        data[:, 2],
+    )
+
+def quote_changes(conn, state: dict | None) -> tuple[str, dict]:
+    """
+    前回の state（{'rows': 件数, 'max_rowid': 最大 rowid}）からの price_quotes の変化を
+    ('unchanged' / 'appended' / 'rebuilt', 新しい state) で返す。
+    price_quotes は追記のみなので、件数の増分が rowid > 前回の最大 rowid の件数と一致すれば追記だけとみなす。
+    """
+    rows, max_rowid = conn.execute("SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM price_quotes").fetchone()
+    new_state = {"rows": rows, "max_rowid": max_rowid}
+    if state is None:
+        return "rebuilt", new_state
+    if (rows, max_rowid) == (state["rows"], state["max_rowid"]):
+        return "unchanged", new_state
+    added = conn.execute("SELECT COUNT(*) FROM price_quotes WHERE rowid > ?", (state["max_rowid"],)).fetchone()[0]
+    return ("appended" if state["rows"] + added == rows else "rebuilt"), new_state
+
+# ─────────────────────────────
+# 2. 索引
+# ─────────────────────────────
+class AsofIndex:
+    """(security_id, 日付) 順に並べた終値の配列と、銘柄ごとの先頭位置。"""
+
+    def __init__(self, dates: np.ndarray, security_ids: np.ndarray, closes: np.ndarray):
+        days = _days(dates)
+        order = np.lexsort((days, security_ids))
+        self.days = days[order]
+        self.closes = np.asarray(closes, dtype=np.float64)[order]
+        self.row_security_ids = np.asarray(security_ids, dtype=np.int64)[order]
+        self.keys = self.row_security_ids * KEY_SPAN + self.days
+        self.security_ids, self.starts = np.unique(self.row_security_ids, return_index=True)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def extend(self, dates: np.ndarray, security_ids: np.ndarray, closes: np.ndarray) -> "AsofIndex":
+        """行を追加した新しい索引を返す（自身は変更しない）。"""
+        return AsofIndex(
+            np.concatenate([self.days.astype("datetime64[D]"), np.asarray(dates, dtype="datetime64[D]")]),
+            np.concatenate([self.row_security_ids, np.asarray(security_ids, dtype=np.int64)]),
+            np.concatenate([self.closes, closes]),
+        )
+
+    def positions(self, days) -> np.ndarray:
+        """days の各日 × 全銘柄について、その日以前の直近の行位置（無ければ -1）。"""
+        targets = _days(days)
+        queries = self.security_ids[None, :] * KEY_SPAN + targets[:, None]
+        pos = np.searchsorted(self.keys, queries, side="right") - 1
+        # 直前の行が別の銘柄（その銘柄の最初の株価より前の日）なら値なし
+        return np.where(pos >= self.starts[None, :], pos, -1)
+
+    def asof_many(self, days) -> np.ndarray:
+        """len(days) × 銘柄数（security_ids の順）の終値。無いセルは NaN。"""
+        pos = self.positions(days)
+        return np.where(pos >= 0, self.closes[np.maximum(pos, 0)], np.nan)
+
+    def asof(self, day) -> dict[int, float]:
+        """day 以前の直近終値を { security_id: 終値 } で返す（株価の無い銘柄は含めない）。"""
+        pos = self.positions([day])[0]
+        has = pos >= 0
+        return dict(zip(self.security_ids[has].tolist(), self.closes[pos[has]].tolist()))
+
+def build_index(conn) -> AsofIndex:
+    """conn から price_quotes 全件を読んで索引を作る（キャッシュしない）。"""
+    return AsofIndex(*read_quotes(conn))
+
+# ─────────────────────────────
+# 3. プロセス内キャッシュ
+# ─────────────────────────────
+_indexes: dict[str, tuple[dict, AsofIndex]] = {}
+_indexes_lock = threading.Lock()
+
+def _refresh(conn, cached: tuple[dict, AsofIndex] | None) -> tuple[dict, AsofIndex]:
+    """cached（(state, 索引) または None）を conn の price_quotes に合わせた (state, 索引) を返す。"""
+    state, index = cached or (None, None)
+    version = get_data_version(conn)
+    if state is not None and state["data_version"] == version:
+        return cached
+    change, new_state = quote_changes(conn, state)
+    if change == "appended":
+        index = index.extend(*read_quotes(conn, state["max_rowid"]))
+    elif change == "rebuilt":
+        index = build_index(conn)
+    return {**new_state, "data_version": version}, index
+
+def _read_entry(conn, cached):
+    """data_version と price_quotes を同じスナップショットで読む（呼び出し側のトランザクション中ならその中で）。"""
+    if conn.in_transaction:
+        return _refresh(conn, cached)
+    conn.execute("BEGIN")
+    try:
+        return _refresh(conn, cached)
+    finally:
+        conn.rollback()
+
+def get_asof_index(db_path=DB_PATH, conn=None) -> AsofIndex:
+    """
+    DB ファイルごとの索引を返す。price_quotes に行が増えていれば読み足してから返す。
+    プールから借りた接続の中で呼ぶときは、その接続を conn に渡す
+    （渡さなければ読み取り用の接続をもう 1 本借りる）。
+    ロックは保持している索引の差し替えにだけ使い、DB を読んでいる間は取らない
+    （同時に読み足しが起きたときは新しい data_version の方を残す）。
+    """
+    key = str(Path(db_path).resolve())
+    cached = _indexes.get(key)
+    if conn is None:
+        with get_pool(key).read() as conn:
+            entry = _read_entry(conn, cached)
+    else:
+        entry = _read_entry(conn, cached)
+    if entry is not cached:
+        with _indexes_lock:
+            current = _indexes.get(key)
+            if current is None or current[0]["data_version"] <= entry[0]["data_version"]:
+                _indexes[key] = entry
+    return entry[1]
@@ -0,0 +1,247 @@
+# price_matrix.py
+"""
+price_quotes の列指向コピー（日付 × 銘柄の終値行列を .npy で保存し、memmap で読む）。
+
+分析のたびに price_quotes を read_sql_query で読み直す代わりに、
+行列から期間や期末日を NumPy のインデックスだけで切り出す。
+
+使うかどうかは任意の分析・ベンチマーク用の補助で、画面・API・snapshots.py などの
+本来の処理からは参照しない（期末・指定日の終値は price_asof が price_quotes から直接引く）。
+行列は open_price_matrix() / このスクリプトを実行したときにだけ price_quotes と同期するので、
+使うときは必ずそのどちらかを通すこと（現在は benchmarks/run_benchmarks.py だけが使う）。
+
+- 保存先: DB ファイルと同じ場所の <DB 名>.prices/（例: app.prices/）
+    meta.json             … 現在の世代と、同期した時点の data_version・件数・最大 rowid
+    <世代>/dates.npy      … 日付（datetime64[D]、昇順）
+    <世代>/security_ids.npy … 銘柄 ID（昇順）
+    <世代>/closes.npy     … 終値（float64、日付 × 銘柄、無い日は NaN）
+- 同期: price_quotes は追記のみ（INSERT）なので、最大 rowid より後の行だけを読んで追加する。
+  件数が合わない（銘柄削除の CASCADE などで行が消えた）ときは全件から作り直す。
+  新しい世代のディレクトリに書いてから meta.json を差し替えるので、読み取り中の行列は壊れない。
+- 形式: pyarrow があるので Parquet でも保存できるが、Parquet は圧縮された列チャンクを
+  読むたびに展開してメモリに載せる。.npy なら memmap で開くだけで、期間や期末日の行を
+  ページ単位で必要な分だけ読める（ファイル全体を読み込まない）ため .npy にしている。
+
+    python price_matrix.py              # app.db から同期
+    python price_matrix.py --rebuild    # 全件から作り直す
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data_version import get_data_version
+from db import connect, get_pool
+from init_db import ensure_schema
+from price_asof import quote_changes, read_quotes
+
+DB = "app.db"
+
+STORE_SUFFIX = ".prices"
+META_FILE = "meta.json"
+
+def store_path(db_path) -> Path:
+    """db_path に対応する保存先ディレクトリ。"""
+    return Path(db_path).with_suffix(STORE_SUFFIX)
+
+# ─────────────────────────────
+# 1. 行列
+# ─────────────────────────────
+class PriceMatrix:
+    """日付 × 銘柄の終値行列。closes は読み取り専用の memmap。"""
+
+    def __init__(self, dates: np.ndarray, security_ids: np.ndarray, closes: np.ndarray):
+        self.dates = dates
+        self.security_ids = security_ids
+        self.closes = closes
+        self._last_valid = None
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.closes.shape
+
+    def columns(self, security_ids) -> np.ndarray:
+        """銘柄 ID の列番号（行列に無い銘柄は -1）。"""
+        security_ids = np.asarray(security_ids, dtype=np.int64)
+        if not len(self.security_ids):
+            return np.full(len(security_ids), -1)
+        pos = np.minimum(np.searchsorted(self.security_ids, security_ids), len(self.security_ids) - 1)
+        return np.where(self.security_ids[pos] == security_ids, pos, -1)
+
+    def window(self, start, end) -> tuple[np.ndarray, np.ndarray]:
+        """start〜end（両端含む）の (日付, 終値の行) をコピーせずに返す。"""
+        lo = np.searchsorted(self.dates, np.datetime64(start, "D"), side="left")
+        hi = np.searchsorted(self.dates, np.datetime64(end, "D"), side="right")
+        return self.dates[lo:hi], self.closes[lo:hi]
+
+    def last_valid(self) -> np.ndarray:
+        """各セルについて、その日以前で終値のある最後の行番号（無ければ -1）。初回だけ計算する。"""
+        if self._last_valid is None:
+            rows = np.arange(len(self.dates), dtype=np.int32)[:, None]
+            idx = np.where(np.isnan(self.closes), np.int32(-1), rows)
+            self._last_valid = np.maximum.accumulate(idx, axis=0) if len(idx) else idx
+        return self._last_valid
+
+    def asof(self, days) -> np.ndarray:
+        """days の各日について、その日以前の直近の終値（len(days) × 銘柄数、無ければ NaN）。"""
+        days = np.asarray(days, dtype="datetime64[D]")
+        out = np.full((len(days), len(self.security_ids)), np.nan)
+        rows = np.searchsorted(self.dates, days, side="right") - 1
+        ok = rows >= 0
+        if not ok.any():
+            return out
+        last = self.last_valid()[rows[ok]]
+        cols = np.broadcast_to(np.arange(len(self.security_ids)), last.shape)
+        has = last >= 0
+        values = np.full(last.shape, np.nan)
+        values[has] = self.closes[last[has], cols[has]]
+        out[ok] = values
+        return out
+
+    def latest(self, day=None) -> dict[int, float]:
+        """day（既定: 最終日）以前の直近の終値を { security_id: close } で返す。"""
+        day = self.dates[-1] if day is None and len(self.dates) else day
+        if day is None:
+            return {}
+        row = self.asof([day])[0]
+        has = ~np.isnan(row)
+        return dict(zip(self.security_ids[has].tolist(), row[has].tolist()))
+
+def quarter_ends(first, last) -> np.ndarray:
+    """first を含む四半期から、last までに終わる四半期の末日（datetime64[D]）。"""
+    periods = pd.period_range(pd.Timestamp(first), pd.Timestamp(last), freq="Q")
+    ends = periods.end_time.normalize().to_numpy().astype("datetime64[D]")
+    return ends[ends <= np.datetime64(last, "D")]
+
+def quarter_end_prices(matrix: PriceMatrix, codes: dict[int, str]) -> pd.DataFrame:
+    """
+    各四半期末時点の直近終値を positions_quarter と同じ形
+    （security_code / year / quarter / market_price）で返す。drop_detection.detect_drops にそのまま渡せる。
+    codes は { security_id: security_code }。codes に無い銘柄と、期末以前の終値が無いセルは出力しない。
+    """
+    if not len(matrix.dates):
+        return pd.DataFrame(columns=["security_code", "year", "quarter", "market_price"])
+    ends = quarter_ends(matrix.dates[0], matrix.dates[-1])
+    values = matrix.asof(ends)
+    code_arr = np.array([codes.get(sid) for sid in matrix.security_ids.tolist()], dtype=object)
+    keep = ~np.isnan(values) & pd.notna(code_arr)[None, :]
+    end_idx, col_idx = np.nonzero(keep)
+    years = ends.astype("datetime64[Y]").astype(int) + 1970
+    quarters = (ends.astype("datetime64[M]").astype(int) % 12) // 3 + 1
+    return pd.DataFrame({
+        "security_code": code_arr[col_idx],
+        "year": years[end_idx].astype(str),
+        "quarter": np.char.add("Q", quarters[end_idx].astype(str)),
+        "market_price": values[end_idx, col_idx],
+    })
+
+# ─────────────────────────────
+# 2. 保存・読み込み
+# ─────────────────────────────
+def _read_meta(store: Path) -> dict | None:
+    try:
+        return json.loads((store / META_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def _write_meta(store: Path, meta: dict):
+    tmp = store / f"{META_FILE}.{meta['generation']}"
+    tmp.write_text(json.dumps(meta), encoding="utf-8")
+    os.replace(tmp, store / META_FILE)
+
+def _load(store: Path, meta: dict) -> PriceMatrix:
+    gen = store / meta["generation"]
+    return PriceMatrix(
+        np.load(gen / "dates.npy"),
+        np.load(gen / "security_ids.npy"),
+        np.load(gen / "closes.npy", mmap_mode="r"),
+    )
+
+def _write(store: Path, old_meta: dict | None, dates, security_ids, closes, meta: dict):
+    """新しい世代のディレクトリに書き、meta.json を差し替えてから前の世代を消す。"""
+    store.mkdir(parents=True, exist_ok=True)
+    gen = Path(tempfile.mkdtemp(prefix="gen-", dir=store))
+    np.save(gen / "dates.npy", dates)
+    np.save(gen / "security_ids.npy", security_ids)
+    out = np.lib.format.open_memmap(gen / "closes.npy", mode="w+", dtype=np.float64, shape=closes.shape)
+    out[:] = closes
+    out.flush()
+    del out
+
+    _write_meta(store, {**meta, "generation": gen.name})
+    if old_meta and old_meta.get("generation"):
+        # 読み取り中の memmap は削除後も有効（ファイルが閉じられるまで残る）
+        shutil.rmtree(store / old_meta["generation"], ignore_errors=True)
+
+def _merge(base: PriceMatrix | None, dates, sids, closes):
+    """base に (日付, 銘柄, 終値) の行を重ね、軸を広げた新しい行列を返す（同じセルは後の行が優先）。"""
+    old_dates = base.dates if base is not None else np.array([], dtype="datetime64[D]")
+    old_sids = base.security_ids if base is not None else np.array([], dtype=np.int64)
+    all_dates = np.union1d(old_dates, dates)
+    all_sids = np.union1d(old_sids, sids)
+    out = np.full((len(all_dates), len(all_sids)), np.nan)
+    if base is not None and base.closes.size:
+        out[np.ix_(np.searchsorted(all_dates, old_dates), np.searchsorted(all_sids, old_sids))] = base.closes
+    out[np.searchsorted(all_dates, dates), np.searchsorted(all_sids, sids)] = closes
+    return all_dates, all_sids, out
+
+def sync(conn, store, rebuild: bool = False) -> str:
+    """
+    保存先を price_quotes に合わせ、'unchanged' / 'appended' / 'rebuilt' のいずれかを返す。
+    data_version が同期時と同じなら DB の件数も数えない。
+    """
+    store = Path(store)
+    meta = _read_meta(store)
+    version = get_data_version(conn)
+    if meta and not rebuild and meta["data_version"] == version:
+        return "unchanged"
+
+    change, state = quote_changes(conn, None if rebuild else meta)
+    state["data_version"] = version
+    if change == "unchanged":
+        # 他のテーブルへの書き込みでバージョンだけ進んだ
+        _write_meta(store, {**meta, **state})
+    elif change == "appended":
+        _write(store, meta, *_merge(_load(store, meta), *read_quotes(conn, meta["max_rowid"])), state)
+    else:
+        _write(store, meta, *_merge(None, *read_quotes(conn)), state)
+    return change
+
+def open_price_matrix(db_path=DB, store=None, sync_first: bool = True) -> PriceMatrix:
+    """db_path の終値行列を開く（既定では先に price_quotes と同期する）。"""
+    store = Path(store) if store else store_path(db_path)
+    if sync_first or _read_meta(store) is None:
+        with get_pool(db_path).read() as conn:
+            sync(conn, store)
+    return _load(store, _read_meta(store))
+
+# ─────────────────────────────
+# 3. CLI
+# ─────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="price_quotes の終値行列（memmap、分析・ベンチマーク用）を同期する")
+    parser.add_argument("--db", default=DB, help="SQLite ファイルのパス")
+    parser.add_argument("--store", default=None, help="保存先ディレクトリ（既定: <DB 名>.prices）")
+    parser.add_argument("--rebuild", action="store_true", help="全件から作り直す")
+    args = parser.parse_args()
+
+    store = Path(args.store) if args.store else store_path(args.db)
+    started = time.perf_counter()
+    conn = connect(args.db)
+    ensure_schema(conn)
+    try:
+        result = sync(conn, store, rebuild=args.rebuild)
+    finally:
+        conn.close()
+    matrix = _load(store, _read_meta(store))
+    n_dates, n_securities = matrix.shape
+    filled = int(np.count_nonzero(~np.isnan(matrix.closes)))
+    label = {"unchanged": "変更なし", "appended": "追加分を反映", "rebuilt": "全件から作成"}[result]
+    print(f"✅ {store}: {label}（{n_dates:,} 日 × {n_securities:,} 銘柄 / 終値 {filled:,} 件 / "
+          f"{time.perf_counter() - started:.2f} 秒）")
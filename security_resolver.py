@@ -0,0 +1,147 @@
+# security_resolver.py
+"""
+銘柄コード → 銘柄情報（コード・名称・現在値）の解決。登録画面で使う。
+
+1. ローカルの securities（登録済みの銘柄。現在値は positions_current の最新株価）
+2. プロセス内の TTL キャッシュ（取得できなかったコードも NEGATIVE_TTL 秒だけ覚える）
+3. ネットワーク（market_data.get_info。バックグラウンドのスレッドで実行し、NETWORK_TIMEOUT 秒で打ち切る）
+
+prefetch() はコードを裏で取得し始めてすぐ戻る。登録画面では st.text_input の on_change から呼ぶので、
+取得が始まるのは入力が確定したとき（Enter またはフォーカスが外れたとき）で、打鍵ごとではない。
+Enter で確定してからボタンを押せば、resolve() は取得済みか取得中の結果を待つだけで済む
+（入力欄から直接ボタンを押したときは同じ再実行の中で prefetch と resolve が続けて呼ばれ、先読みの効果は無い）。
+
+    resolver = get_resolver(db_path)
+    resolver.prefetch("7203")           # 入力の確定時に呼ぶ（すぐ戻る）
+    info = resolver.resolve("7203")     # 無ければ None、時間切れは TimeoutError
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from db import DB_PATH, get_pool
+from market_data import INFO_TTL_SECONDS, get_market_data, to_ticker
+
+# ネットワーク取得の待ち時間の上限（秒）
+NETWORK_TIMEOUT = 5.0
+# 取得できなかったコードを覚えておく秒数
+NEGATIVE_TTL = 60
+# 先読みの対象にする最短のコード長（東証のコードは 4 桁）
+MIN_CODE_LENGTH = 4
+# ネットワーク取得に使うスレッド数
+MAX_WORKERS = 4
+
+# ─────────────────────────────
+# 1. 解決本体
+# ─────────────────────────────
+class SecurityResolver:
+    """ローカル → TTL キャッシュ → ネットワークの順に銘柄情報を引く。"""
+
+    def __init__(self, db_path=DB_PATH, ttl: int = INFO_TTL_SECONDS,
+                 timeout: float = NETWORK_TIMEOUT):
+        self.db_path = str(db_path)
+        self.ttl = ttl
+        self.timeout = timeout
+        self._cache: dict[str, tuple[float, dict | None]] = {}   # code → (期限, 情報)
+        self._inflight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="security-resolver")
+
+    # ── 1) ローカル ─────────────────────────────
+    def lookup_local(self, code: str) -> dict | None:
+        """securities に登録済みならその情報を返す。"""
+        with get_pool(self.db_path).read() as conn:
+            row = conn.execute(
+                """
+                SELECT s.security_code, s.d365_code, s.security_name, pc.market_price
+                FROM securities s
+                LEFT JOIN positions_current pc ON pc.security_id = s.security_id
+                WHERE s.security_code = ?
+                """,
+                (code,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"security_code": row[0], "d365_code": row[1], "security_name": row[2],
+                "market_price": row[3], "source": "local"}
+
+    # ── 2) TTL キャッシュ ───────────────────────
+    def _cached(self, code: str) -> tuple[bool, dict | None]:
+        with self._lock:
+            entry = self._cache.get(code)
+        if entry is None or entry[0] < time.monotonic():
+            return False, None
+        return True, entry[1]
+
+    # ── 3) ネットワーク ─────────────────────────
+    def _fetch_remote(self, code: str) -> dict | None:
+        t = get_market_data().get_info(to_ticker(code))
+        info = None
+        if t.get("shortName"):
+            info = {"security_code": code, "d365_code": code, "security_name": t["shortName"],
+                    "market_price": t.get("currentPrice"), "source": "network"}
+        ttl = self.ttl if info else NEGATIVE_TTL
+        with self._lock:
+            self._cache[code] = (time.monotonic() + ttl, info)
+        return info
+
+    def _submit(self, code: str) -> Future:
+        """code の取得を開始する（取得中なら同じ Future を返す）。"""
+        with self._lock:
+            future = self._inflight.get(code)
+            if future is None:
+                future = self._inflight[code] = self._executor.submit(self._fetch_remote, code)
+                future.add_done_callback(lambda _, code=code: self._done(code))
+            return future
+
+    def _done(self, code: str):
+        with self._lock:
+            self._inflight.pop(code, None)
+
+    # ── 公開 API ────────────────────────────────
+    def prefetch(self, code: str):
+        """
+        code を裏で取得し始める（すぐ戻る）。
+        短すぎるコード・登録済み・キャッシュ済みのコードは何もしない。
+        """
+        code = code.strip()
+        if len(code) < MIN_CODE_LENGTH or self._cached(code)[0] or self.lookup_local(code):
+            return
+        self._submit(code)
+
+    def resolve(self, code: str, timeout: float | None = None) -> dict | None:
+        """
+        code の銘柄情報（security_code / d365_code / security_name / market_price / source）を返す。
+        見つからなければ None。ネットワーク取得が timeout 秒（既定 NETWORK_TIMEOUT）を超えたら
+        TimeoutError（取得は裏で続き、終われば次回はキャッシュから返る）。
+        """
+        code = code.strip()
+        info = self.lookup_local(code)
+        if info:
+            return info
+        hit, info = self._cached(code)
+        if hit:
+            return info and {**info, "source": "cache"}
+        future = self._submit(code)
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except TimeoutError:
+            raise
+        except Exception:
+            return None
+
+# ─────────────────────────────
+# 2. 共有インスタンス
+# ─────────────────────────────
+_resolvers: dict[str, SecurityResolver] = {}
+_resolvers_lock = threading.Lock()
+
+def get_resolver(db_path=DB_PATH) -> SecurityResolver:
+    """DB ファイルごとに 1 つの SecurityResolver を返す（プロセス内で共有）。"""
+    key = str(Path(db_path).resolve())
+    with _resolvers_lock:
+        resolver = _resolvers.get(key)
+        if resolver is None:
+            resolver = _resolvers[key] = SecurityResolver(key)
+        return resolver
@@ -0,0 +1,204 @@
+# snapshots.py
+"""
+期末ポジションのスナップショット（positions_quarter / positions_halfyear）の生成。
+
+transactions を (security_id, txn_date, transaction_id) 順に 1 回だけ走査し、
+各四半期末・半期末の保有数と移動平均単価（position_ledger.apply_txn と同じ計算）を求め、
+期末時点の直近終値（price_asof で全期末 × 全銘柄をまとめて引く）と合わせて executemany で一括 upsert する。
+
+- 既定（増分）: 各テーブルの最新スナップショットより後の期末だけを作る
+- --full: テーブルを空にして最初の取引の期から作り直す
+
+    python snapshots.py --through 2025-03-31
+"""
+import argparse
+import calendar
+import math
+import sqlite3
+import time
+from datetime import date, timedelta
+
+from data_version import bump_data_version
+from db import connect
+from init_db import ensure_schema
+from position_ledger import apply_txn, moving_average
+from price_asof import build_index
+
+DB = "app.db"
+
+# 種類ごとの (テーブル, 期の列, 1 期の月数, ラベルの接頭辞)
+SNAPSHOT_KINDS = {
+    "quarter":  ("positions_quarter", "quarter", 3, "Q"),
+    "halfyear": ("positions_halfyear", "half", 6, "H"),
+}
+
+# ─────────────────────────────
+# 1. 期末日
+# ─────────────────────────────
+def period_ends(kind: str, first: date, through: date) -> list[tuple[date, str, str]]:
+    """first を含む期から through までに終わる期の (期末日, 年, 'Q1' / 'H1' など) を返す。"""
+    _, _, months, prefix = SNAPSHOT_KINDS[kind]
+    year, month = first.year, ((first.month - 1) // months + 1) * months
+    ends = []
+    while True:
+        end = date(year, month, calendar.monthrange(year, month)[1])
+        if end > through:
+            return ends
+        ends.append((end, str(year), f"{prefix}{month // months}"))
+        month += months
+        if month > 12:
+            year, month = year + 1, months
+
+def latest_snapshot_end(conn: sqlite3.Connection, kind: str) -> date | None:
+    """テーブルに登録済みの最新の期末日。スナップショットが無ければ None。"""
+    table, column, months, _ = SNAPSHOT_KINDS[kind]
+    row = conn.execute(
+        f"SELECT year, {column} FROM {table} ORDER BY year DESC, {column} DESC LIMIT 1"
+    ).fetchone()
+    if row is None:
+        return None
+    year, month = int(row[0]), int(row[1][1:]) * months
+    return date(year, month, calendar.monthrange(year, month)[1])
+
+# ─────────────────────────────
+# 2. 1 回の走査で全期末のポジションを計算
+# ─────────────────────────────
+def compute_snapshots(conn: sqlite3.Connection,
+                      ends: list[tuple[date, list[tuple[str, str, str]]]]) -> dict[str, list[tuple]]:
+    """
+    ends = [(期末日, [(kind, 年, 期ラベル), ...]), ...]（期末日の昇順）について、
+    { kind: [(security_id, 年, 期ラベル, holding_qty, avg_cost, market_price), ...] } を返す。
+    保有数が 0 以下、または期末以前の株価が無い銘柄は出力しない。
+    """
+    out = {kind: [] for kind in SNAPSHOT_KINDS}
+    if not ends:
+        return out
+    end_dates = [end.isoformat() for end, _ in ends]
+    # 期末 × 銘柄の直近終値（期末以前の株価が無ければ NaN）
+    index = build_index(conn)
+    closes = index.asof_many(end_dates)
+    columns = dict(zip(index.security_ids.tolist(), range(len(index.security_ids))))
+
+    def emit(sid, start, stop, holding_qty, holding_cost):
+        # 期末 index start..stop-1 の時点で、保有状態は (holding_qty, holding_cost)
+        col = columns.get(sid)
+        if holding_qty <= 0 or col is None:
+            return
+        avg_cost = moving_average(holding_qty, holding_cost)
+        for i in range(start, stop):
+            price = float(closes[i, col])
+            if math.isnan(price):
+                continue
+            for kind, year, label in ends[i][1]:
+                out[kind].append((sid, year, label, holding_qty, avg_cost, price))
+
+    cur = conn.execute(
+        """
+        SELECT security_id, txn_type, quantity, price, txn_date
+        FROM transactions
+        WHERE txn_date < ?
+        ORDER BY security_id, txn_date, transaction_id
+        """,
+        ((ends[-1][0] + timedelta(days=1)).isoformat(),)
+    )
+    current_sid = None
+    holding_qty = holding_cost = 0.0
+    i = 0
+    for sid, txn_type, qty, price, txn_date in cur:
+        if sid != current_sid:
+            # 前銘柄の残りの期末はすべて最終状態のまま
+            if current_sid is not None:
+                emit(current_sid, i, len(ends), holding_qty, holding_cost)
+            current_sid = sid
+            holding_qty = holding_cost = 0.0
+            i = 0
+        # この取引より前に終わった期末の状態を確定
+        day = txn_date[:10]
+        start = i
+        while i < len(ends) and end_dates[i] < day:
+            i += 1
+        if i > start:
+            emit(sid, start, i, holding_qty, holding_cost)
+        holding_qty, holding_cost = apply_txn(holding_qty, holding_cost, txn_type, qty, price)
+    if current_sid is not None:
+        emit(current_sid, i, len(ends), holding_qty, holding_cost)
+    return out
+
+# ─────────────────────────────
+# 3. 一括書き込み
+# ─────────────────────────────
+def write_snapshots(conn: sqlite3.Connection, kind: str, rows: list[tuple]) -> int:
+    """
+    compute_snapshots の 1 種類分を upsert し、件数を返す。
+    銘柄コード・名称は securities から引く。commit は呼び出し側で行う。
+    """
+    table, column, _, _ = SNAPSHOT_KINDS[kind]
+    conn.executemany(
+        f"""
+        INSERT INTO {table}
+            (security_id, d365_code, security_code, security_name, {column},
+             year, holding_qty, avg_cost, market_price, market_cap)
+        SELECT s.security_id, s.d365_code, s.security_code, s.security_name, ?3,
+               ?2, ?4, ?5, ?6, ?4 * ?6
+        FROM securities s
+        WHERE s.security_id = ?1
+        ON CONFLICT(security_id, year, {column}) DO UPDATE SET
+            holding_qty  = excluded.holding_qty,
+            avg_cost     = excluded.avg_cost,
+            market_price = excluded.market_price,
+            market_cap   = excluded.market_cap;
+        """,
+        rows
+    )
+    return len(rows)
+
+def generate_snapshots(conn: sqlite3.Connection, through: date | None = None,
+                       full: bool = False) -> dict[str, int]:
+    """
+    through（既定: 今日）までに終わった四半期末・半期末のスナップショットを作り、
+    { 'quarter': 件数, 'halfyear': 件数 } を返す。
+    full=False なら各テーブルの最新スナップショットより後の期末だけを計算する。
+    データバージョンも更新する。commit は呼び出し側で行う（with conn: で囲む想定）。
+    """
+    through = through or date.today()
+    first_txn = conn.execute("SELECT MIN(txn_date) FROM transactions").fetchone()[0]
+    if first_txn is None:
+        return {kind: 0 for kind in SNAPSHOT_KINDS}
+    first = date.fromisoformat(first_txn[:10])
+
+    by_date = {}
+    for kind, (table, _, _, _) in SNAPSHOT_KINDS.items():
+        if full:
+            conn.execute(f"DELETE FROM {table}")
+            latest = None
+        else:
+            latest = latest_snapshot_end(conn, kind)
+        for end, year, label in period_ends(kind, first, through):
+            if latest is None or end > latest:
+                by_date.setdefault(end, []).append((kind, year, label))
+
+    snapshots = compute_snapshots(conn, sorted(by_date.items()))
+    counts = {kind: write_snapshots(conn, kind, rows) for kind, rows in snapshots.items()}
+    bump_data_version(conn)
+    return counts
+
+# ─────────────────────────────
+# 4. CLI
+# ─────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="四半期末・半期末のポジションスナップショットを作成する")
+    parser.add_argument("--db", default=DB, help="SQLite ファイルのパス")
+    parser.add_argument("--through", type=date.fromisoformat, default=None,
+                        help="この日までに終わった期を対象にする（YYYY-MM-DD、既定: 今日）")
+    parser.add_argument("--full", action="store_true",
+                        help="既存のスナップショットを消して最初の期から作り直す")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    conn = connect(args.db)
+    ensure_schema(conn)
+    with conn:
+        counts = generate_snapshots(conn, args.through, args.full)
+    conn.close()
+    print(f"スナップショットを作成しました（四半期 {counts['quarter']:,} 件 / "
+          f"半期 {counts['halfyear']:,} 件 / {time.perf_counter() - started:.2f} 秒）")
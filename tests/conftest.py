@@ -0,0 +1,63 @@
+# tests/conftest.py
+"""テスト共通の fixture（一時ディレクトリに作る app.db）。"""
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from db import connect
+from init_db import ensure_schema
+from position_ledger import apply_txn
+
+@pytest.fixture
+def db_path(tmp_path):
+    """基本スキーマとマイグレーションを適用した空の DB のパス。"""
+    path = tmp_path / "app.db"
+    conn = connect(path)
+    ensure_schema(conn)
+    conn.close()
+    return path
+
+@pytest.fixture
+def conn(db_path):
+    conn = connect(db_path)
+    yield conn
+    conn.close()
+
+def add_security(conn, code: str, name: str | None = None) -> int:
+    """securities に 1 銘柄登録して security_id を返す。"""
+    cur = conn.execute(
+        "INSERT INTO securities (security_code, d365_code, security_name) VALUES (?, ?, ?)",
+        (code, code, name or f"銘柄{code}")
+    )
+    conn.commit()
+    return cur.lastrowid
+
+def random_trades(seed: int, count: int, first_day: str = "2024-01-01", days: int = 365) -> list[tuple]:
+    """(txn_type, quantity, price, txn_date) を count 件。同じ日に複数件の取引も含む。"""
+    rng = random.Random(seed)
+    start = date.fromisoformat(first_day)
+    trades = []
+    for _ in range(count):
+        txn_type = rng.choice(["BUY", "BUY", "SEL"])
+        trades.append((
+            txn_type,
+            rng.randint(1, 10) * 100,
+            round(rng.uniform(500, 3000), 2),
+            (start + timedelta(days=rng.randrange(days))).isoformat(),
+        ))
+    return trades
+
+def brute_force(conn, security_id: int, through: str | None = None) -> tuple[float, float, int]:
+    """transactions を先頭から全件再生した (holding_qty, holding_cost, txn_count)（through 以前の取引まで）。"""
+    sql = "SELECT txn_type, quantity, price FROM transactions WHERE security_id = ?"
+    params = [security_id]
+    if through is not None:
+        sql += " AND txn_date <= ?"
+        params.append(through)
+    qty = cost = 0.0
+    count = 0
+    for txn_type, quantity, price in conn.execute(sql + " ORDER BY txn_date, transaction_id", params):
+        qty, cost = apply_txn(qty, cost, txn_type, quantity, price)
+        count += 1
+    return qty, cost, count
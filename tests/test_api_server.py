@@ -0,0 +1,107 @@
+# tests/test_api_server.py
+import asyncio
+import json
+import threading
+
+import pytest
+
+import api_server
+from api_server import ApiApp, serve
+from conftest import add_security
+from db import READ_POOL_SIZE
+from position_ledger import record_transaction
+
+@pytest.fixture
+def app(conn, db_path):
+    sid = add_security(conn, "7203")
+    with conn:
+        record_transaction(conn, sid, "BUY", 100, 2500.0, "2025-01-10")
+    return ApiApp(db_path)
+
+def _bump(conn):
+    with conn:
+        conn.execute("UPDATE app_meta SET value = value + 1 WHERE key = 'data_version'")
+
+def test_etag_and_not_modified(app):
+    async def run():
+        status, headers, body = await app.respond("GET", "/positions", {})
+        assert status == 200
+        assert json.loads(body)["items"][0]["security_code"] == "7203"
+        again = await app.respond("GET", "/positions", {"if-none-match": headers["ETag"]})
+        assert again[:2] == (304, {"ETag": headers["ETag"]})
+    asyncio.run(run())
+
+def test_write_invalidates_cache(app, conn):
+    async def run():
+        _, first, _ = await app.respond("GET", "/positions", {})
+        _bump(conn)
+        status, second, body = await app.respond("GET", "/positions", {"if-none-match": first["ETag"]})
+        assert status == 200
+        assert second["ETag"] != first["ETag"]
+        assert json.loads(body)["data_version"] == app._version
+    asyncio.run(run())
+
+def test_request_after_write_does_not_reuse_stale_computation(app, conn, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    positions = api_server.ROUTES["/positions"]
+
+    def slow(conn, params, db_path):
+        started.set()
+        release.wait(5)
+        return positions(conn, params, db_path)
+
+    monkeypatch.setitem(api_server.ROUTES, "/positions", slow)
+
+    async def run():
+        old = asyncio.ensure_future(app.respond("GET", "/positions", {}))
+        await asyncio.to_thread(started.wait, 5)
+        _bump(conn)
+        new = asyncio.ensure_future(app.respond("GET", "/positions", {}))
+        await asyncio.sleep(0.05)
+        release.set()
+        (_, old_headers, old_body), (_, new_headers, new_body) = await old, await new
+        assert json.loads(new_body)["data_version"] == json.loads(old_body)["data_version"] + 1
+        assert new_headers["ETag"] != old_headers["ETag"]
+        # キャッシュには新しい版だけが残る
+        assert [etag for etag, _ in app._cache.values()] == [new_headers["ETag"]]
+    asyncio.run(run())
+
+def test_concurrent_performance_requests(app, monkeypatch):
+    # 読み取り用の接続を全部貸し出した状態で、各リクエストが as-of 索引を引く
+    barrier = threading.Barrier(READ_POOL_SIZE, timeout=5)
+    performance = api_server.ROUTES["/performance"]
+
+    def gathered(conn, params, db_path):
+        barrier.wait()
+        return performance(conn, params, db_path)
+
+    monkeypatch.setitem(api_server.ROUTES, "/performance", gathered)
+
+    async def run():
+        responses = await asyncio.gather(*(
+            app.respond("GET", f"/performance?date=2025-0{month}-15", {}) for month in range(1, 9)
+        ))
+        assert [status for status, _, _ in responses] == [200] * 8
+    asyncio.run(run())
+
+def test_errors(app):
+    async def run():
+        assert (await app.respond("GET", "/nowhere", {}))[0] == 404
+        assert (await app.respond("POST", "/positions", {}))[0] == 405
+        assert (await app.respond("GET", "/positions?date=2025-13-01", {}))[0] == 400
+        assert (await app.respond("GET", "/transactions?page_size=0", {}))[0] == 400
+    asyncio.run(run())
+
+def test_malformed_content_length(db_path):
+    async def run():
+        ready = asyncio.get_running_loop().create_future()
+        server = asyncio.ensure_future(serve(db_path, "127.0.0.1", 0, ready.set_result))
+        port = (await ready).sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /version HTTP/1.1\r\nContent-Length: abc\r\n\r\n")
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        server.cancel()
+        return response
+    assert asyncio.run(run()).startswith(b"HTTP/1.1 400 ")
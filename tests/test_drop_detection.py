@@ -0,0 +1,63 @@
+# tests/test_drop_detection.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from drop_detection import REASON_50PCT, REASON_COLUMN, REASON_STREAK, detect_drops, flagged, quarter_period
+
+def _quarters(rows) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=["security_code", "year", "quarter", "market_price"])
+
+def _by_period(df: pd.DataFrame, code: str) -> pd.DataFrame:
+    return df[df["security_code"] == code].set_index(["year", "quarter"])
+
+def test_quarter_period():
+    period = quarter_period(pd.Series(["2024", "2024", "2025", "2023"]), pd.Series(["Q1", "Q4", "Q1", "Q3"]))
+    assert period.tolist() == [2024 * 4, 2024 * 4 + 3, 2025 * 4, 2023 * 4 + 2]
+    # Q4 の次の期は翌年の Q1
+    assert period[2] - period[1] == 1
+
+def test_30_and_50_percent_drops():
+    df = detect_drops(_quarters([
+        ("1001", "2024", "Q1", 1000), ("1001", "2024", "Q2", 700),     # -30%
+        ("1002", "2024", "Q1", 1000), ("1002", "2024", "Q2", 500),     # -50%
+        ("1003", "2024", "Q1", 1000), ("1003", "2024", "Q2", 701),     # -29.9%
+    ]))
+    q2 = df[df["quarter"] == "Q2"].set_index("security_code")
+    assert q2["price_drop_rate"].tolist() == pytest.approx([-0.3, -0.5, -0.299])
+    assert q2["drop_30pct"].tolist() == [True, True, False]
+    assert q2["drop_50pct"].tolist() == [False, True, False]
+    # 単発の 30% 下落には理由が付かず、50% 下落には付く
+    assert q2[REASON_COLUMN].tolist() == ["", REASON_50PCT, ""]
+    assert flagged(df)["security_code"].tolist() == ["1002"]
+
+def test_consecutive_drops_across_year_boundary():
+    df = detect_drops(_quarters([
+        # 年・四半期の順に並んでいなくてもよい
+        ("1001", "2025", "Q1", 490), ("1001", "2024", "Q3", 1000), ("1001", "2024", "Q4", 700),
+        ("1002", 2024, "Q3", 1000), ("1002", 2024, "Q4", 700), ("1002", 2025, "Q1", 340),   # year が整数でもよい
+    ]))
+    a = _by_period(df, "1001")
+    assert a.loc[("2024", "Q4"), REASON_COLUMN] == ""
+    assert a.loc[("2025", "Q1"), "prev_market_price"] == 700
+    assert bool(a.loc[("2025", "Q1"), "prev_drop_30pct"])
+    assert a.loc[("2025", "Q1"), REASON_COLUMN] == REASON_STREAK
+    # 連続下落でもある 50% 下落は 50% 下落とする
+    assert _by_period(df, "1002").loc[("2025", "Q1"), REASON_COLUMN] == REASON_50PCT
+    assert list(df["security_code"]) == ["1001"] * 3 + ["1002"] * 3
+
+def test_missing_previous_quarter():
+    df = detect_drops(_quarters([
+        ("1001", "2024", "Q1", 1000), ("1001", "2024", "Q2", 600),
+        # Q3 が欠けているので Q4 には前期が無く、Q2 の下落とも連続しない
+        ("1001", "2024", "Q4", 300),
+        ("1002", "2024", "Q2", 500),
+    ]))
+    a = _by_period(df, "1001")
+    assert np.isnan(a.loc[("2024", "Q4"), "prev_market_price"])
+    assert not a.loc[("2024", "Q4"), "drop_30pct"]
+    assert not a.loc[("2024", "Q4"), "prev_drop_30pct"]
+    assert a.loc[("2024", "Q4"), REASON_COLUMN] == ""
+    # 別銘柄の直前の行を前期として使わない
+    assert np.isnan(_by_period(df, "1002").loc[("2024", "Q2"), "prev_market_price"])
+    assert flagged(df).empty
@@ -0,0 +1,95 @@
+# tests/test_export.py
+import gzip
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from conftest import add_security
+from export import DATASETS, export, export_bytes, file_name, frame_chunks, write_csv, write_parquet
+
+def _read_parquet(data: bytes) -> pa.Table:
+    return pq.read_table(pa.BufferReader(data))
+
+def test_parquet_null_column_takes_type_from_later_chunk():
+    chunks = [
+        pd.DataFrame({"id": [1, 2], "moving_average": [None, None], "code": ["1001", "1002"]}),
+        pd.DataFrame({"id": [3, 4], "moving_average": [None, None], "code": ["1003", None]}),
+        pd.DataFrame({"id": [5, 6], "moving_average": [1.5, np.nan], "code": ["1005", "1006"]}),
+    ]
+    table = _read_parquet(export_bytes(iter(chunks), "parquet"))
+    assert table.schema.field("moving_average").type == pa.float64()
+    assert table.schema.field("id").type == pa.int64()
+    assert table.column("moving_average").to_pylist() == [None, None, None, None, 1.5, None]
+    assert table.num_rows == 6
+
+def test_transactions_parquet_with_unset_moving_average(conn):
+    # 新しい順に書き出すので、moving_average 未計算の最近の取引が先頭のチャンクに来る
+    sid = add_security(conn, "1001")
+    conn.executemany(
+        "INSERT INTO transactions (security_id, txn_type, quantity, price, txn_date, moving_average) "
+        "VALUES (?, 'BUY', 100, 1000, ?, ?)",
+        [(sid, f"2025-01-{day:02d}", None if day > 20 else 1000.0) for day in range(1, 29)]
+    )
+    conn.commit()
+    chunks = DATASETS["transactions"](conn, pd.Timestamp("2025-01-01").date(), pd.Timestamp("2025-12-31").date(),
+                                      None, 5)
+    table = _read_parquet(export_bytes(chunks, "parquet"))
+    assert table.num_rows == 28
+    assert table.schema.field("moving_average").type == pa.float64()
+    assert table.column("moving_average").null_count == 8
+
+def test_parquet_column_null_throughout_is_string():
+    chunks = [pd.DataFrame({"id": [1], "note": [None]}), pd.DataFrame({"id": [2], "note": [None]})]
+    table = _read_parquet(export_bytes(iter(chunks), "parquet"))
+    assert table.schema.field("note").type == pa.string()
+    assert table.num_rows == 2
+
+def test_parquet_one_row_group_per_chunk():
+    df = pd.DataFrame({"x": range(10)})
+    buffer = io.BytesIO()
+    assert write_parquet(frame_chunks(df, chunk_size=3), buffer, "zstd") == 10
+    meta = pq.ParquetFile(pa.BufferReader(buffer.getvalue())).metadata
+    assert meta.num_row_groups == 4
+    assert meta.row_group(0).column(0).compression == "ZSTD"
+
+def test_parquet_without_chunks():
+    assert _read_parquet(export_bytes(iter([]), "parquet")).num_rows == 0
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_csv_chunks_match_single_write(compression):
+    df = pd.DataFrame({"code": ["1001", "1002", "1003"], "name": ["森永", "亀田", "明治"], "qty": [1.0, None, 3.0]})
+    buffer = io.BytesIO()
+    assert write_csv(frame_chunks(df, chunk_size=2), buffer, compression) == 3
+    data = buffer.getvalue()
+    if compression == "gzip":
+        data = gzip.decompress(data)
+    elif compression == "zstd":
+        # チャンクごとの zstd フレームが連結されている
+        data = pa.input_stream(pa.BufferReader(data), compression="zstd").read()
+    # BOM・見出しは先頭の 1 回だけ
+    assert data == df.to_csv(index=False).encode("utf-8-sig")
+
+def test_export_to_path_leaves_no_part_file(tmp_path):
+    out = tmp_path / file_name("transactions", "csv", "gzip")
+    assert out.name == "transactions.csv.gz"
+    export(frame_chunks(pd.DataFrame({"x": [1, 2]})), out, "csv", "gzip")
+    assert gzip.decompress(out.read_bytes()).decode("utf-8-sig") == "x\n1\n2\n"
+    assert list(tmp_path.iterdir()) == [out]
+
+def test_export_failure_removes_part_file(tmp_path):
+    def chunks():
+        yield pd.DataFrame({"x": [1]})
+        raise RuntimeError("boom")
+
+    out = tmp_path / "out.csv"
+    with pytest.raises(RuntimeError):
+        export(chunks(), out)
+    assert list(tmp_path.iterdir()) == []
+
+def test_unsupported_format():
+    with pytest.raises(ValueError):
+        export_bytes(iter([]), "xlsx")
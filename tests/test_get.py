@@ -0,0 +1,35 @@
+# tests/test_get.py
+import pandas as pd
+
+from conftest import add_security
+from get import write_quarter_end_closes
+
+def _closes(rows):
+    return pd.DataFrame(rows, columns=["ticker", "year", "quarter", "quote_date", "close"])
+
+def _current(conn, sid):
+    return conn.execute(
+        "SELECT market_price, quote_date FROM positions_current WHERE security_id = ?", (sid,)
+    ).fetchone()
+
+def test_new_closes_update_positions_current(conn):
+    sid = add_security(conn, "7203")
+    inserted, _ = write_quarter_end_closes(conn, _closes([("7203.T", "2025", "Q1", "2025-03-31", 2500.0)]))
+    assert inserted == 1
+    assert _current(conn, sid) == (2500.0, "2025-03-31")
+
+def test_existing_close_is_not_overwritten(conn):
+    sid = add_security(conn, "7203")
+    write_quarter_end_closes(conn, _closes([("7203.T", "2025", "Q1", "2025-03-31", 2500.0)]))
+
+    # 同じ日付の別の値は price_quotes に入らないので、positions_current も変えない
+    inserted, _ = write_quarter_end_closes(conn, _closes([("7203.T", "2025", "Q1", "2025-03-31", 9999.0)]))
+    assert inserted == 0
+    assert conn.execute(
+        "SELECT close_price FROM price_quotes WHERE security_id = ?", (sid,)
+    ).fetchall() == [(2500.0,)]
+    assert _current(conn, sid) == (2500.0, "2025-03-31")
+
+def test_unknown_securities_are_ignored(conn):
+    inserted, updated = write_quarter_end_closes(conn, _closes([("9999.T", "2025", "Q1", "2025-03-31", 1.0)]))
+    assert (inserted, updated) == (0, 0)
@@ -0,0 +1,103 @@
+# tests/test_import_trades.py
+import pytest
+
+import import_trades as import_trades_module
+from conftest import add_security, brute_force, random_trades
+from import_trades import import_trades, read_trades, validate_trades
+from position_ledger import CHECKPOINT_INTERVAL, apply_txn, moving_average, record_transaction
+
+CSV = """約定日,銘柄コード,銘柄名,売買,数量,単価
+2025/01/10,7203,トヨタ自動車,買,"1,000",2500
+2025-01-11,7203,トヨタ自動車,売,400,2600.5
+2025-01-12,6758,ソニーG,BUY,100,3000
+"""
+
+def _trades(rows) -> bytes:
+    lines = ["trade_date,code,side,qty,price"]
+    lines += [f"{day},{code},{side},{qty},{price}" for code, side, qty, price, day in rows]
+    return ("\n".join(lines) + "\n").encode()
+
+def test_read_cp932_with_japanese_headers():
+    trades, errors = validate_trades(read_trades(CSV.encode("cp932")))
+    assert errors == []
+    assert trades.to_dict("records")[0] == {
+        "security_code": "7203", "security_name": "トヨタ自動車", "txn_type": "BUY",
+        "quantity": 1000.0, "price": 2500.0, "txn_date": "2025-01-10",
+    }
+    assert list(trades["txn_type"]) == ["BUY", "SEL", "BUY"]
+
+def test_invalid_rows_are_reported_with_line_numbers():
+    raw = _trades([("7203", "BUY", 100, 2500, "2025-01-10"),
+                   ("", "BUY", 100, 2500, "2025-01-10"),
+                   ("7203", "HOLD", 100, 2500, "2025-01-10"),
+                   ("7203", "BUY", -1, 2500, "2025-01-10"),
+                   ("7203", "BUY", 100, 2500, "2025-02-30")])
+    trades, errors = validate_trades(read_trades(raw))
+    assert len(trades) == 1
+    assert [line for line, _ in errors] == [3, 4, 5, 6]
+
+def test_missing_column():
+    with pytest.raises(ValueError, match="price"):
+        read_trades(b"trade_date,code,side,qty\n2025-01-10,7203,BUY,100\n")
+
+def test_import_matches_full_replay(conn):
+    # 既存の取引（チェックポイントあり）の途中の日付に遡る取引をまとめて取り込む
+    sid = add_security(conn, "7203")
+    existing = sorted(random_trades(0, CHECKPOINT_INTERVAL + 10, "2024-01-01", 365), key=lambda t: t[3])
+    for txn_type, qty, price, day in existing:
+        with conn:
+            record_transaction(conn, sid, txn_type, qty, price, day)
+    new = random_trades(1, 40, "2024-06-01", 300)
+
+    trades, errors = validate_trades(read_trades(_trades([("7203", *t) for t in new] +
+                                                         [("6758", "BUY", 100, 3000, "2024-07-01")])))
+    assert errors == []
+    with conn:
+        stats = import_trades(conn, trades)
+    assert stats["inserted"] == 41
+    assert stats["new_securities"] == 1
+    assert stats["securities"] == 2
+
+    for security_id, qty, cost, count in conn.execute(
+        "SELECT security_id, holding_qty, holding_cost, txn_count FROM position_state"
+    ).fetchall():
+        assert (qty, cost, count) == pytest.approx(brute_force(conn, security_id))
+    # 取引ごとの moving_average も先頭から再生した値と同じ
+    qty = cost = 0.0
+    for txn_type, quantity, price, ma in conn.execute(
+        "SELECT txn_type, quantity, price, moving_average FROM transactions WHERE security_id = ? "
+        "ORDER BY txn_date, transaction_id", (sid,)
+    ).fetchall():
+        qty, cost = apply_txn(qty, cost, txn_type, quantity, price)
+        assert ma == pytest.approx(moving_average(qty, cost))
+
+def test_skip_existing_reimport(conn):
+    raw = _trades([("7203", "BUY", 100, 2500, "2025-01-10"),
+                   ("7203", "BUY", 100, 2500, "2025-01-10"),
+                   ("7203", "SEL", 50, 2600, "2025-01-11")])
+    trades, _ = validate_trades(read_trades(raw))
+    with conn:
+        import_trades(conn, trades)
+
+    more = _trades([("7203", "BUY", 100, 2500, "2025-01-10"),
+                    ("7203", "BUY", 100, 2500, "2025-01-10"),
+                    ("7203", "BUY", 100, 2500, "2025-01-10"),
+                    ("7203", "SEL", 50, 2600, "2025-01-11")])
+    trades, _ = validate_trades(read_trades(more))
+    with conn:
+        stats = import_trades(conn, trades, skip_existing=True)
+    # 同じ内容の取引は件数で突き合わせるので、3 件目の買いだけが新しい
+    assert (stats["inserted"], stats["skipped"]) == (1, 3)
+    assert conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 4
+
+def test_failed_import_rolls_back(conn, monkeypatch):
+    def boom(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(import_trades_module, "replay_from_checkpoint", boom)
+    trades, _ = validate_trades(read_trades(_trades([("7203", "BUY", 100, 2500, "2025-01-10")])))
+    with pytest.raises(RuntimeError):
+        with conn:
+            import_trades(conn, trades)
+    assert conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM securities").fetchone()[0] == 0
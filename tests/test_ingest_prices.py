@@ -0,0 +1,79 @@
+# tests/test_ingest_prices.py
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from conftest import add_security
+from ingest_prices import ingest
+
+# 取引所の休日（平日だが日足が無い）
+HOLIDAYS = {"2025-01-01", "2025-01-02", "2025-01-03", "2025-01-13"}
+
+class RecordingProvider:
+    """取引のあった平日の日足を返し、リクエストされた (ティッカー, 開始日, 終了日) を記録する。"""
+
+    def __init__(self):
+        self.requests = []
+
+    def history(self, tickers, start, end):
+        self.requests.append((sorted(tickers), start, end))
+        days = [d for d in pd.bdate_range(start, end).strftime("%Y-%m-%d") if d not in HOLIDAYS]
+        return pd.DataFrame(
+            [(tk, d, 100.0, 100.0, 100.0, 100.0, 1000) for tk in tickers for d in days],
+            columns=["ticker", "date", "open", "high", "low", "close", "volume"],
+        )
+
+@pytest.fixture
+def provider():
+    return RecordingProvider()
+
+def test_holidays_are_not_refetched(conn, provider):
+    add_security(conn, "7203")
+    add_security(conn, "6758")
+    stats = ingest(conn, date(2025, 1, 1), date(2025, 1, 17), provider=provider)
+    assert provider.requests == [(["6758.T", "7203.T"], date(2025, 1, 1), date(2025, 1, 17))]
+    assert stats["inserted"] == 2 * 9
+
+    # 同じ期間を最初から取り込み直しても、休日の分を取りにいかない
+    stats = ingest(conn, date(2025, 1, 1), date(2025, 1, 17), provider=provider, reset=False)
+    assert stats["resumed"] == 2
+    stats = ingest(conn, date(2025, 1, 2), date(2025, 1, 16), provider=provider)
+    assert (stats["requests"], len(provider.requests)) == (0, 1)
+
+def test_only_uncovered_days_are_requested(conn, provider):
+    add_security(conn, "7203")
+    ingest(conn, date(2025, 1, 6), date(2025, 1, 17), provider=provider)
+    # 期間を前後に広げると、取得済み期間の外側を含む最小の期間だけ取得する
+    ingest(conn, date(2025, 1, 6), date(2025, 1, 24), provider=provider)
+    sid = add_security(conn, "6758")
+    ingest(conn, date(2025, 1, 1), date(2025, 1, 24), provider=provider)
+    assert provider.requests[1:] == [
+        (["7203.T"], date(2025, 1, 20), date(2025, 1, 24)),
+        (["7203.T"], date(2025, 1, 1), date(2025, 1, 3)),
+        (["6758.T"], date(2025, 1, 1), date(2025, 1, 24)),
+    ]
+    assert conn.execute(
+        "SELECT start_date, end_date FROM price_quote_coverage WHERE security_id = ?", (sid,)
+    ).fetchall() == [("2025-01-01", "2025-01-24")]
+
+def test_no_bars_are_requested_again(conn):
+    class EmptyProvider(RecordingProvider):
+        def history(self, tickers, start, end):
+            super().history(tickers, start, end)
+            return pd.DataFrame(columns=["ticker", "date", "close"])
+
+    provider = EmptyProvider()
+    add_security(conn, "7203")
+    ingest(conn, date(2025, 1, 6), date(2025, 1, 10), provider=provider)
+    ingest(conn, date(2025, 1, 6), date(2025, 1, 10), provider=provider, reset=True)
+    # 何も返ってこなかった銘柄は取得済みにしない
+    assert len(provider.requests) == 2
+
+def test_reset_forgets_covered_range(conn, provider):
+    add_security(conn, "7203")
+    ingest(conn, date(2025, 1, 13), date(2025, 1, 17), provider=provider)
+    ingest(conn, date(2025, 1, 13), date(2025, 1, 17), provider=provider, reset=True)
+    # 行のある日は取り直さないが、取得済み期間を消したので休日は取りにいく
+    assert [r[1:] for r in provider.requests] == [(date(2025, 1, 13), date(2025, 1, 17)),
+                                                  (date(2025, 1, 13), date(2025, 1, 13))]
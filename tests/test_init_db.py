@@ -0,0 +1,78 @@
+# tests/test_init_db.py
+import sqlite3
+
+import pandas as pd
+
+from data_version import get_data_version
+from drop_detection import save_judgements
+from init_db import MIGRATIONS, create_schema, explain_check, explain_hot_queries, full_scans, migrate
+
+def _user_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def test_migrate_applies_each_version_once():
+    conn = sqlite3.connect(":memory:")
+    create_schema(conn)
+    assert migrate(conn) == [v for v, _, _ in MIGRATIONS]
+    assert _user_version(conn) == MIGRATIONS[-1][0]
+    assert migrate(conn) == []
+
+def test_migrate_stops_at_target():
+    conn = sqlite3.connect(":memory:")
+    create_schema(conn)
+    assert migrate(conn, target=2) == [1, 2]
+    assert _user_version(conn) == 2
+    # positions_current への載せ替え（version 3）はまだ
+    view = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'v_positions'").fetchone()[0]
+    assert "positions_current" not in view
+    assert migrate(conn) == [v for v, _, _ in MIGRATIONS if v > 2]
+
+def test_index_migration_removes_full_scans():
+    conn = sqlite3.connect(":memory:")
+    create_schema(conn)
+    migrate(conn, target=1)
+    assert full_scans(explain_hot_queries(conn))
+    migrate(conn, target=2)
+    assert full_scans(explain_hot_queries(conn)) == {}
+
+def test_explain_check(capsys):
+    assert explain_check()
+    assert "全件走査なし" in capsys.readouterr().out
+
+def _judgements(conn) -> list[tuple]:
+    return conn.execute(
+        "SELECT security_code, year, quarter, drop_30pct, judged_at FROM drop_judgement "
+        "ORDER BY security_code, year, quarter"
+    ).fetchall()
+
+def test_unique_drop_judgement_keeps_latest_duplicate():
+    conn = sqlite3.connect(":memory:")
+    create_schema(conn)
+    migrate(conn, target=3)
+    conn.executemany(
+        "INSERT INTO drop_judgement (security_code, year, quarter, drop_30pct, judged_at) VALUES (?, ?, ?, ?, ?)",
+        [("1001", "2024", "Q1", 0, "t1"), ("1001", "2024", "Q1", 1, "t2"), ("1002", "2024", "Q1", 0, "t1"),
+         ("1001", "2024", "Q2", 1, "t1"), ("1001", "2024", "Q1", 0, "t3")]
+    )
+    conn.commit()
+    assert migrate(conn, target=4) == [4]
+    # 重複は id の最も大きい（最後に登録した）行だけ残る
+    assert _judgements(conn) == [("1001", "2024", "Q1", 0, "t3"), ("1001", "2024", "Q2", 1, "t1"),
+                                 ("1002", "2024", "Q1", 0, "t1")]
+    index = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'ux_drop_judgement_period'").fetchone()[0]
+    assert "UNIQUE" in index
+
+def test_save_judgements_upserts(conn):
+    df = pd.DataFrame({"security_code": ["1001", "1002"], "year": [2024, 2024], "quarter": ["Q1", "Q1"],
+                       "drop_30pct": [True, False]})
+    with conn:
+        assert save_judgements(conn, df, judged_at="t1") == 2
+    version = get_data_version(conn)
+
+    # 判定が変わったものを保存し直すと、行は増えずに上書きされる
+    df["drop_30pct"] = [False, True]
+    with conn:
+        save_judgements(conn, pd.concat([df, df.assign(quarter="Q2")]), judged_at="t2")
+    assert _judgements(conn) == [("1001", "2024", "Q1", 0, "t2"), ("1001", "2024", "Q2", 0, "t2"),
+                                 ("1002", "2024", "Q1", 1, "t2"), ("1002", "2024", "Q2", 1, "t2")]
+    assert get_data_version(conn) == version + 1
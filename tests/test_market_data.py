@@ -0,0 +1,45 @@
+# tests/test_market_data.py
+from datetime import date
+
+import pytest
+
+from market_data import FixtureProvider, MarketDataCache
+
+BARS = """ticker,date,open,high,low,close,volume
+A.T,2025-01-06,100,101,99,100,1000
+A.T,2025-01-07,100,102,99,101,1000
+A.T,2025-01-08,101,103,100,102,1000
+C.T,2025-01-06,50,51,49,50,500
+"""
+
+@pytest.fixture
+def cache(tmp_path):
+    (tmp_path / "bars.csv").write_text(BARS, encoding="utf-8")
+    provider = FixtureProvider(tmp_path)
+    return MarketDataCache(tmp_path / "cache.db", provider=provider), provider
+
+def test_history_is_fetched_once(cache):
+    cache, provider = cache
+    first = cache.get_history(["A.T"], date(2025, 1, 6), date(2025, 1, 8))
+    second = cache.get_history(["A.T"], date(2025, 1, 6), date(2025, 1, 8))
+    assert len(first) == len(second) == 3
+    assert [c[0] for c in provider.calls] == ["history"]
+
+def test_tickers_without_bars_are_not_marked_covered(cache):
+    cache, provider = cache
+    cache.get_history(["A.T", "B.T"], date(2025, 1, 6), date(2025, 1, 8))
+    assert cache.missing_ranges("A.T", date(2025, 1, 6), date(2025, 1, 8)) == []
+    assert cache.missing_ranges("B.T", date(2025, 1, 6), date(2025, 1, 8)) == [(date(2025, 1, 6), date(2025, 1, 8))]
+
+    cache.get_history(["A.T", "B.T"], date(2025, 1, 6), date(2025, 1, 8))
+    assert provider.calls[-1][1] == ("B.T",)
+
+def test_coverage_runs_to_gap_end_for_tickers_with_bars(cache):
+    cache, provider = cache
+    # 2025-01-11/12 は週末で日足が無い
+    cache.get_history(["A.T", "C.T"], date(2025, 1, 6), date(2025, 1, 12))
+    for tk in ("A.T", "C.T"):
+        assert cache.missing_ranges(tk, date(2025, 1, 6), date(2025, 1, 12)) == []
+
+    cache.get_history(["A.T", "C.T"], date(2025, 1, 6), date(2025, 1, 12))
+    assert [c[0] for c in provider.calls] == ["history"]
@@ -0,0 +1,126 @@
+# tests/test_position_ledger.py
+from datetime import date
+
+import pytest
+
+import create_dummydata
+from analytics import holdings_asof, prev_positions_asof, quarter_performance
+from conftest import add_security, brute_force, random_trades
+from db import connect
+from init_db import ensure_schema
+from position_ledger import (
+    CHECKPOINT_INTERVAL,
+    apply_txn,
+    position_asof,
+    positions_asof,
+    record_transaction,
+    replay_events,
+)
+
+def _register(conn, sid, trades):
+    for txn_type, qty, price, day in trades:
+        with conn:
+            record_transaction(conn, sid, txn_type, qty, price, day)
+
+@pytest.fixture
+def ledger(conn):
+    """3 銘柄（チェックポイント複数・1 つだけ・無し）を日付順と遡りを混ぜて登録した DB。"""
+    sids = [add_security(conn, code) for code in ("1001", "1002", "1003")]
+    for seed, (sid, count) in enumerate(zip(sids, (CHECKPOINT_INTERVAL * 3 + 5, CHECKPOINT_INTERVAL + 1, 7))):
+        trades = random_trades(seed, count)
+        # 大半は日付順、残りは遡り登録
+        head = sorted(trades[:-10], key=lambda t: t[3])
+        _register(conn, sid, head + trades[-10:])
+    return conn, sids
+
+def test_replay_events():
+    rows = [(1, "2025-01-01", "BUY", 100, 10.0), (2, "2025-01-02", "BUY", 100, 20.0),
+            (3, "2025-01-03", "SEL", 50, 30.0)]
+    states = [state for _, *state in replay_events(rows)]
+    assert states == [[100, 1000.0, 1], [200, 3000.0, 2], [150, 2250.0, 3]]
+    # 途中の状態から続けて再生できる
+    assert [s for _, *s in replay_events(rows[2:], 200, 3000.0, 2)] == states[2:]
+
+def test_sell_beyond_holding_is_capped():
+    assert apply_txn(100, 1000.0, "SEL", 300, 50.0) == (0, 0.0)
+
+def test_position_state_matches_full_replay(ledger):
+    conn, sids = ledger
+    for sid in sids:
+        state = conn.execute(
+            "SELECT holding_qty, holding_cost, txn_count FROM position_state WHERE security_id = ?", (sid,)
+        ).fetchone()
+        assert state == pytest.approx(brute_force(conn, sid))
+
+def test_positions_asof_matches_full_replay(ledger):
+    conn, sids = ledger
+    checkpoint_days = [d for (d,) in conn.execute("SELECT DISTINCT txn_date FROM position_checkpoints")]
+    days = ["2023-12-31", "2024-01-01", "2024-03-31", "2024-07-15", "2024-12-31", "2030-01-01"]
+    for day in days + checkpoint_days:
+        got = positions_asof(conn, day)
+        want = {sid: brute_force(conn, sid, day) for sid in sids}
+        want = {sid: state for sid, state in want.items() if state[2]}
+        assert got.keys() == want.keys(), day
+        for sid in want:
+            assert got[sid] == pytest.approx(want[sid]), (day, sid)
+
+def test_positions_asof_subset(ledger):
+    conn, sids = ledger
+    assert positions_asof(conn, "2024-06-30", [sids[1]]).keys() == {sids[1]}
+    assert positions_asof(conn, "2024-06-30", []) == {}
+    assert position_asof(conn, sids[0], date(2024, 6, 30)) == pytest.approx(brute_force(conn, sids[0], "2024-06-30"))
+    assert position_asof(conn, sids[0], "2000-01-01") == (0.0, 0.0, 0)
+
+def test_holdings_asof(ledger):
+    conn, sids = ledger
+    df = holdings_asof(conn, date(2024, 6, 30))
+    assert list(df["security_code"]) == sorted(df["security_code"])
+    row = df.set_index("security_id").loc[sids[0]]
+    qty, cost, count = brute_force(conn, sids[0], "2024-06-30")
+    assert (row["holding_qty"], row["txn_count"]) == (qty, count)
+    assert row["avg_cost"] == pytest.approx(cost / qty)
+
+    prev = prev_positions_asof(conn, date(2024, 6, 30))
+    assert (prev["prev_holding_qty"] > 0).all()
+    assert set(prev.index) <= set(df["security_code"])
+
+def test_quarter_performance_uses_positions_quarter(conn):
+    # 前期の基準は positions_quarter（管理画面で編集できる）で、取引台帳からは作らない
+    sid = add_security(conn, "1001")
+    _register(conn, sid, [("BUY", 100, 1000.0, "2025-02-01")])
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO positions_quarter
+                (security_id, d365_code, security_code, security_name, year, quarter,
+                 holding_qty, avg_cost, market_price, market_cap)
+            VALUES (?, '1001', '1001', '銘柄1001', '2025', 'Q1', 300, 1200, 1300, 390000)
+            """,
+            (sid,)
+        )
+    df = quarter_performance(conn, date(2025, 5, 15)).set_index("security_code")
+    # 取引台帳では 100 株・1000 円だが、positions_quarter の値を使う
+    assert df.loc["1001", "prev_avg_cost"] == 1200
+    assert df.loc["1001", "latest_holding_qty"] == 300
+
+def test_dummy_data_keeps_ledger_in_step(tmp_path, monkeypatch):
+    # 台帳のある DB に create_dummydata が取引を直接 INSERT しても、position_state が追従する
+    monkeypatch.chdir(tmp_path)
+    conn = connect(tmp_path / "app.db")
+    ensure_schema(conn)
+    sid = add_security(conn, "2201", "森永製菓")
+    _register(conn, sid, sorted(random_trades(0, CHECKPOINT_INTERVAL + 3), key=lambda t: t[3]))
+    conn.close()
+
+    create_dummydata.create_dummy_data()
+
+    conn = connect(tmp_path / "app.db")
+    for sid, qty, cost, count in conn.execute(
+        "SELECT security_id, holding_qty, holding_cost, txn_count FROM position_state"
+    ).fetchall():
+        assert (qty, cost, count) == pytest.approx(brute_force(conn, sid))
+    assert conn.execute(
+        "SELECT COUNT(*) FROM securities s "
+        "WHERE NOT EXISTS (SELECT 1 FROM position_state p WHERE p.security_id = s.security_id)"
+    ).fetchone()[0] == 0
+    conn.close()
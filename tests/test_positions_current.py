@@ -0,0 +1,62 @@
+# tests/test_positions_current.py
+import pytest
+
+from conftest import add_security
+from position_ledger import record_transaction
+from positions_current import apply_prices, check, rebuild
+
+def _current(conn, sid) -> tuple:
+    return conn.execute(
+        "SELECT holding_qty, avg_cost, market_price, quote_date, valuation_diff "
+        "FROM positions_current WHERE security_id = ?", (sid,)
+    ).fetchone()
+
+def _add_quote(conn, sid, day, close):
+    with conn:
+        conn.execute("INSERT INTO price_quotes (quote_date, security_id, close_price) VALUES (?, ?, ?)",
+                     (day, sid, close))
+        apply_prices(conn, [(day, sid, close)])
+
+@pytest.fixture
+def position(conn):
+    sid = add_security(conn, "1001")
+    with conn:
+        record_transaction(conn, sid, "BUY", 100, 1000.0, "2025-01-10")
+    _add_quote(conn, sid, "2025-02-03", 1200.0)
+    return conn, sid
+
+def test_apply_prices_ignores_older_quote(position):
+    conn, sid = position
+    _add_quote(conn, sid, "2025-01-31", 900.0)
+    assert _current(conn, sid) == (100, 1000.0, 1200.0, "2025-02-03", 20000.0)
+
+    # 同じ日付・新しい日付は反映する
+    _add_quote(conn, sid, "2025-02-04", 1100.0)
+    assert _current(conn, sid)[2:] == (1100.0, "2025-02-04", 10000.0)
+    assert check(conn) == []
+
+def test_apply_prices_creates_row_for_price_only_security(conn):
+    sid = add_security(conn, "1002")
+    _add_quote(conn, sid, "2025-02-03", 500.0)
+    assert _current(conn, sid)[2:4] == (500.0, "2025-02-03")
+    assert check(conn) == []
+
+def test_check_finds_drift_and_rebuild_repairs(position):
+    conn, sid = position
+    with conn:
+        conn.execute("UPDATE positions_current SET holding_qty = 90, market_price = 1150 WHERE security_id = ?",
+                     (sid,))
+    diffs = {(s, col): (have, want) for s, col, have, want in check(conn)}
+    assert diffs[(sid, "holding_qty")] == (90, 100)
+    assert diffs[(sid, "market_price")] == (1150, 1200.0)
+
+    with conn:
+        assert rebuild(conn) == 1
+    assert check(conn) == []
+    assert _current(conn, sid) == (100, 1000.0, 1200.0, "2025-02-03", 20000.0)
+
+def test_check_finds_missing_row(position):
+    conn, sid = position
+    with conn:
+        conn.execute("DELETE FROM positions_current WHERE security_id = ?", (sid,))
+    assert [(s, col) for s, col, _, _ in check(conn)] == [(sid, "(row)")]
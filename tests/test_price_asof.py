@@ -0,0 +1,94 @@
+# tests/test_price_asof.py
+from contextlib import ExitStack
+from datetime import date
+
+import numpy as np
+import pytest
+
+import price_asof
+from conftest import add_security
+from data_version import bump_data_version
+from db import READ_POOL_SIZE, get_pool
+from price_asof import AsofIndex, build_index, get_asof_index
+
+def _add_quotes(conn, rows):
+    """price_quotes に (quote_date, security_id, close_price) を追加して data_version を進める。"""
+    with conn:
+        conn.executemany("INSERT INTO price_quotes (quote_date, security_id, close_price) VALUES (?, ?, ?)", rows)
+        bump_data_version(conn)
+
+@pytest.fixture
+def quotes(conn):
+    # 2025-01-04/05 は週末で株価なし。2 銘柄目は 1/7 から
+    sids = [add_security(conn, "1001"), add_security(conn, "1002")]
+    _add_quotes(conn, [("2025-01-02", sids[0], 100.0), ("2025-01-03", sids[0], 101.0),
+                       ("2025-01-06", sids[0], 102.0), ("2025-01-07", sids[1], 500.0)])
+    return conn, sids
+
+@pytest.fixture
+def build_calls(monkeypatch):
+    calls = []
+
+    def counting_build(conn):
+        calls.append(1)
+        return build_index(conn)
+
+    monkeypatch.setattr(price_asof, "build_index", counting_build)
+    monkeypatch.setattr(price_asof, "_indexes", {})
+    return calls
+
+def test_asof_goes_back_to_previous_quote(quotes):
+    conn, (a, b) = quotes
+    index = build_index(conn)
+    assert index.asof(date(2025, 1, 5)) == {a: 101.0}
+    assert index.asof("2025-01-07") == {a: 102.0, b: 500.0}
+    assert index.asof(date(2025, 1, 1)) == {}
+
+def test_asof_many_is_nan_before_first_quote(quotes):
+    conn, (a, b) = quotes
+    index = build_index(conn)
+    assert list(index.security_ids) == [a, b]
+    got = index.asof_many([date(2025, 1, 1), date(2025, 1, 4), date(2025, 1, 31)])
+    np.testing.assert_array_equal(got, [[np.nan, np.nan], [101.0, np.nan], [102.0, 500.0]])
+
+def test_extend_returns_new_index():
+    index = AsofIndex(np.array(["2025-01-02", "2025-01-06"], dtype="datetime64[D]"),
+                      np.array([1, 1]), np.array([10.0, 12.0]))
+    # 既存の行より前の日付や新しい銘柄が混じっても (security_id, 日付) 順に並べ直す
+    extended = index.extend(np.array(["2025-01-03", "2025-01-02"], dtype="datetime64[D]"),
+                            np.array([1, 2]), np.array([11.0, 20.0]))
+    assert len(index) == 2 and len(extended) == 4
+    assert extended.asof("2025-01-05") == {1: 11.0, 2: 20.0}
+    assert index.asof("2025-01-05") == {1: 10.0}
+
+def test_cached_index_appends_new_quotes(db_path, quotes, build_calls):
+    conn, (a, b) = quotes
+    first = get_asof_index(db_path)
+    assert get_asof_index(db_path) is first
+    _add_quotes(conn, [("2025-01-08", a, 103.0), ("2025-01-08", b, 510.0)])
+
+    index = get_asof_index(db_path)
+    assert index is not first
+    assert index.asof("2025-01-08") == {a: 103.0, b: 510.0}
+    # 追記分だけ読み足し、全件は最初の 1 回しか読まない
+    assert len(build_calls) == 1
+
+def test_cached_index_rebuilds_after_delete(db_path, quotes, build_calls):
+    conn, (a, b) = quotes
+    get_asof_index(db_path)
+    with conn:
+        conn.execute("DELETE FROM price_quotes WHERE quote_date = '2025-01-06'")
+        bump_data_version(conn)
+    _add_quotes(conn, [("2025-01-08", b, 510.0)])
+
+    index = get_asof_index(db_path)
+    assert index.asof("2025-01-08") == {a: 101.0, b: 510.0}
+    assert len(build_calls) == 2
+
+def test_uses_callers_connection_when_pool_is_exhausted(db_path, quotes, build_calls):
+    conn, (a, b) = quotes
+    pool = get_pool(db_path)
+    with ExitStack() as stack:
+        readers = [stack.enter_context(pool.read()) for _ in range(READ_POOL_SIZE)]
+        # 接続を全部借りた状態でも、借りている接続を渡せば待たずに返る
+        assert get_asof_index(db_path, readers[0]).asof("2025-01-07") == {a: 102.0, b: 500.0}
@@ -0,0 +1,103 @@
+# tests/test_snapshots.py
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import add_security, brute_force, random_trades
+from position_ledger import moving_average, record_transaction
+from snapshots import SNAPSHOT_KINDS, generate_snapshots, period_ends
+
+def _register(conn, sid, trades):
+    for txn_type, qty, price, day in trades:
+        with conn:
+            record_transaction(conn, sid, txn_type, qty, price, day)
+
+def _snapshot_rows(conn, kind) -> dict:
+    table, column, _, _ = SNAPSHOT_KINDS[kind]
+    return {
+        (sid, year, label): (qty, avg_cost, price, cap)
+        for sid, year, label, qty, avg_cost, price, cap in conn.execute(
+            f"SELECT security_id, year, {column}, holding_qty, avg_cost, market_price, market_cap FROM {table}"
+        )
+    }
+
+def _expected(conn, kind, sids, first: date, through: date) -> dict:
+    """期末ごとに取引を先頭から再生し、期末以前の直近終値と合わせた期待値。"""
+    rows = {}
+    for end, year, label in period_ends(kind, first, through):
+        for sid in sids:
+            qty, cost, _ = brute_force(conn, sid, end.isoformat())
+            price = conn.execute(
+                "SELECT close_price FROM price_quotes WHERE security_id = ? AND quote_date <= ? "
+                "ORDER BY quote_date DESC LIMIT 1", (sid, end.isoformat())
+            ).fetchone()
+            if qty > 0 and price is not None:
+                rows[(sid, year, label)] = (qty, moving_average(qty, cost), price[0], qty * price[0])
+    return rows
+
+def _assert_matches(got: dict, want: dict):
+    assert got.keys() == want.keys()
+    for key in want:
+        assert got[key] == pytest.approx(want[key]), key
+
+@pytest.fixture
+def book(conn):
+    """3 銘柄の取引（2023〜2024 年）と週次の終値。3 銘柄目は 2024-05 まで株価が無い。"""
+    sids = [add_security(conn, code) for code in ("1001", "1002", "1003")]
+    for seed, sid in enumerate(sids):
+        _register(conn, sid, sorted(random_trades(seed, 60, "2023-02-01", 700), key=lambda t: t[3]))
+    rng = random.Random(0)
+    day = date(2023, 1, 2)
+    rows = []
+    while day <= date(2025, 6, 30):
+        rows += [(day.isoformat(), sid, round(rng.uniform(500, 3000), 1))
+                 for sid in sids if sid != sids[2] or day >= date(2024, 5, 1)]
+        day += timedelta(days=7)
+    with conn:
+        conn.executemany("INSERT INTO price_quotes (quote_date, security_id, close_price) VALUES (?, ?, ?)", rows)
+    return conn, sids
+
+@pytest.mark.parametrize("kind", list(SNAPSHOT_KINDS))
+def test_full_matches_brute_force(book, kind):
+    conn, sids = book
+    with conn:
+        counts = generate_snapshots(conn, date(2025, 3, 31), full=True)
+    want = _expected(conn, kind, sids, date(2023, 2, 1), date(2025, 3, 31))
+    assert counts[kind] == len(want)
+    _assert_matches(_snapshot_rows(conn, kind), want)
+
+@pytest.mark.parametrize("kind", list(SNAPSHOT_KINDS))
+def test_incremental_matches_full(book, kind):
+    conn, sids = book
+    # 期末ごとに少しずつ進めても、一度に作ったものと同じになる
+    for through in (date(2023, 9, 30), date(2024, 2, 10), date(2024, 6, 30), date(2025, 3, 31)):
+        with conn:
+            generate_snapshots(conn, through)
+    incremental = _snapshot_rows(conn, kind)
+    _assert_matches(incremental, _expected(conn, kind, sids, date(2023, 2, 1), date(2025, 3, 31)))
+
+    with conn:
+        assert generate_snapshots(conn, date(2025, 3, 31))[kind] == 0
+
+def test_backdated_transaction_needs_full(book):
+    conn, sids = book
+    with conn:
+        generate_snapshots(conn, date(2024, 12, 31))
+    before = _snapshot_rows(conn, "quarter")
+
+    # 作成済みの期（2024Q2）に遡る取引を登録する
+    _register(conn, sids[0], [("BUY", 10_000, 100.0, "2024-05-15")])
+    with conn:
+        generate_snapshots(conn, date(2025, 3, 31))
+    after = _snapshot_rows(conn, "quarter")
+    # 増分では作成済みの期は作り直さない（新しい期だけ追加され、新しい期は遡りを反映している）
+    assert {k: v for k, v in after.items() if k in before} == before
+    want = _expected(conn, "quarter", sids, date(2023, 2, 1), date(2025, 3, 31))
+    assert after[(sids[0], "2025", "Q1")] == pytest.approx(want[(sids[0], "2025", "Q1")])
+    assert before[(sids[0], "2024", "Q2")] != pytest.approx(want[(sids[0], "2024", "Q2")])
+
+    # --full で遡りを含めて作り直される
+    with conn:
+        generate_snapshots(conn, date(2025, 3, 31), full=True)
+    _assert_matches(_snapshot_rows(conn, "quarter"), want)
@@ -0,0 +1,75 @@
+# tests/test_update_moving_average.py
+import pytest
+
+import update_moving_average
+from conftest import add_security, brute_force, random_trades
+from position_ledger import CHECKPOINT_INTERVAL, moving_average, record_transaction
+from update_moving_average import update_all_moving_averages
+
+def _ledger(conn):
+    return (
+        conn.execute("SELECT transaction_id, moving_average FROM transactions ORDER BY transaction_id").fetchall(),
+        conn.execute("SELECT security_id, holding_qty, holding_cost, txn_count FROM position_state "
+                     "ORDER BY security_id").fetchall(),
+        conn.execute("SELECT * FROM position_checkpoints ORDER BY security_id, txn_count").fetchall(),
+        conn.execute("SELECT security_id, holding_qty, avg_cost FROM positions_current "
+                     "ORDER BY security_id").fetchall(),
+    )
+
+@pytest.fixture
+def filled(conn):
+    """2 銘柄 × CHECKPOINT_INTERVAL の 3 倍程度の取引を INSERT だけで登録した DB（台帳は未作成）。"""
+    for seed, code in enumerate(["1001", "1002"]):
+        sid = add_security(conn, code)
+        conn.executemany(
+            "INSERT INTO transactions (security_id, txn_type, quantity, price, txn_date) VALUES (?, ?, ?, ?, ?)",
+            [(sid, *t) for t in random_trades(seed, CHECKPOINT_INTERVAL * 3 + 7)]
+        )
+    conn.commit()
+    return conn
+
+def test_rebuild_matches_full_replay(filled, db_path):
+    stats = update_all_moving_averages(db_path, recompute_all=True, chunk_size=17)
+    assert stats["rows"] == stats["updated"] == (CHECKPOINT_INTERVAL * 3 + 7) * 2
+
+    for sid, qty, cost, count in filled.execute(
+        "SELECT security_id, holding_qty, holding_cost, txn_count FROM position_state"
+    ):
+        assert (qty, cost, count) == pytest.approx(brute_force(filled, sid))
+        # 最後の取引の moving_average は最終状態の平均単価
+        last = filled.execute(
+            "SELECT moving_average FROM transactions WHERE security_id = ? "
+            "ORDER BY txn_date DESC, transaction_id DESC LIMIT 1", (sid,)
+        ).fetchone()[0]
+        assert last == pytest.approx(moving_average(qty, cost))
+
+    counts = filled.execute(
+        "SELECT security_id, COUNT(*) FROM position_checkpoints GROUP BY security_id"
+    ).fetchall()
+    assert [c for _, c in counts] == [3, 3]
+
+def test_rebuild_matches_incremental_registration(conn, db_path):
+    sid = add_security(conn, "1001")
+    trades = sorted(random_trades(1, CHECKPOINT_INTERVAL * 2 + 3), key=lambda t: t[3])
+    for txn_type, qty, price, day in trades:
+        with conn:
+            record_transaction(conn, sid, txn_type, qty, price, day)
+    incremental = _ledger(conn)
+
+    update_all_moving_averages(db_path, recompute_all=True)
+    rebuilt = _ledger(conn)
+    assert rebuilt[2] == incremental[2]
+    for got, want in zip(rebuilt[:2] + rebuilt[3:], incremental[:2] + incremental[3:]):
+        assert got == pytest.approx(want)
+
+def test_failure_leaves_ledger_untouched(filled, db_path, monkeypatch):
+    update_all_moving_averages(db_path, recompute_all=True)
+    before = _ledger(filled)
+
+    def boom(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(update_moving_average, "upsert_positions_current", boom)
+    with pytest.raises(RuntimeError):
+        update_all_moving_averages(db_path, recompute_all=True, chunk_size=10)
+    assert _ledger(filled) == before
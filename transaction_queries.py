@@ -0,0 +1,107 @@
+# transaction_queries.py
+"""
+取引一覧ページ（売買結果一覧・取引チェック）用のクエリ。
+期間・銘柄コードの絞り込み、件数、ページングをすべて SQL 側で行い、
+表示する 1 ページ分だけを DataFrame にする。
+"""
+import sqlite3
+from collections.abc import Iterator
+from datetime import date, timedelta
+
+import pandas as pd
+
+# 1 ページに表示する件数
+PAGE_SIZE = 100
+
+# 一覧で使う列（別名 t = transactions, s = securities）
+SALE_RESULT_COLUMNS = """
+    t.txn_type,
+    t.quantity,
+    t.price,
+    t.txn_date,
+    COALESCE(s.security_code, '不明') AS security_code,
+    COALESCE(s.security_name, '不明') AS security_name
+"""
+TRANSACTION_CHECK_COLUMNS = """
+    t.*,
+    COALESCE(s.security_code, '不明') AS security_code
+"""
+
+# ─────────────────────────────
+# 1. 全体の概要・選択肢
+# ─────────────────────────────
+def _to_date(value: str | None) -> date | None:
+    return date.fromisoformat(value[:10]) if value else None
+
+def transaction_summary(conn: sqlite3.Connection) -> tuple[int, date | None, date | None]:
+    """(件数, 最古の取引日, 最新の取引日) を返す。取引が無ければ日付は None。"""
+    count, oldest, newest = conn.execute(
+        "SELECT COUNT(*), MIN(txn_date), MAX(txn_date) FROM transactions"
+    ).fetchone()
+    return count, _to_date(oldest), _to_date(newest)
+
+def security_codes(conn: sqlite3.Connection) -> list[str]:
+    """絞り込み用の銘柄コード一覧（昇順）。"""
+    rows = conn.execute("SELECT security_code FROM securities ORDER BY security_code").fetchall()
+    return [str(r[0]) for r in rows]
+
+# ─────────────────────────────
+# 2. 絞り込み条件
+# ─────────────────────────────
+def _where(start_date: date, end_date: date, code: str | None) -> tuple[str, list]:
+    # txn_date は DATE() で包まずに範囲条件にする（idx_transactions_date を使うため）
+    clause = "WHERE t.txn_date >= ? AND t.txn_date < ?"
+    params = [start_date.isoformat(), (end_date + timedelta(days=1)).isoformat()]
+    if code:
+        clause += " AND s.security_code = ?"
+        params.append(code)
+    return clause, params
+
+def count_transactions(conn: sqlite3.Connection, start_date: date, end_date: date,
+                       code: str | None = None) -> int:
+    """条件に一致する取引の件数。"""
+    where, params = _where(start_date, end_date, code)
+    return conn.execute(
+        f"""
+        SELECT COUNT(*)
+        FROM transactions t
+        LEFT JOIN securities s ON t.security_id = s.security_id
+        {where}
+        """,
+        params
+    ).fetchone()[0]
+
+def _select(columns: str, start_date: date, end_date: date, code: str | None,
+            order_by: str) -> tuple[str, list]:
+    where, params = _where(start_date, end_date, code)
+    sql = f"""
+        SELECT {columns}
+        FROM transactions t
+        LEFT JOIN securities s ON t.security_id = s.security_id
+        {where}
+        ORDER BY {order_by}
+    """
+    return sql, params
+
+def fetch_transactions(conn: sqlite3.Connection, columns: str, start_date: date, end_date: date,
+                       code: str | None = None, order_by: str = "t.txn_date DESC, t.transaction_id DESC",
+                       limit: int | None = PAGE_SIZE, offset: int = 0) -> pd.DataFrame:
+    """
+    条件に一致する取引を order_by 順に limit 件（offset から）取得する。
+    limit=None なら一致する全件を返す。
+    """
+    sql, params = _select(columns, start_date, end_date, code, order_by)
+    if limit is not None:
+        sql += " LIMIT ? OFFSET ?"
+        params += [limit, offset]
+    return pd.read_sql_query(sql, conn, params=params)
+
+def iter_transactions(conn: sqlite3.Connection, columns: str, start_date: date, end_date: date,
+                      code: str | None = None, order_by: str = "t.txn_date DESC, t.transaction_id DESC",
+                      chunk_size: int = 50_000) -> Iterator[pd.DataFrame]:
+    """
+    条件に一致する全件を chunk_size 行ずつの DataFrame で順に返す（export 用）。
+    カーソルから fetchmany するので、全件を一度にメモリへ載せない。
+    """
+    sql, params = _select(columns, start_date, end_date, code, order_by)
+    yield from pd.read_sql_query(sql, conn, params=params, chunksize=chunk_size)
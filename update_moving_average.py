@@ -1,44 +1,134 @@
-import sqlite3
+import argparse
+import time
+from itertools import groupby
+from operator import itemgetter
+
+from data_version import bump_data_version
+from db import connect
+from init_db import ensure_schema
+from position_ledger import (
+    CHECKPOINT_INTERVAL,
+    moving_average,
+    replay_events,
+    upsert_positions_current,
+)
 
 DB_PATH = "app.db"
 
-def update_all_moving_averages():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+# 1 回の executemany でまとめる件数
+CHUNK_SIZE = 5000
+
+def update_all_moving_averages(db_path=DB_PATH, recompute_all=False, chunk_size=CHUNK_SIZE):
+    """
+    transactions を (security_id, txn_date, transaction_id) 順に 1 回だけ走査し、
+    全銘柄の moving_average を計算して chunk_size 件ずつ executemany で書き戻す。
+    position_state / position_checkpoints / positions_current の保有数・単価も同じ走査で作り直す。
 
-    # 全銘柄IDを取得
-    c.execute("SELECT security_id FROM securities")
-    security_ids = [row[0] for row in c.fetchall()]
+    走査は読み取り専用の別接続（WAL のスナップショット）で行い、チェックポイントの削除から
+    書き戻しまでを 1 トランザクションにまとめる（途中で失敗しても元の状態のまま残る）。
 
-    for sid in security_ids:
-        # 取引履歴を取引日・transaction_id順で取得
-        c.execute(
-            "SELECT transaction_id, txn_type, quantity, price FROM transactions WHERE security_id=? ORDER BY txn_date, transaction_id",
-            (sid,)
+    recompute_all=False のときは moving_average が NULL / 0 の行だけを更新する。
+    戻り値は {"rows": 走査件数, "updated": 更新件数, "seconds": 経過秒} の辞書。
+    """
+    started = time.perf_counter()
+    conn = connect(db_path)
+    ensure_schema(conn)
+    reader = connect(db_path, readonly=True)
+
+    def stream():
+        read = reader.execute(
+            """
+            SELECT transaction_id, txn_date, txn_type, quantity, price, moving_average, security_id
+            FROM transactions
+            ORDER BY security_id, txn_date, transaction_id
+            """
+        )
+        while batch := read.fetchmany(chunk_size):
+            yield from batch
+
+    updates, checkpoints, states = [], [], []
+    rows_seen = updated = 0
+
+    def flush():
+        conn.executemany(
+            "UPDATE transactions SET moving_average=? WHERE transaction_id=?", updates
+        )
+        conn.executemany(
+            """
+            INSERT INTO position_checkpoints
+                (security_id, txn_count, txn_date, transaction_id, holding_qty, holding_cost)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            checkpoints
         )
-        rows = c.fetchall()
-        holding_qty = 0.0
-        holding_cost = 0.0
-        for transaction_id, txn_type, qty, price in rows:
-            if txn_type == "BUY":
-                holding_cost += qty * price
-                holding_qty += qty
-            elif txn_type == "SEL":
-                if holding_qty > 0:
-                    avg = holding_cost / holding_qty if holding_qty > 0 else 0
-                    sell_qty = min(qty, holding_qty)
-                    holding_cost -= avg * sell_qty
-                    holding_qty -= sell_qty
-            moving_average = holding_cost / holding_qty if holding_qty > 0 else 0
-
-            # moving_averageがNULLの場合のみ更新
-            c.execute(
-                "UPDATE transactions SET moving_average=? WHERE transaction_id=? AND (moving_average IS NULL OR moving_average=0)",
-                (moving_average, transaction_id)
-            )
-    conn.commit()
-    conn.close()
+        conn.executemany(
+            """
+            INSERT INTO position_state
+                (security_id, holding_qty, holding_cost, txn_count,
+                 last_txn_date, last_transaction_id, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(security_id) DO UPDATE SET
+                holding_qty         = excluded.holding_qty,
+                holding_cost        = excluded.holding_cost,
+                txn_count           = excluded.txn_count,
+                last_txn_date       = excluded.last_txn_date,
+                last_transaction_id = excluded.last_transaction_id,
+                updated_at          = excluded.updated_at;
+            """,
+            states
+        )
+        upsert_positions_current(conn, [(sid, qty, cost) for sid, qty, cost, *_ in states])
+        updates.clear()
+        checkpoints.clear()
+        states.clear()
+
+    try:
+        # 書き込みロックを先に取ってから読み始める（走査中に他の書き込みが割り込まない）
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM position_checkpoints")
+
+        # 銘柄ごとに先頭から再生し、最終状態を position_state に確定
+        for sid, rows in groupby(stream(), key=itemgetter(6)):
+            for (transaction_id, txn_date, _, _, _, stored, _), holding_qty, holding_cost, txn_count in replay_events(rows):
+                rows_seen += 1
+                if txn_count % CHECKPOINT_INTERVAL == 0:
+                    checkpoints.append((sid, txn_count, txn_date, transaction_id, holding_qty, holding_cost))
+
+                # --recompute-all でなければ moving_average が NULL / 0 の行のみ更新
+                if recompute_all or not stored:
+                    updates.append((moving_average(holding_qty, holding_cost), transaction_id))
+                    updated += 1
+                if len(updates) >= chunk_size:
+                    flush()
+            states.append((sid, holding_qty, holding_cost, txn_count, txn_date, transaction_id))
+
+        flush()
+        bump_data_version(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        reader.close()
+        conn.close()
+
+    return {
+        "rows": rows_seen,
+        "updated": updated,
+        "seconds": time.perf_counter() - started,
+    }
 
 if __name__ == "__main__":
-    update_all_moving_averages()
-    print("全ての移動平均を更新しました。")
+    parser = argparse.ArgumentParser(description="transactions.moving_average を一括更新する")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite ファイルのパス")
+    parser.add_argument("--recompute-all", action="store_true",
+                        help="NULL / 0 の行だけでなく全行を再計算する")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="1 回の executemany で書き戻す件数")
+    args = parser.parse_args()
+
+    stats = update_all_moving_averages(args.db, args.recompute_all, args.chunk_size)
+    rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0
+    print(f"全ての移動平均を更新しました。"
+          f"（走査 {stats['rows']:,} 件 / 更新 {stats['updated']:,} 件 / "
+          f"{stats['seconds']:.2f} 秒 / {rate:,.0f} rows/s）")